@@ -4,7 +4,7 @@
 #  - listfolder
 #  - upload a file
 #  - download it in a zip
-#  - perform checksums
+#  - perform checksums (hashing the file while it is uploaded)
 
 import hashlib
 import os
@@ -15,12 +15,12 @@ from pprint import pprint as pp
 import sys
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
 from pcloudapi import PCloudBinaryConnection
+from pcloudapi.checksums import HashingReader, verify_checksums
 
 def fill_file(f):
     data = b'abcdef\n' * 100000
     f.write(data)
     f.seek(0, os.SEEK_SET)
-    return hashlib.sha1(data).hexdigest()
 
 def main():
     try:
@@ -40,14 +40,16 @@ def main():
 
         filename = "test_" + os.path.basename(tmpfile1.name)
         print("Uploading to : " + filename)
-        checksum = fill_file(tmpfile1.file)
+        fill_file(tmpfile1.file)
+        data = HashingReader(tmpfile1.file)
         res = api.send_command('uploadfile',
                             path=TEST_DIR,
                             filename=filename,
-                            _data=tmpfile1.file)
+                            _data=data)
         pp(res)
         assert res['result'] == 0
-        assert res['checksums'][0]['sha1'].lower() == checksum
+        verify_checksums(data.digests, res['checksums'][0], filename)
+        checksum = data.hexdigests()['sha1']
         fileid = res['fileids'][0]
         print()
 
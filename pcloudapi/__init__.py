@@ -1,8 +1,30 @@
 from .pcloudbin import PCloudBinaryConnection
+from .pipeline import PCloudPipeline
+from .pool import PCloudConnectionPool
 from .pcloudjson import PCloudJSONConnection
 from .pcloudapi import PCloudAPI, PCloudException
+from .cache import PCloudMetadataCache
+from .mirror import PCloudMirror
+from .hashcache import PCloudHashCache
+from .contentindex import PCloudContentIndex
+from .remotefile import PCloudRemoteFile
+from .subscription import PCloudSubscription
+from .retry import PCloudRetryPolicy
+from .endpoints import PCloudEndpointSelector
+from .metrics import PCloudInstrumentation, CompositeInstrumentation, \
+    PCloudMetrics, PCloudTracing
+from .utils import PCloudTransport
+from .pcloudasync import AsyncPCloudAPI, AsyncPCloudBinaryConnection
 
 __version__ = '0.0.1'
 
 __all__ = ['PCloudAPI', 'PCloudException',
-           'PCloudBinaryConnection', 'PCloudJSONConnection']
+           'PCloudBinaryConnection', 'PCloudJSONConnection',
+           'PCloudPipeline', 'PCloudConnectionPool',
+           'AsyncPCloudAPI', 'AsyncPCloudBinaryConnection',
+           'PCloudMetadataCache', 'PCloudMirror', 'PCloudSubscription',
+           'PCloudHashCache', 'PCloudContentIndex',
+           'PCloudRemoteFile', 'PCloudTransport', 'PCloudRetryPolicy',
+           'PCloudEndpointSelector',
+           'PCloudInstrumentation', 'CompositeInstrumentation',
+           'PCloudMetrics', 'PCloudTracing']
@@ -0,0 +1,234 @@
+/*
+ * C implementation of pcloudapi.decoder.decode_python.
+ *
+ * Decodes a whole binary protocol response frame using an explicit stack
+ * for the nested hashes and lists.
+ */
+
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+
+typedef struct {
+    PyObject *container;    /* dict or list, owned */
+    PyObject *key;          /* pending dict key, owned, NULL if none */
+} level_t;
+
+static unsigned long long
+read_le(const unsigned char *p, Py_ssize_t size)
+{
+    unsigned long long value = 0;
+    Py_ssize_t i;
+
+    for (i = size - 1; i >= 0; i--)
+        value = (value << 8) | p[i];
+    return value;
+}
+
+static PyObject *
+malformed(Py_ssize_t pos)
+{
+    PyErr_Format(PyExc_ValueError, "Malformed response at offset %zd", pos);
+    return NULL;
+}
+
+static PyObject *
+decode(PyObject *module, PyObject *frame)
+{
+    Py_buffer view;
+    const unsigned char *buf;
+    Py_ssize_t end, pos = 0, depth = 0, capacity = 16;
+    level_t *stack = NULL;
+    PyObject *strings = NULL, *value = NULL, *result = NULL;
+
+    if (PyObject_GetBuffer(frame, &view, PyBUF_SIMPLE) < 0)
+        return NULL;
+    buf = (const unsigned char *)view.buf;
+    end = view.len;
+
+    strings = PyList_New(0);
+    stack = PyMem_Malloc(capacity * sizeof(level_t));
+    if (strings == NULL || stack == NULL) {
+        PyErr_NoMemory();
+        goto error;
+    }
+
+    for (;;) {
+        unsigned int obj_type;
+        Py_ssize_t size;
+        unsigned long long number;
+
+        if (pos >= end) {
+            malformed(pos);
+            goto error;
+        }
+        obj_type = buf[pos++];
+
+        if (obj_type <= 3 || (obj_type >= 100 && obj_type <= 149)) {
+            /* new string */
+            if (obj_type <= 3) {
+                size = obj_type + 1;
+                if (pos + size > end) {
+                    malformed(pos);
+                    goto error;
+                }
+                number = read_le(buf + pos, size);
+                pos += size;
+            }
+            else {
+                number = obj_type - 100;
+            }
+            if (number > (unsigned long long)(end - pos)) {
+                malformed(pos);
+                goto error;
+            }
+            value = PyUnicode_DecodeUTF8((const char *)buf + pos,
+                                         (Py_ssize_t)number, NULL);
+            if (value == NULL || PyList_Append(strings, value) < 0)
+                goto error;
+            pos += (Py_ssize_t)number;
+        }
+        else if ((obj_type >= 4 && obj_type <= 7) ||
+                 (obj_type >= 150 && obj_type <= 199)) {
+            /* existing string */
+            if (obj_type <= 7) {
+                size = obj_type - 3;
+                if (pos + size > end) {
+                    malformed(pos);
+                    goto error;
+                }
+                number = read_le(buf + pos, size);
+                pos += size;
+            }
+            else {
+                number = obj_type - 150;
+            }
+            if (number >= (unsigned long long)PyList_GET_SIZE(strings)) {
+                malformed(pos);
+                goto error;
+            }
+            value = PyList_GET_ITEM(strings, (Py_ssize_t)number);
+            Py_INCREF(value);
+        }
+        else if ((obj_type >= 8 && obj_type <= 15) || obj_type == 20) {
+            /* int or data length */
+            size = obj_type == 20 ? 8 : obj_type - 7;
+            if (pos + size > end) {
+                malformed(pos);
+                goto error;
+            }
+            value = PyLong_FromUnsignedLongLong(read_le(buf + pos, size));
+            if (value == NULL)
+                goto error;
+            pos += size;
+        }
+        else if (obj_type >= 200 && obj_type <= 219) {
+            value = PyLong_FromLong(obj_type - 200);
+            if (value == NULL)
+                goto error;
+        }
+        else if (obj_type == 18 || obj_type == 19) {
+            value = PyBool_FromLong(obj_type == 19);
+        }
+        else if (obj_type == 16 || obj_type == 17) {
+            /* hash or list */
+            PyObject *container = obj_type == 16 ? PyDict_New() : PyList_New(0);
+
+            if (container == NULL)
+                goto error;
+            if (depth == capacity) {
+                level_t *grown = PyMem_Realloc(stack,
+                                               2 * capacity * sizeof(level_t));
+                if (grown == NULL) {
+                    Py_DECREF(container);
+                    PyErr_NoMemory();
+                    goto error;
+                }
+                stack = grown;
+                capacity *= 2;
+            }
+            stack[depth].container = container;
+            stack[depth].key = NULL;
+            depth++;
+            continue;
+        }
+        else if (obj_type == 255) {
+            if (depth == 0 || stack[depth - 1].key != NULL) {
+                PyErr_SetString(PyExc_ValueError,
+                                "Unexpected end of hash or list");
+                goto error;
+            }
+            depth--;
+            value = stack[depth].container;
+        }
+        else {
+            PyErr_Format(PyExc_ValueError, "Unknown value returned: %u",
+                         obj_type);
+            goto error;
+        }
+
+        /* store value in the enclosing container */
+        if (depth == 0) {
+            result = value;
+            value = NULL;
+            break;
+        }
+        else {
+            level_t *top = &stack[depth - 1];
+
+            if (PyList_CheckExact(top->container)) {
+                if (PyList_Append(top->container, value) < 0)
+                    goto error;
+                Py_CLEAR(value);
+            }
+            else if (top->key == NULL) {
+                top->key = value;
+                value = NULL;
+            }
+            else {
+                if (PyDict_SetItem(top->container, top->key, value) < 0)
+                    goto error;
+                Py_CLEAR(top->key);
+                Py_CLEAR(value);
+            }
+        }
+    }
+
+    Py_DECREF(strings);
+    PyMem_Free(stack);
+    PyBuffer_Release(&view);
+    return result;
+
+error:
+    Py_XDECREF(value);
+    Py_XDECREF(strings);
+    if (stack != NULL) {
+        while (depth > 0) {
+            depth--;
+            Py_DECREF(stack[depth].container);
+            Py_XDECREF(stack[depth].key);
+        }
+        PyMem_Free(stack);
+    }
+    PyBuffer_Release(&view);
+    return NULL;
+}
+
+static PyMethodDef speedups_methods[] = {
+    {"decode", decode, METH_O,
+     "Decodes a response frame, see pcloudapi.decoder.decode_python."},
+    {NULL, NULL, 0, NULL}
+};
+
+static struct PyModuleDef speedups_module = {
+    PyModuleDef_HEAD_INIT,
+    "pcloudapi._speedups",
+    "Optional C accelerators for pcloudapi.",
+    -1,
+    speedups_methods
+};
+
+PyMODINIT_FUNC
+PyInit__speedups(void)
+{
+    return PyModule_Create(&speedups_module);
+}
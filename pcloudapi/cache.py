@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+
+import collections
+import re
+import threading
+import time
+
+# methods whose response metadata describes the given path
+_READ_METHODS = frozenset("""
+    listfolder stat checksumfile createfolder createfolderifnotexists
+    """.split())
+
+# methods removing what path/fileid/folderid refer to
+_DELETE_METHODS = frozenset("""
+    deletefile deletefolder deletefolderrecursive
+    """.split())
+
+# methods moving what path/fileid/folderid refer to, to topath
+_RENAME_METHODS = frozenset("""
+    renamefile renamefolder
+    """.split())
+
+# methods modifying the file open as fd
+_WRITE_METHODS = frozenset("""
+    file_write file_pwrite file_truncate
+    """.split())
+
+# file_open flag of the fds that can be written
+_O_WRITE = 0x0002
+
+# result codes meaning that path does not exist (anymore)
+_NOT_FOUND_RESULTS = frozenset([2002, 2005, 2009])
+
+# methods whose path is a folder, something may be cached below it
+_FOLDER_METHODS = frozenset("""
+    listfolder createfolder createfolderifnotexists deletefolder
+    deletefolderrecursive renamefolder
+    """.split())
+
+
+def normalize_path(path):
+    """Returns path with a single leading slash and no trailing slashes."""
+    return '/' + re.sub('/+', '/', path).strip('/')
+
+
+def _strip(metadata):
+    """Metadata without the (potentially huge) contents of folders."""
+    if 'contents' in metadata:
+        metadata = dict(metadata)
+        del metadata['contents']
+    return metadata
+
+
+class PCloudMetadataCache(object):
+    """LRU cache with expiration of the metadata of remote paths.
+
+    PCloudAPI feeds it with every response (see .observe), so
+    it learns paths from listings and mutating calls and forgets the
+    paths that are deleted or renamed, and the files written through
+    file descriptors (when opened, written and closed). It is thread-safe.
+
+    NOTE: fds are told apart by number only, with a pool of connections
+        a write may forget a file opened on another connection as well.
+
+    :ivar hits: number of successful lookups
+    :ivar misses: number of failed lookups
+    """
+
+    def __init__(self, max_size=100000, ttl=300, clock=time.monotonic):
+        """Initializes the cache.
+
+        :param max_size: maximum number of paths kept
+        :param ttl: seconds a path is kept, None keeps it until evicted
+        :param clock: callable returning the current time in seconds
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict() # path -> (expires, metadata)
+        self._ids = {} # metadata 'id' (e.g. d12, f34) -> path
+        self._write_fds = {} # fd open for writing -> fileid
+
+    def get(self, path):
+        """Returns the cached metadata of path or None."""
+        path = normalize_path(path)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None:
+                if entry[0] is None or entry[0] > self.clock():
+                    self._entries.move_to_end(path)
+                    self.hits += 1
+                    return entry[1]
+                self._remove(path)
+            self.misses += 1
+            return None
+
+    def put(self, path, metadata):
+        """Stores the metadata of path (without folder contents)."""
+        path = normalize_path(path)
+        metadata = _strip(metadata)
+        expires = None if self.ttl is None else self.clock() + self.ttl
+        with self._lock:
+            self._remove(path)
+            self._entries[path] = (expires, metadata)
+            if 'id' in metadata:
+                self._ids[metadata['id']] = path
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, path):
+        """Call locked."""
+        entry = self._entries.pop(path, None)
+        if entry is not None:
+            item_id = entry[1].get('id')
+            if self._ids.get(item_id) == path:
+                del self._ids[item_id]
+
+    def invalidate(self, path, recursive=False):
+        """Forgets path and if recursive everything below it."""
+        path = normalize_path(path)
+        with self._lock:
+            self._remove(path)
+            if recursive:
+                prefix = path.rstrip('/') + '/'
+                for cached_path in [p for p in self._entries
+                                    if p.startswith(prefix)]:
+                    self._remove(cached_path)
+
+    def path_of(self, fileid=None, folderid=None):
+        """Returns the cached path of fileid or folderid or None."""
+        with self._lock:
+            if fileid is not None:
+                return self._ids.get('f{0}'.format(fileid))
+            if folderid is not None:
+                return self._ids.get('d{0}'.format(folderid))
+            return None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._ids.clear()
+            self._write_fds.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """Returns dict with hits, misses and size."""
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self)}
+
+    def _is_folder(self, path):
+        """Returns True if path is cached as a folder (expired or not)."""
+        with self._lock:
+            entry = self._entries.get(normalize_path(path))
+            return entry is not None and bool(entry[1].get('isfolder'))
+
+    def _target_path(self, params):
+        if 'path' in params:
+            return params['path']
+        return self.path_of(fileid=params.get('fileid'),
+                            folderid=params.get('folderid'))
+
+    def _invalidate_file(self, fileid):
+        path = self.path_of(fileid=fileid)
+        if path is not None:
+            self.invalidate(path)
+
+    def _observe_fd(self, method, params, response):
+        """Forgets the files modified through fds."""
+        if method == 'file_open':
+            if not params.get('flags', 0) & _O_WRITE:
+                return
+            path = self._target_path(params)
+            if path is not None:
+                self.invalidate(path) # e.g. truncated by O_TRUNC
+            fileid = response.get('fileid')
+            if 'fd' in response and fileid is not None:
+                with self._lock:
+                    self._write_fds[response['fd']] = fileid
+            return
+        with self._lock:
+            if method == 'file_close':
+                fileid = self._write_fds.pop(params.get('fd'), None)
+            else:
+                fileid = self._write_fds.get(params.get('fd'))
+        if fileid is not None:
+            self._invalidate_file(fileid)
+
+    def observe(self, method, params, response):
+        """Updates the cache from the response of an api call."""
+        if method in _WRITE_METHODS or method in ('file_open', 'file_close'):
+            # also after failures, the file may be partially written
+            self._observe_fd(method, params, response)
+            return
+
+        result = response.get('result')
+        if result != 0:
+            if result in _NOT_FOUND_RESULTS and 'path' in params:
+                # only a folder can have something cached below it, a
+                # missing file does not need the whole cache scanned
+                path = params['path']
+                self.invalidate(path, recursive=method in _FOLDER_METHODS or
+                                                self._is_folder(path))
+            return
+
+        if method in _DELETE_METHODS or method in _RENAME_METHODS:
+            path = self._target_path(params)
+            if path is not None:
+                self.invalidate(path, recursive=method != 'deletefile')
+            elif method != 'deletefile' and method != 'renamefile':
+                # unknown folder, its descendants can not be found
+                self.clear()
+            topath = params.get('topath')
+            if (method in _RENAME_METHODS and topath and
+                    not topath.endswith('/') and 'metadata' in response):
+                self.put(topath, response['metadata'])
+            return
+
+        if method == 'copyfile':
+            topath = params.get('topath')
+            if topath and not topath.endswith('/') and 'metadata' in response:
+                self.put(topath, response['metadata'])
+            return
+
+        if method in ('uploadfile', 'upload_save'):
+            folder = params.get('path')
+            if folder is None:
+                return
+            metadata = response.get('metadata')
+            if isinstance(metadata, dict):
+                metadata = [metadata]
+            for item in metadata or []:
+                self.put(normalize_path(folder) + '/' + item['name'], item)
+            return
+
+        if method in _READ_METHODS:
+            metadata = response.get('metadata')
+            path = params.get('path')
+            if metadata is None or path is None:
+                return
+            self.put(path, metadata)
+            if method == 'listfolder' and not params.get('recursive'):
+                parent = normalize_path(path).rstrip('/')
+                for item in metadata.get('contents', []):
+                    self.put(parent + '/' + item['name'], item)
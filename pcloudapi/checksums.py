@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+import hashlib
+import io
+
+from .exceptions import PCloudException
+
+# pcloud reports sha1 everywhere, sha256 in the EU (md5 in the US)
+ALGORITHMS = ('sha1', 'sha256')
+
+
+def new_digests(algorithms=ALGORITHMS):
+    """Returns a dict algorithm -> new hashlib object."""
+    return {algorithm: hashlib.new(algorithm) for algorithm in algorithms}
+
+
+def checksums_match(digests, checksums):
+    """Returns True if the hex digests match the checksums reported by
+    pcloud (in all the algorithms of both), False if they do not or
+    there is nothing to compare.
+    """
+    common = [algorithm for algorithm in digests if algorithm in checksums]
+    return bool(common) and all(
+                digests[algorithm].lower() == checksums[algorithm].lower()
+                for algorithm in common)
+
+
+def verify_checksums(digests, checksums, name):
+    """Compares digests with the checksums reported by pcloud.
+
+    :param digests: dict algorithm -> hashlib object (or hex digest)
+    :param checksums: dict algorithm -> hex digest, e.g. a checksumfile
+        response or an item of the 'checksums' of uploadfile
+    :param name: what was hashed, for the error message
+    :raises PCloudException if a digest differs or none can be compared
+    """
+    compared = False
+    for algorithm, digest in digests.items():
+        expected = checksums.get(algorithm)
+        if expected is None:
+            continue
+        if not isinstance(digest, str):
+            digest = digest.hexdigest()
+        if digest.lower() != expected.lower():
+            raise PCloudException("{0} does not match the {1} reported by pcloud"
+                                  .format(name, algorithm))
+        compared = True
+    if not compared:
+        raise PCloudException("No checksum of {0} to compare with".format(name))
+
+
+class HashingReader(io.IOBase):
+    """Binary file wrapper hashing the bytes as they are read.
+
+    Connections send it like the wrapped file, so the data is hashed
+    while it is uploaded instead of in a separate pass:
+
+        data = HashingReader(open(path, 'rb'))
+        response = api.make_request('uploadfile', _data=data, ...)
+        verify_checksums(data.digests, response['checksums'][0], path)
+
+    NOTE: seek only before reading (e.g. to determine the size),
+        the digests are of the bytes read.
+    """
+
+    def __init__(self, fp, algorithms=ALGORITHMS):
+        self.fp = fp
+        self.digests = new_digests(algorithms)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return self.fp.seekable()
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        return self.fp.seek(offset, whence)
+
+    def tell(self):
+        return self.fp.tell()
+
+    def read(self, size=-1):
+        data = self.fp.read(size)
+        for digest in self.digests.values():
+            digest.update(data)
+        return data
+
+    def hexdigests(self):
+        """Returns dict algorithm -> hex digest of the bytes read so far."""
+        return {algorithm: digest.hexdigest()
+                for algorithm, digest in self.digests.items()}
@@ -37,6 +37,14 @@ class AbstractPCloudConnection(metaclass=abc.ABCMeta):
         else:
             self.persistent_params.pop('auth', None)
 
+    def reconnect(self):
+        """Reestablishes the connection after a failure, returns self.
+
+        Connections recovering by themselves (e.g. reopening sockets on
+        demand) have nothing to do.
+        """
+        return self
+
     def close(self):
         """Perform any cleanup operation"""
         pass
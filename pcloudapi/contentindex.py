@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+
+import sqlite3
+import threading
+
+from .checksums import ALGORITHMS
+
+_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS content (
+        algorithm TEXT NOT NULL,
+        digest TEXT NOT NULL,       -- lowercase hex
+        fileid INTEGER NOT NULL,
+        size INTEGER NOT NULL,
+        PRIMARY KEY (algorithm, digest, fileid)
+    );
+    CREATE INDEX IF NOT EXISTS content_fileid ON content (fileid);
+"""
+
+
+class PCloudContentIndex(object):
+    """Index of the remote files by the checksums of their content.
+
+    It learns the checksums from checksumfile and uploadfile responses
+    and the copies made by copyfile (PCloudAPI feeds it with every
+    response, see .observe) or from .build, and forgets deleted files.
+    PCloudAPI.upload uses it to copy a remote file with the same content
+    (copyfile) instead of sending the data, after checking the checksums
+    of the file are still the indexed ones. It is thread-safe.
+
+    NOTE: files modified in place (e.g. file_pwrite) must be indexed again.
+    """
+
+    def __init__(self, db_path=':memory:', algorithms=ALGORITHMS):
+        """Opens (or creates) the index.
+
+        :param db_path: SQLite database, by default the index is in memory
+        :param algorithms: the checksums indexed
+        """
+        self.db_path = db_path
+        self.algorithms = tuple(algorithms)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        with self._db:
+            self._db.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def add(self, fileid, size, checksums):
+        """Indexes a file, replacing what was indexed for fileid.
+
+        :param checksums: dict algorithm -> hex digest, e.g. a checksumfile
+            response
+        """
+        rows = [(algorithm, checksums[algorithm].lower(), fileid, size)
+                for algorithm in self.algorithms if algorithm in checksums]
+        with self._lock, self._db:
+            # the old digests of a file modified in place
+            self._db.execute("DELETE FROM content WHERE fileid = ?", (fileid,))
+            self._db.executemany(
+                    "INSERT OR REPLACE INTO content VALUES (?, ?, ?, ?)",
+                    rows)
+
+    def copy(self, fileid, copy_fileid):
+        """Indexes copy_fileid with the content of fileid (if indexed)."""
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM content WHERE fileid = ?",
+                             (copy_fileid,))
+            self._db.execute(
+                    "INSERT OR REPLACE INTO content"
+                    " SELECT algorithm, digest, ?, size FROM content"
+                    " WHERE fileid = ?", (copy_fileid, fileid))
+
+    def remove(self, fileid):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM content WHERE fileid = ?", (fileid,))
+
+    def lookup(self, digests, size):
+        """Returns the fileids of the files with the given content.
+
+        A file matches when its size and all its indexed digests (in the
+        algorithms of digests) are equal.
+        NOTE: the files may have changed since they were indexed, check
+            them (checksumfile) before trusting their content.
+        :param digests: dict algorithm -> hex digest of the content
+        """
+        digests = {algorithm: digest.lower()
+                   for algorithm, digest in digests.items()}
+        result = []
+        with self._lock:
+            candidates = set()
+            for algorithm, digest in digests.items():
+                candidates.update(row[0] for row in self._db.execute(
+                                "SELECT fileid FROM content WHERE algorithm = ?"
+                                " AND digest = ? AND size = ?",
+                                (algorithm, digest, size)))
+            for fileid in sorted(candidates):
+                rows = self._db.execute(
+                            "SELECT algorithm, digest FROM content"
+                            " WHERE fileid = ?", (fileid,))
+                if all(digests.get(algorithm, digest) == digest
+                       for algorithm, digest in rows):
+                    result.append(fileid)
+        return result
+
+    def __contains__(self, fileid):
+        with self._lock:
+            return self._db.execute(
+                        "SELECT 1 FROM content WHERE fileid = ? LIMIT 1",
+                        (fileid,)).fetchone() is not None
+
+    def __len__(self):
+        """Number of indexed files."""
+        with self._lock:
+            return self._db.execute(
+                        "SELECT COUNT(DISTINCT fileid) FROM content"
+                    ).fetchone()[0]
+
+    def observe(self, method, params, response):
+        """Updates the index from the response of an api call."""
+        if response.get('result') != 0:
+            if response.get('result') == 2009 and 'fileid' in params:
+                self.remove(params['fileid'])
+            return
+        if method == 'checksumfile':
+            metadata = response['metadata']
+            self.add(metadata['fileid'], metadata['size'], response)
+        elif method == 'uploadfile':
+            for metadata, checksums in zip(response.get('metadata', []),
+                                           response.get('checksums', [])):
+                self.add(metadata['fileid'], metadata['size'], checksums)
+        elif method == 'copyfile':
+            metadata = response.get('metadata')
+            if metadata and 'fileid' in metadata and 'fileid' in params:
+                self.copy(params['fileid'], metadata['fileid'])
+        elif method == 'deletefile':
+            metadata = response.get('metadata')
+            if metadata and 'fileid' in metadata:
+                self.remove(metadata['fileid'])
+
+    def build(self, api, path='/'):
+        """Indexes the files under path that are not indexed yet.
+
+        Lists path recursively and requests the checksums of the new files
+        in a pipeline (when the connection supports it).
+        :returns number of files indexed
+        """
+        if hasattr(api.connection, 'iter_listfolder'):
+            entries = api.iter_listfolder(path=path, recursive=1)
+        else:
+            stack = [api.make_request('listfolder',
+                                      path=path,
+                                      recursive=1)['metadata']]
+            entries = []
+            while stack:
+                metadata = stack.pop()
+                stack.extend(metadata.get('contents', ()))
+                entries.append(metadata)
+        fileids = [entry['fileid'] for entry in entries
+                   if not entry.get('isfolder') and entry['fileid'] not in self]
+
+        if hasattr(api.connection, 'pipeline'):
+            with api.connection.pipeline(
+                        check_result=False,
+                        instrumentation=api.instrumentation) as pipeline:
+                responses = pipeline.map('checksumfile',
+                                         ({'fileid': fileid}
+                                          for fileid in fileids))
+                for fileid, response in zip(fileids, responses):
+                    self.observe('checksumfile', {'fileid': fileid}, response)
+        else:
+            for fileid in fileids:
+                self.observe('checksumfile', {'fileid': fileid},
+                             api.make_request('checksumfile',
+                                              check_result=False,
+                                              fileid=fileid))
+        return len(fileids)
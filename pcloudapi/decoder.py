@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+"""Decoder of binary protocol responses.
+
+A response is decoded from a whole frame (see the length prefix) using
+a memoryview, a dispatch table on the type byte and an explicit stack
+for the nested hashes and lists, so deep trees (listfolder recursive=1)
+can not overflow the interpreter stack.
+
+The C implementation from the optional _speedups extension is used when
+available, otherwise the pure python one.
+"""
+
+from .exceptions import PCloudException
+
+# type byte -> kind of the object
+_NEW_STRING, _NEW_SHORT_STRING, _OLD_STRING, _OLD_SHORT_STRING, _INT, \
+    _SHORT_INT, _HASH, _LIST, _FALSE, _TRUE, _DATA, _END = range(12)
+
+_KINDS = [None] * 256
+for _type in range(0, 4):
+    _KINDS[_type] = _NEW_STRING         # length in the next type+1 bytes
+for _type in range(4, 8):
+    _KINDS[_type] = _OLD_STRING         # index in the next type-3 bytes
+for _type in range(8, 16):
+    _KINDS[_type] = _INT                # int in the next type-7 bytes
+_KINDS[16] = _HASH
+_KINDS[17] = _LIST
+_KINDS[18] = _FALSE
+_KINDS[19] = _TRUE
+_KINDS[20] = _DATA                      # data length in the next 8 bytes
+for _type in range(100, 150):
+    _KINDS[_type] = _NEW_SHORT_STRING   # length is type-100
+for _type in range(150, 200):
+    _KINDS[_type] = _OLD_SHORT_STRING   # index is type-150
+for _type in range(200, 220):
+    _KINDS[_type] = _SHORT_INT          # int is type-200
+_KINDS[255] = _END
+del _type
+
+_NO_KEY = object()
+
+_EMITTED = object()
+
+# state of an open container in iter_events
+_IN_LIST, _IN_HASH_KEY, _IN_HASH_VALUE = range(3)
+
+# kinds of open containers in iter_folder_entries
+_RESPONSE, _ENTRY, _CONTENTS, _OTHER = range(4)
+
+
+def decode_python(frame):
+    """Decodes a response frame, pure python implementation.
+
+    :param frame: bytes-like object holding exactly one response
+    :raises ValueError on malformed response
+    """
+    buf = memoryview(frame)
+    end = len(buf)
+    from_bytes = int.from_bytes
+    kinds = _KINDS
+    strings = []
+    stack = [] # [container, pending key] for each open hash or list
+    pos = 0
+    try:
+        while True:
+            obj_type = buf[pos]
+            pos += 1
+            kind = kinds[obj_type]
+
+            if kind == _NEW_SHORT_STRING or kind == _NEW_STRING:
+                if kind == _NEW_STRING:
+                    str_len = from_bytes(buf[pos:pos + obj_type + 1], 'little')
+                    pos += obj_type + 1
+                else:
+                    str_len = obj_type - 100
+                if pos + str_len > end:
+                    raise IndexError
+                value = str(buf[pos:pos + str_len], 'utf-8')
+                pos += str_len
+                strings.append(value)
+            elif kind == _OLD_SHORT_STRING:
+                value = strings[obj_type - 150]
+            elif kind == _SHORT_INT:
+                value = obj_type - 200
+            elif kind == _HASH:
+                stack.append([{}, _NO_KEY])
+                continue
+            elif kind == _LIST:
+                stack.append([[], _NO_KEY])
+                continue
+            elif kind == _END:
+                if not stack or stack[-1][1] is not _NO_KEY:
+                    raise ValueError("Unexpected end of hash or list")
+                value = stack.pop()[0]
+            elif kind == _INT or kind == _OLD_STRING:
+                size = obj_type - (7 if kind == _INT else 3)
+                if pos + size > end:
+                    raise IndexError
+                value = from_bytes(buf[pos:pos + size], 'little')
+                pos += size
+                if kind == _OLD_STRING:
+                    value = strings[value]
+            elif kind == _FALSE:
+                value = False
+            elif kind == _TRUE:
+                value = True
+            elif kind == _DATA:
+                # data, return data_length
+                # be sure to consume the data
+                if pos + 8 > end:
+                    raise IndexError
+                value = from_bytes(buf[pos:pos + 8], 'little')
+                pos += 8
+            else:
+                raise ValueError("Unknown value returned: {0}".format(obj_type))
+
+            if not stack:
+                return value
+            top = stack[-1]
+            container = top[0]
+            if container.__class__ is list:
+                container.append(value)
+            elif top[1] is _NO_KEY:
+                top[1] = value
+            else:
+                container[top[1]] = value
+                top[1] = _NO_KEY
+    except IndexError:
+        # truncated frame or unknown string index
+        raise ValueError("Malformed response at offset {0}".format(pos))
+    finally:
+        buf.release()
+
+
+try:
+    from ._speedups import decode
+except ImportError:
+    decode = decode_python
+
+
+def iter_events(read, frame_len, chunk_size=65536):
+    """Decodes a response incrementally, yields parse events.
+
+    Events are (event, value) tuples, where event is one of 'start_map',
+    'map_key', 'end_map', 'start_array', 'end_array' and 'value'.
+
+    NOTE: memory is bounded by the distinct strings in the response (the
+        protocol may refer back to any of them), not by its structure.
+    NOTE: the whole frame is consumed even if the generator is not
+        exhausted, as long as it is closed (or garbage collected).
+
+    :param read: callable(size) returning exactly size bytes
+    :param frame_len: length of the response, see the length prefix
+    :param chunk_size: how many bytes to read at once
+    """
+    from_bytes = int.from_bytes
+    kinds = _KINDS
+    strings = []
+    states = [] # _IN_LIST, _IN_HASH_KEY or _IN_HASH_VALUE per open container
+    remaining = frame_len
+    buf = b''
+    pos = 0
+
+    def fill(size):
+        """Ensures buf[pos:pos + size] is available."""
+        nonlocal buf, pos, remaining
+        missing = size - (len(buf) - pos)
+        if missing > remaining:
+            raise ValueError("Malformed response, truncated")
+        to_read = min(remaining, max(missing, chunk_size))
+        try:
+            data = read(to_read)
+        except:
+            remaining = 0 # the stream is broken, do not try to drain it
+            raise
+        buf = buf[pos:] + data
+        pos = 0
+        remaining -= to_read
+
+    try:
+        while True:
+            if pos >= len(buf):
+                fill(1)
+            obj_type = buf[pos]
+            pos += 1
+            kind = kinds[obj_type]
+
+            if kind == _END:
+                if not states or states[-1] == _IN_HASH_VALUE:
+                    raise ValueError("Unexpected end of hash or list")
+                state = states.pop()
+                yield ('end_array' if state == _IN_LIST else 'end_map', None)
+                if not states:
+                    return
+                continue
+            if kind == _HASH or kind == _LIST:
+                if states:
+                    if states[-1] == _IN_HASH_KEY:
+                        raise ValueError("Unexpected hash or list as a key")
+                    if states[-1] == _IN_HASH_VALUE:
+                        states[-1] = _IN_HASH_KEY
+                if kind == _HASH:
+                    states.append(_IN_HASH_KEY)
+                    yield ('start_map', None)
+                else:
+                    states.append(_IN_LIST)
+                    yield ('start_array', None)
+                continue
+
+            if kind == _NEW_SHORT_STRING or kind == _NEW_STRING:
+                if kind == _NEW_STRING:
+                    if pos + obj_type + 1 > len(buf):
+                        fill(obj_type + 1)
+                    str_len = from_bytes(buf[pos:pos + obj_type + 1], 'little')
+                    pos += obj_type + 1
+                else:
+                    str_len = obj_type - 100
+                if pos + str_len > len(buf):
+                    fill(str_len)
+                value = buf[pos:pos + str_len].decode('utf-8')
+                pos += str_len
+                strings.append(value)
+            elif kind == _OLD_SHORT_STRING:
+                value = strings[obj_type - 150]
+            elif kind == _SHORT_INT:
+                value = obj_type - 200
+            elif kind == _INT or kind == _OLD_STRING or kind == _DATA:
+                size = (8 if kind == _DATA else
+                        obj_type - (7 if kind == _INT else 3))
+                if pos + size > len(buf):
+                    fill(size)
+                value = from_bytes(buf[pos:pos + size], 'little')
+                pos += size
+                if kind == _OLD_STRING:
+                    value = strings[value]
+            elif kind == _FALSE:
+                value = False
+            elif kind == _TRUE:
+                value = True
+            else:
+                raise ValueError("Unknown value returned: {0}".format(obj_type))
+
+            if not states:
+                yield ('value', value)
+                return
+            if states[-1] == _IN_HASH_KEY:
+                states[-1] = _IN_HASH_VALUE
+                yield ('map_key', value)
+            else:
+                if states[-1] == _IN_HASH_VALUE:
+                    states[-1] = _IN_HASH_KEY
+                yield ('value', value)
+    except IndexError:
+        raise ValueError("Malformed response, unknown string index")
+    finally:
+        # keep the stream in sync
+        while remaining > 0:
+            to_read = min(remaining, chunk_size)
+            read(to_read)
+            remaining -= to_read
+
+
+def _entry_path(fields, parentpath, root_path):
+    if parentpath is None:
+        if 'path' in fields:
+            return fields['path']
+        if root_path is not None:
+            return root_path
+        return '/' if fields.get('folderid') == 0 else None
+    return parentpath.rstrip('/') + '/' + fields.get('name', '')
+
+
+def iter_folder_entries(events, root_path=None):
+    """Flattens the events of a listfolder response into metadata entries.
+
+    Yields the metadata of the listed folder and of everything in its
+    contents (recursively with recursive=1) as soon as it is decoded, as
+    dicts without 'contents' and with 'parentpath' and 'path' added
+    (None if unknown). Parents are yielded before their contents, as
+    pcloud sends 'contents' after the other fields of a folder.
+
+    :param events: events from iter_events
+    :param root_path: path of the listed folder, if it was given by path
+    :raises PCloudException if the result is not 0
+    """
+    # [kind, container, key, parentpath] for each open container,
+    # parentpath of an _ENTRY becomes _EMITTED once it is yielded
+    stack = []
+    response = None
+    for event, value in events:
+        if event == 'map_key':
+            stack[-1][2] = value
+            continue
+
+        if event == 'start_map' or event == 'start_array':
+            if not stack:
+                stack.append([_RESPONSE, {}, None, None])
+                continue
+            top = stack[-1]
+            if event == 'start_map' and (
+                    top[0] == _CONTENTS or
+                    (top[0] == _RESPONSE and top[2] == 'metadata')):
+                stack.append([_ENTRY, {}, None, top[3]])
+            elif (event == 'start_array' and
+                    top[0] == _ENTRY and top[2] == 'contents'):
+                fields = top[1]
+                path = _entry_path(fields, top[3], root_path)
+                yield dict(fields, parentpath=top[3], path=path)
+                top[2] = None
+                top[3] = _EMITTED
+                stack.append([_CONTENTS, None, None, path])
+            else:
+                container = {} if event == 'start_map' else []
+                stack.append([_OTHER, container, None, None])
+            continue
+
+        if event == 'end_map' or event == 'end_array':
+            kind, value, _, parentpath = stack.pop()
+            if kind == _ENTRY:
+                if parentpath is not _EMITTED:
+                    yield dict(value,
+                               parentpath=parentpath,
+                               path=_entry_path(value, parentpath, root_path))
+                continue
+            if kind == _CONTENTS:
+                continue
+            if kind == _RESPONSE:
+                response = value
+                continue
+
+        # event is 'value' or a finished _OTHER container
+        top = stack[-1]
+        container = top[1]
+        if container.__class__ is list:
+            container.append(value)
+        elif top[0] != _CONTENTS:
+            container[top[2]] = value
+
+    if response is None or response.get('result') != 0:
+        raise PCloudException(result_code=response and response.get('result'))
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+
+import collections
+import contextlib
+import hashlib
+import os
+
+from .checksums import new_digests, verify_checksums
+from .exceptions import PCloudException
+from .pool import PCloudConnectionPool
+
+BLOCK_SIZE = 1024 * 1024
+
+# file_open flags
+O_WRITE = 0x0002
+O_CREAT = 0x0040
+
+
+class PCloudDeltaUploader(object):
+    """Updates a remote file by rewriting only the blocks that differ.
+
+    The remote file is opened with file_open, the sha1 of each block is
+    requested with file_checksum and compared with the local block, then
+    only the differing blocks (and what the local file has past the end
+    of the remote one) are written with file_pwrite, and the remote file
+    is truncated if the local one is shorter. The commands are pipelined
+    over a single binary connection (borrowed when the api uses a
+    PCloudConnectionPool). A missing remote file is created. The commands
+    bypass PCloudAPI.make_request, so the file is forgotten by the cache
+    and the content index of the api once it is updated.
+
+    NOTE: the remote file is modified in place, an interrupted update
+        leaves it partially updated (running the update again fixes it).
+    """
+
+    def __init__(self, api, local_path, remote_path,
+                 block_size=BLOCK_SIZE, max_in_flight=32,
+                 progress_callback=None, verify=True):
+        """Initializes the uploader.
+
+        :param api: PCloudAPI using a binary connection (or a pool of them)
+        :param block_size: size of the compared and written blocks
+        :param max_in_flight: commands pipelined without waiting for replies
+        :param progress_callback: called each time with the number of bytes
+            written, once the write is acknowledged
+        :param verify: compare the whole remote file (checksumfile) with the
+            local one, hashed while it is read for the comparison
+        """
+        self.api = api
+        self.local_path = local_path
+        self.remote_path = remote_path
+        self.block_size = block_size
+        self.max_in_flight = max_in_flight
+        self.progress_callback = progress_callback
+        self.verify = verify
+
+    def _borrow(self):
+        connection = self.api.connection
+        if isinstance(connection, PCloudConnectionPool):
+            return connection.connection()
+        return contextlib.nullcontext(connection)
+
+    @staticmethod
+    def _command(connection, method, **params):
+        response = connection.send_command(method, **params)
+        if response.get('result') != 0:
+            raise PCloudException(result_code=response.get('result'))
+        return response
+
+    def upload(self):
+        """Updates the remote file.
+
+        :returns dict with the 'size' of the file, the number of 'blocks'
+            compared, how many of them were 'changed' and the bytes 'written'
+        """
+        with self._borrow() as connection:
+            response = self._command(connection, 'file_open',
+                                     flags=O_WRITE | O_CREAT,
+                                     path=self.remote_path)
+            fd = response['fd']
+            try:
+                try:
+                    summary, digests = self._update(connection, fd)
+                except:
+                    try:
+                        self._command(connection, 'file_close', fd=fd)
+                    except (PCloudException, IOError):
+                        pass # broken connection, the fd is closed with it
+                    raise
+                self._command(connection, 'file_close', fd=fd)
+            finally:
+                # even partially updated, what is known of it is stale
+                self._forget(response.get('fileid'))
+
+        if self.verify:
+            checksums = self.api.make_request('checksumfile',
+                                              path=self.remote_path)
+            verify_checksums(digests, checksums, self.remote_path)
+        return summary
+
+    def _forget(self, fileid):
+        cache = getattr(self.api, 'cache', None)
+        if cache is not None:
+            cache.invalidate(self.remote_path)
+        content_index = getattr(self.api, 'content_index', None)
+        if content_index is not None and fileid is not None:
+            content_index.remove(fileid)
+
+    def _update(self, connection, fd):
+        remote_size = self._command(connection, 'file_size', fd=fd)['size']
+        block_size = self.block_size
+        digests = list(new_digests().values()) if self.verify else []
+        changed = []
+        futures = collections.deque() # (future, bytes written)
+        written = 0
+
+        def acknowledged(wait=False):
+            """Reports the progress of the writes answered."""
+            while futures and (wait or futures[0][0].done()):
+                future, size = futures.popleft()
+                future.result() # raises if a write failed
+                if size and self.progress_callback:
+                    self.progress_callback(size)
+
+        with open(self.local_path, 'rb') as f, \
+                connection.pipeline(
+                        max_in_flight=self.max_in_flight,
+                        check_result=True,
+                        instrumentation=getattr(self.api, 'instrumentation',
+                                                None)) as pipeline:
+            local_size = os.fstat(f.fileno()).st_size
+            common = min(local_size, remote_size)
+
+            offsets = range(0, common, block_size)
+            checksums = pipeline.map('file_checksum',
+                                     ({'fd': fd,
+                                       'offset': offset,
+                                       'count': min(block_size, common - offset)}
+                                      for offset in offsets))
+            for offset, response in zip(offsets, checksums):
+                block = f.read(min(block_size, common - offset))
+                for digest in digests:
+                    digest.update(block)
+                if hashlib.sha1(block).hexdigest() != response['sha1'].lower():
+                    changed.append(offset)
+
+            def write(offset, data):
+                nonlocal written
+                futures.append((pipeline.submit('file_pwrite',
+                                                fd=fd,
+                                                offset=offset,
+                                                _data=data),
+                                len(data)))
+                written += len(data)
+                acknowledged()
+
+            for offset in changed:
+                f.seek(offset)
+                write(offset, f.read(min(block_size, common - offset)))
+            f.seek(common)
+            for offset in range(common, local_size, block_size):
+                block = f.read(block_size)
+                for digest in digests:
+                    digest.update(block)
+                write(offset, block)
+            if local_size < remote_size:
+                futures.append((pipeline.submit('file_truncate',
+                                                fd=fd,
+                                                length=local_size),
+                                0))
+        acknowledged(wait=True)
+
+        summary = {'size': local_size,
+                   'blocks': len(offsets),
+                   'changed': len(changed),
+                   'written': written}
+        return summary, {digest.name: digest for digest in digests}
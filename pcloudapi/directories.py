@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+
+import asyncio
+import threading
+
+from .cache import normalize_path
+from .exceptions import PCloudException
+
+# methods after which remembered folders may not exist anymore
+_FORGET_METHODS = frozenset("""
+    deletefolder deletefolderrecursive renamefolder
+    """.split())
+
+
+class _PendingFolder(object):
+    """A folder being created by another thread."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.error = None
+
+
+class PCloudDirectories(object):
+    """Ensures remote directories exist (mkdir -p), thread-safe.
+
+    Remembers the folders known to exist and creates only the missing
+    ones, top-down with createfolderifnotexists from the deepest folder
+    known to exist (remembered or cached). Concurrent requests for
+    the same folder wait for a single createfolderifnotexists, so each
+    folder is created once per PCloudDirectories (i.e. per PCloudAPI).
+    A folder is forgotten when it is removed through the api or a command
+    on it answers that it does not exist (2005).
+    """
+
+    def __init__(self, api):
+        self.api = api
+        self._lock = threading.Lock()
+        self._existing = set(['/'])
+        self._pending = {} # path -> _PendingFolder
+
+    def _exists(self, path):
+        if path in self._existing:
+            return True
+        cache = getattr(self.api, 'cache', None)
+        if cache is not None:
+            metadata = cache.get(path)
+            if metadata is not None and metadata.get('isfolder'):
+                return True
+        return False
+
+    def ensure(self, path):
+        """Creates path and its missing parents."""
+        path = normalize_path(path)
+        try:
+            self._ensure(path, trust_known=True)
+        except PCloudException as e:
+            if e.result_code != 2002:
+                raise
+            # a remembered parent was removed meanwhile, recreate all levels
+            self._ensure(path, trust_known=False)
+
+    def _missing_levels(self, path, trust_known):
+        """Returns the levels of path to create, top-down.
+
+        Without trust_known all the levels are forgotten and returned.
+        """
+        levels = []
+        while path != '/' and not (trust_known and self._exists(path)):
+            levels.append(path)
+            path = path.rsplit('/', 1)[0] or '/'
+        if not trust_known:
+            with self._lock:
+                self._existing.difference_update(levels)
+        levels.reverse()
+        return levels
+
+    def _ensure(self, path, trust_known):
+        for level in self._missing_levels(path, trust_known):
+            self._create(level)
+
+    def _create(self, path):
+        with self._lock:
+            if path in self._existing:
+                return
+            pending = self._pending.get(path)
+            owner = pending is None
+            if owner:
+                pending = self._pending[path] = _PendingFolder()
+
+        if not owner:
+            pending.done.wait()
+            if pending.error is not None:
+                raise pending.error
+            return
+
+        try:
+            self.api.make_request('createfolderifnotexists', path=path)
+        except BaseException as e:
+            pending.error = e
+            raise
+        else:
+            with self._lock:
+                self._existing.add(path)
+        finally:
+            with self._lock:
+                del self._pending[path]
+            pending.done.set()
+
+    def forget(self, path=None):
+        """Forgets path and everything below it, or everything if None."""
+        with self._lock:
+            if path is None:
+                self._existing = set(['/'])
+                return
+            path = normalize_path(path)
+            prefix = path.rstrip('/') + '/'
+            self._existing = set(p for p in self._existing
+                                 if p != path and not p.startswith(prefix))
+            self._existing.add('/')
+
+    def observe(self, method, params, response):
+        """Forgets the folders possibly removed by an api call, or found
+        missing by one.
+        """
+        if method in _FORGET_METHODS:
+            self.forget(params.get('path'))
+        elif response.get('result') == 2005 and 'path' in params:
+            # removed behind our back (e.g. by another client)
+            self.forget(params['path'])
+
+
+class AsyncPCloudDirectories(PCloudDirectories):
+    """asyncio counterpart of PCloudDirectories (for AsyncPCloudAPI).
+
+    The same folders are created the same way, concurrent tasks wait for
+    a single createfolderifnotexists per folder.
+    """
+
+    async def ensure(self, path):
+        """Creates path and its missing parents."""
+        path = normalize_path(path)
+        try:
+            await self._ensure(path, trust_known=True)
+        except PCloudException as e:
+            if e.result_code != 2002:
+                raise
+            # a remembered parent was removed meanwhile, recreate all levels
+            await self._ensure(path, trust_known=False)
+
+    async def _ensure(self, path, trust_known):
+        for level in self._missing_levels(path, trust_known):
+            await self._create(level)
+
+    async def _create(self, path):
+        with self._lock:
+            if path in self._existing:
+                return
+            pending = self._pending.get(path)
+            owner = pending is None
+            if owner:
+                pending = self._pending[path] = \
+                        asyncio.get_running_loop().create_future()
+
+        if not owner:
+            # the waiters are cancelled alone, not the creation
+            await asyncio.shield(pending)
+            return
+
+        try:
+            await self.api.make_request('createfolderifnotexists', path=path)
+        except asyncio.CancelledError:
+            pending.cancel()
+            raise
+        except BaseException as e:
+            pending.set_exception(e)
+            pending.exception() # retrieved, there may be no waiters
+            raise
+        else:
+            with self._lock:
+                self._existing.add(path)
+            pending.set_result(None)
+        finally:
+            with self._lock:
+                del self._pending[path]
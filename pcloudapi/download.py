@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+CHUNK_SIZE = 65536
+RANGE_SIZE = 16 * 1024 * 1024
+CHECKPOINT_SUFFIX = '.pcloudpart'
+
+_CONTENT_RANGE_RE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+
+def pwrite(fd, data, offset, lock=None):
+    """Writes data at offset of the file descriptor fd.
+
+    Uses os.pwrite when available, otherwise seek + write under lock.
+    """
+    if hasattr(os, 'pwrite'):
+        view = memoryview(data)
+        while view:
+            written = os.pwrite(fd, view, offset)
+            view = view[written:]
+            offset += written
+    else:
+        with lock:
+            os.lseek(fd, offset, os.SEEK_SET)
+            view = memoryview(data)
+            while view:
+                view = view[os.write(fd, view):]
+
+
+class PCloudRangeDownloader(object):
+    """Downloads a file as byte ranges fetched concurrently.
+
+    The ranges are spread over all the given urls (the hosts returned by
+    getfilelink) and written in place with positional writes. A failed
+    range is retried on the next url from where it stopped. If the server
+    does not support ranges the file is downloaded as a single stream.
+
+    With checkpoint_path the progress of each range is saved in a small
+    json file (after fsync-ing the data), so an interrupted download can
+    be resumed by running a downloader with the same checkpoint_path and
+    identity. The checkpoint is removed once the download is complete.
+    """
+
+    def __init__(self, urls, local_path,
+                 connections=4, range_size=RANGE_SIZE, retries=3,
+                 timeout=30, progress_callback=None,
+                 checkpoint_path=None, identity=None,
+                 checkpoint_interval=1.0,
+                 refresh_urls=None):
+        """Initializes the downloader.
+
+        :param urls: urls of the same file, ranges are spread over them
+        :param connections: number of ranges downloaded concurrently
+        :param range_size: size of each range in bytes
+        :param retries: how many times a range is retried
+        :param progress_callback: called each time with the number of bytes
+            written in the iteration (from multiple threads, serialized)
+        :param checkpoint_path: where to save the progress, None disables it
+        :param identity: json serializable identity of the remote file
+            (e.g. its hash), a checkpoint of another identity is ignored
+        :param checkpoint_interval: seconds between checkpoint saves
+        :param refresh_urls: callable returning new urls, called when
+            the urls are rejected (e.g. the download link expired)
+        """
+        if not urls:
+            raise ValueError("No urls to download from")
+        self.urls = list(urls)
+        self.local_path = local_path
+        self.connections = connections
+        self.range_size = range_size
+        self.retries = retries
+        self.timeout = timeout
+        self.progress_callback = progress_callback
+        self.checkpoint_path = checkpoint_path
+        self.identity = identity
+        self.checkpoint_interval = checkpoint_interval
+        self.refresh_urls = refresh_urls
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._checkpoint_lock = threading.Lock()
+        self._ranges = None # [start, end, offset reached]
+        self._size = None
+        self._fd = None
+        self._saved_at = 0
+
+    def _session(self):
+        """requests.Session is not thread-safe, one per thread."""
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def _progress(self, size):
+        if self.progress_callback:
+            with self._lock:
+                self.progress_callback(size)
+
+    def _get(self, url, start, end):
+        r = self._session().get(url,
+                                headers={'Range': 'bytes={0}-{1}'.format(
+                                                            start, end - 1)},
+                                stream=True,
+                                allow_redirects=False,
+                                timeout=self.timeout)
+        r.raise_for_status()
+        return r
+
+    def _load_checkpoint(self):
+        """Returns the saved ranges if the checkpoint matches, else None."""
+        if not self.checkpoint_path or not os.path.exists(self.local_path):
+            return None
+        try:
+            with open(self.checkpoint_path) as f:
+                checkpoint = json.load(f)
+        except (IOError, ValueError):
+            return None
+        if (checkpoint.get('identity') != self.identity or
+                os.path.getsize(self.local_path) != checkpoint.get('size')):
+            return None
+        return checkpoint['size'], checkpoint['ranges']
+
+    def _save_checkpoint(self, force=False):
+        if not self.checkpoint_path:
+            return
+        now = time.monotonic()
+        if not force and now - self._saved_at < self.checkpoint_interval:
+            return
+        if not self._checkpoint_lock.acquire(force):
+            return # another thread is saving
+        try:
+            self._saved_at = now
+            with self._lock:
+                ranges = [list(r) for r in self._ranges]
+            # the data must be on disk before the checkpoint claiming it
+            os.fsync(self._fd)
+            tmp_path = self.checkpoint_path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump({'identity': self.identity,
+                           'size': self._size,
+                           'ranges': ranges}, f)
+            os.replace(tmp_path, self.checkpoint_path)
+        finally:
+            self._checkpoint_lock.release()
+
+    def _refresh(self, rejected_urls):
+        """Replaces the urls if they were rejected, returns True if done."""
+        if self.refresh_urls is None:
+            return False
+        with self._lock:
+            if self.urls is not rejected_urls:
+                return True # already refreshed by another thread
+            self.urls = list(self.refresh_urls())
+        return True
+
+    def download(self):
+        """Downloads the file, returns its size."""
+        first = None
+        saved = self._load_checkpoint()
+        if saved is not None:
+            self._size, self._ranges = saved
+            flags = os.O_WRONLY
+        else:
+            try:
+                first = self._get(self.urls[0], 0, self.range_size)
+            except requests.HTTPError as e:
+                if e.response is None or e.response.status_code != 416:
+                    raise
+                first = e.response # empty file
+            match = _CONTENT_RANGE_RE.match(
+                            first.headers.get('Content-Range', ''))
+            if first.status_code != 206 or not match or match.group(1) != '0':
+                # ranges are not supported
+                first.close()
+                return self._download_single()
+            self._size = int(match.group(3))
+            self._ranges = [[start, min(start + self.range_size, self._size),
+                             start]
+                            for start in range(0, self._size, self.range_size)]
+            flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC
+
+        self._fd = os.open(self.local_path,
+                           flags | getattr(os, 'O_BINARY', 0),
+                           0o666)
+        try:
+            os.ftruncate(self._fd, self._size)
+            self._save_checkpoint(force=True)
+            with ThreadPoolExecutor(self.connections) as executor:
+                futures = [executor.submit(self._fetch_range, i,
+                                           first if i == 0 else None)
+                           for i, (_, end, offset) in enumerate(self._ranges)
+                           if offset < end]
+                try:
+                    for future in futures:
+                        future.result()
+                except:
+                    # no need to wait for the rest
+                    for future in futures:
+                        future.cancel()
+                    raise
+        except:
+            if self.checkpoint_path:
+                self._save_checkpoint(force=True)
+            raise
+        finally:
+            os.close(self._fd)
+            self._fd = None
+        if self.checkpoint_path and os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+        return self._size
+
+    def _fetch_range(self, index, response=None):
+        """Downloads a range, a retry continues where the last one failed."""
+        current_range = self._ranges[index]
+        start, end, offset = current_range
+        for attempt in range(self.retries + 1):
+            urls = self.urls
+            url = urls[(index + attempt) % len(urls)]
+            try:
+                if response is None:
+                    response = self._get(url, offset, end)
+                match = _CONTENT_RANGE_RE.match(
+                                response.headers.get('Content-Range', ''))
+                if (response.status_code != 206 or not match
+                        or int(match.group(1)) != offset):
+                    raise IOError("Expected partial content from {0}, got {1}"
+                                  .format(url, response.status_code))
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    if offset + len(chunk) > end:
+                        raise IOError("Received more data than requested")
+                    pwrite(self._fd, chunk, offset, self._lock)
+                    offset += len(chunk)
+                    current_range[2] = offset
+                    self._progress(len(chunk))
+                    self._save_checkpoint()
+                if offset != end:
+                    raise IOError("Range {0}-{1} incomplete, got {2} bytes"
+                                  .format(start, end, offset - start))
+                return
+            except requests.HTTPError as e:
+                if attempt == self.retries:
+                    raise
+                if (e.response is not None and
+                        400 <= e.response.status_code < 500):
+                    # most likely an expired link, refreshed if possible,
+                    # otherwise the next url is tried like on other errors
+                    self._refresh(urls)
+            except (requests.RequestException, IOError):
+                if attempt == self.retries:
+                    raise
+            finally:
+                if response is not None:
+                    response.close()
+                response = None
+
+    def _download_single(self):
+        r = self._session().get(self.urls[0],
+                                stream=True,
+                                allow_redirects=False,
+                                timeout=self.timeout)
+        r.raise_for_status()
+        size = 0
+        with open(self.local_path, 'wb') as f:
+            for chunk in r.iter_content(CHUNK_SIZE):
+                size += f.write(chunk)
+                self._progress(len(chunk))
+        return size
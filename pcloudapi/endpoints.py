@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from .pcloudbin import PCloudBinaryConnection
+from .utils import create_connection
+
+
+def connect_probe(port, use_ssl=True, timeout=5, transport=None):
+    """Returns a probe measuring the time to connect to a host
+    (including the TLS handshake).
+    """
+    def probe(host):
+        started = time.monotonic()
+        sock = create_connection(host, port, timeout, use_ssl, transport)
+        elapsed = time.monotonic() - started
+        sock.close()
+        return elapsed
+    return probe
+
+
+def binapi_probe(port=None, use_ssl=True, timeout=5, transport=None):
+    """Returns a probe measuring the time to connect to a binary api
+    server and get the response of currentserver (time to first byte).
+    """
+    def probe(host):
+        started = time.monotonic()
+        connection = PCloudBinaryConnection(use_ssl=use_ssl, server=host,
+                                            port=port, timeout=timeout,
+                                            transport=transport).connect()
+        try:
+            connection.send_command('currentserver')
+        finally:
+            connection.close()
+        return time.monotonic() - started
+    return probe
+
+
+def http_probe(path='/', use_ssl=True, port=None, timeout=5):
+    """Returns a probe measuring the time to the response headers of
+    a HEAD request to a (download) host. Any HTTP status counts as alive.
+    """
+    protocol = use_ssl and 'https' or 'http'
+    port = port or (use_ssl and 443 or 80)
+
+    def probe(host):
+        url = "{0}://{1}:{2}{3}".format(protocol, host, port, path)
+        started = time.monotonic()
+        requests.head(url, allow_redirects=False, timeout=timeout).close()
+        return time.monotonic() - started
+    return probe
+
+
+class PCloudEndpointSelector(object):
+    """Ranks hosts serving the same thing by their measured latency.
+
+    The hosts are measured with probe(host) -> seconds (raising if the
+    host is unreachable), concurrently, and the measurements are cached
+    for ttl seconds (failures for failure_ttl), so ranking known hosts
+    costs nothing until they expire. Failures reported by the users of
+    the hosts (.report_failure) move a host to the end of the ranking,
+    so the following connections and downloads fail over to the next.
+
+        selector = PCloudEndpointSelector(binapi_probe())
+        servers = api.api_servers()
+        pool = PCloudConnectionPool(server=servers, endpoints=selector)
+
+    It is thread-safe.
+    """
+
+    def __init__(self, probe, ttl=600, failure_ttl=60, max_workers=8):
+        """Initializes the selector.
+
+        :param probe: callable(host) returning the latency in seconds,
+            see connect_probe, binapi_probe and http_probe
+        :param ttl: seconds a measurement is trusted
+        :param failure_ttl: seconds a failed host stays last
+        :param max_workers: hosts probed concurrently
+        """
+        self.probe = probe
+        self.ttl = ttl
+        self.failure_ttl = failure_ttl
+        self.max_workers = max_workers
+        self._lock = threading.Lock()
+        self._latencies = {} # host -> (seconds or None if failed, expires)
+
+    def _measure(self, host):
+        try:
+            latency = self.probe(host)
+        except (IOError, ValueError):
+            latency = None
+        self._record(host, latency)
+
+    def _record(self, host, latency):
+        ttl = self.failure_ttl if latency is None else self.ttl
+        with self._lock:
+            self._latencies[host] = (latency, time.monotonic() + ttl)
+
+    def rank(self, hosts):
+        """Returns the hosts, fastest first and failed ones last.
+
+        Hosts without a valid measurement are probed first.
+        """
+        hosts = list(hosts)
+        now = time.monotonic()
+        with self._lock:
+            expired = [host for host in hosts
+                       if self._latencies.get(host, (None, 0))[1] <= now]
+        if len(expired) == 1:
+            self._measure(expired[0])
+        elif expired:
+            with ThreadPoolExecutor(min(len(expired),
+                                        self.max_workers)) as executor:
+                list(executor.map(self._measure, expired))
+
+        with self._lock:
+            latencies = {host: self._latencies.get(host, (None, 0))[0]
+                         for host in hosts}
+        # stable, equally fast hosts keep their order
+        return sorted(hosts, key=lambda host: (latencies[host] is None,
+                                               latencies[host] or 0))
+
+    def best(self, hosts):
+        """Returns the fastest healthy host (or the first if none is)."""
+        return self.rank(hosts)[0]
+
+    def latency(self, host):
+        """Returns the last measured latency of host, None if unknown
+        or failed.
+        """
+        with self._lock:
+            return self._latencies.get(host, (None, 0))[0]
+
+    def report_failure(self, host):
+        """Marks host as failed until failure_ttl passes."""
+        self._record(host, None)
+
+    def forget(self, host=None):
+        """Drops the measurements of host (all if None)."""
+        with self._lock:
+            if host is None:
+                self._latencies.clear()
+            else:
+                self._latencies.pop(host, None)
+
+    def connect(self, hosts, connect):
+        """Calls connect(host) on the ranked hosts until one succeeds.
+
+        The hosts failing with IOError are reported as failed.
+        :returns (host, result of connect)
+        :raises the error of the last host
+        """
+        if not hosts:
+            raise ValueError("No hosts to connect to")
+        error = None
+        for host in self.rank(hosts):
+            try:
+                return host, connect(host)
+            except IOError as e:
+                error = e
+                self.report_failure(host)
+        raise error
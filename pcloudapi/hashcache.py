@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import sqlite3
+import threading
+
+from .checksums import ALGORITHMS, new_digests
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS hashes (
+        dev INTEGER NOT NULL,
+        inode INTEGER NOT NULL,
+        size INTEGER NOT NULL,
+        mtime_ns INTEGER NOT NULL,
+        digests TEXT NOT NULL,      -- json, algorithm -> hex digest
+        PRIMARY KEY (dev, inode, size, mtime_ns)
+    );
+"""
+
+
+def stat_signature(st):
+    """Returns (device, inode, size, mtime_ns) of an os.stat_result."""
+    return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+def hash_file(path, algorithms=ALGORITHMS):
+    """Returns dict algorithm -> hex digest of the file, in a single pass."""
+    digests = new_digests(algorithms)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            for digest in digests.values():
+                digest.update(chunk)
+    return {algorithm: digest.hexdigest()
+            for algorithm, digest in digests.items()}
+
+
+class PCloudHashCache(object):
+    """Persistent cache of the digests of local files.
+
+    The digests are kept in an SQLite database by the stat signature of
+    the file (device, inode, size, mtime_ns), so a file is hashed again
+    only when it changes. See PCloudAPI.upload and
+    PCloudAPI.changed_files for skipping the upload of unchanged files.
+    It is thread-safe.
+    """
+
+    def __init__(self, db_path, algorithms=ALGORITHMS):
+        """Opens (or creates) the database.
+
+        :param algorithms: the hashlib algorithms computed for each file
+        """
+        self.db_path = db_path
+        self.algorithms = tuple(algorithms)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        with self._db:
+            self._db.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def get(self, signature):
+        """Returns the cached digests for the stat signature or None."""
+        with self._lock:
+            row = self._db.execute(
+                        "SELECT digests FROM hashes WHERE dev = ? AND inode = ?"
+                        " AND size = ? AND mtime_ns = ?",
+                        signature).fetchone()
+        if row is None:
+            return None
+        digests = json.loads(row[0])
+        if any(algorithm not in digests for algorithm in self.algorithms):
+            return None
+        return digests
+
+    def put(self, signature, digests):
+        """Stores digests, replacing older versions of the same file."""
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM hashes WHERE dev = ? AND inode = ?",
+                             signature[:2])
+            self._db.execute("INSERT INTO hashes VALUES (?, ?, ?, ?, ?)",
+                             tuple(signature) + (json.dumps(digests),))
+
+    def digests(self, path):
+        """Returns dict algorithm -> hex digest of the file at path.
+
+        The file is hashed only if its stat signature is not cached.
+        """
+        signature = stat_signature(os.stat(path))
+        digests = self.get(signature)
+        if digests is None:
+            digests = hash_file(path, self.algorithms)
+            # do not cache digests of a file modified while hashing
+            if stat_signature(os.stat(path)) == signature:
+                self.put(signature, digests)
+        return digests
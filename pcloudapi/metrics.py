@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+
+import bisect
+import threading
+import time
+
+try:
+    from opentelemetry.trace import Status, StatusCode
+except ImportError:
+    Status = StatusCode = None
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = tuple(4 ** exponent for exponent in range(4, 16)) # 256B..1GiB
+
+
+class PCloudInstrumentation(object):
+    """Hooks called by the api and the connections, doing nothing.
+
+    Override the hooks of interest and pass the instance to PCloudAPI
+    (requests and retries) and to the binary connection or the pool
+    (frames and data):
+
+        metrics = PCloudMetrics()
+        pool = PCloudConnectionPool(instrumentation=metrics)
+        api = PCloudAPI(connection=pool, instrumentation=metrics)
+
+    Without instrumentation (the default) nothing is measured. The hooks
+    are called from the threads doing the work, they must be thread-safe
+    and fast.
+    """
+
+    def on_request(self, method, seconds, result=None, error=None):
+        """A make_request finished (with retries), result is the result
+        code of the response or None if it raised error.
+        """
+
+    def on_retry(self, method, attempt, error=None, response=None):
+        """A command is about to be retried, see PCloudRetryPolicy."""
+
+    def on_frame(self, direction, size, method=None):
+        """A frame of size bytes was 'sent' (a request of method) or
+        'received' (a response).
+        """
+
+    def on_data(self, direction, size, seconds):
+        """size bytes of data were 'sent' (uploaded with a command),
+        'received' (following a response) or 'downloaded' (download)
+        in seconds.
+        """
+
+
+class CompositeInstrumentation(PCloudInstrumentation):
+    """Calls the hooks of several instrumentations."""
+
+    def __init__(self, *instrumentations):
+        self.instrumentations = instrumentations
+
+    def on_request(self, *args, **kwargs):
+        for instrumentation in self.instrumentations:
+            instrumentation.on_request(*args, **kwargs)
+
+    def on_retry(self, *args, **kwargs):
+        for instrumentation in self.instrumentations:
+            instrumentation.on_retry(*args, **kwargs)
+
+    def on_frame(self, *args, **kwargs):
+        for instrumentation in self.instrumentations:
+            instrumentation.on_frame(*args, **kwargs)
+
+    def on_data(self, *args, **kwargs):
+        for instrumentation in self.instrumentations:
+            instrumentation.on_data(*args, **kwargs)
+
+
+def _reason(error, response):
+    if error is not None:
+        return type(error).__name__
+    return str(response.get('result'))
+
+
+class _Histogram(object):
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # the last is +Inf
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class PCloudMetrics(PCloudInstrumentation):
+    """Registry of metrics, exported in the Prometheus text format.
+
+     - request_duration_seconds{method} histogram of make_request
+     - requests_total{method, result} by result code (or exception name)
+     - retries_total{method, reason} by result code (or exception name)
+     - frame_bytes{direction} histogram of the request/response frames
+     - data_bytes_total{direction}, data_seconds_total{direction} of the
+       data transferred, .throughput(direction) is their ratio
+
+    It is thread-safe.
+    """
+
+    HELP = {
+        'request_duration_seconds': "Duration of the api requests",
+        'requests_total': "Api requests by result",
+        'retries_total': "Retried commands by reason",
+        'frame_bytes': "Size of the binary protocol frames",
+        'data_bytes_total': "Bytes of data transferred",
+        'data_seconds_total': "Seconds spent transferring data",
+    }
+
+    def __init__(self, prefix='pcloud', latency_buckets=LATENCY_BUCKETS,
+                 size_buckets=SIZE_BUCKETS):
+        """
+        :param prefix: of the exported metric names
+        """
+        self.prefix = prefix
+        self.latency_buckets = tuple(latency_buckets)
+        self.size_buckets = tuple(size_buckets)
+        self._lock = threading.Lock()
+        self._counters = {} # (name, labels) -> value
+        self._histograms = {} # (name, labels) -> _Histogram
+
+    def _inc(self, name, labels, value=1):
+        key = (name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def _observe(self, name, labels, value, buckets):
+        key = (name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = _Histogram(buckets)
+            histogram.observe(value)
+
+    def on_request(self, method, seconds, result=None, error=None):
+        self._observe('request_duration_seconds', (('method', method),),
+                      seconds, self.latency_buckets)
+        result = type(error).__name__ if error is not None else str(result)
+        self._inc('requests_total', (('method', method), ('result', result)))
+
+    def on_retry(self, method, attempt, error=None, response=None):
+        self._inc('retries_total', (('method', method),
+                                    ('reason', _reason(error, response))))
+
+    def on_frame(self, direction, size, method=None):
+        self._observe('frame_bytes', (('direction', direction),),
+                      size, self.size_buckets)
+
+    def on_data(self, direction, size, seconds):
+        labels = (('direction', direction),)
+        self._inc('data_bytes_total', labels, size)
+        self._inc('data_seconds_total', labels, seconds)
+
+    def counter(self, name, **labels):
+        """Returns the value of a counter, 0 if never incremented."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            return self._counters.get(key, 0)
+
+    def histogram(self, name, **labels):
+        """Returns dict with the 'count', 'sum' and cumulative 'buckets'
+        (list of (upper bound, count)) of a histogram, None if empty.
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                return None
+            counts = list(histogram.counts)
+            result = {'count': histogram.count, 'sum': histogram.sum}
+        cumulative = 0
+        buckets = []
+        for bound, count in zip(histogram.buckets + (float('inf'),), counts):
+            cumulative += count
+            buckets.append((bound, cumulative))
+        result['buckets'] = buckets
+        return result
+
+    def throughput(self, direction):
+        """Returns the bytes per second of the data transferred in
+        direction, None if nothing was.
+        """
+        seconds = self.counter('data_seconds_total', direction=direction)
+        if not seconds:
+            return None
+        return self.counter('data_bytes_total', direction=direction) / seconds
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def prometheus_text(self):
+        """Returns the metrics in the Prometheus text exposition format."""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, (histogram.buckets,
+                                       list(histogram.counts),
+                                       histogram.sum, histogram.count))
+                                for key, histogram in self._histograms.items())
+        lines = []
+        described = set()
+
+        def describe(name, kind):
+            if name not in described:
+                described.add(name)
+                full_name = self._name(name)
+                lines.append("# HELP {0} {1}".format(full_name,
+                                                     self.HELP.get(name, name)))
+                lines.append("# TYPE {0} {1}".format(full_name, kind))
+
+        for (name, labels), value in counters:
+            describe(name, 'counter')
+            lines.append("{0}{1} {2}".format(self._name(name),
+                                             _format_labels(labels),
+                                             _format_value(value)))
+        for (name, labels), (buckets, counts, total, count) in histograms:
+            describe(name, 'histogram')
+            full_name = self._name(name)
+            cumulative = 0
+            for bound, bucket_count in zip(buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                lines.append("{0}_bucket{1} {2}".format(
+                        full_name,
+                        _format_labels(labels + (('le', _format_value(bound)),)),
+                        cumulative))
+            lines.append("{0}_sum{1} {2}".format(full_name,
+                                                 _format_labels(labels),
+                                                 _format_value(total)))
+            lines.append("{0}_count{1} {2}".format(full_name,
+                                                   _format_labels(labels),
+                                                   count))
+        return "\n".join(lines) + "\n"
+
+    def _name(self, name):
+        return self.prefix and "{0}_{1}".format(self.prefix, name) or name
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(
+                '{0}="{1}"'.format(key, str(value).replace('\\', '\\\\')
+                                                  .replace('"', '\\"')
+                                                  .replace('\n', '\\n'))
+                for key, value in labels) + "}"
+
+
+class PCloudTracing(PCloudInstrumentation):
+    """Reports the requests as OpenTelemetry-style spans.
+
+    Each make_request becomes a span 'pcloud.<method>' of tracer (an
+    opentelemetry.trace.Tracer or anything with the same start_span)
+    with the result code, the sizes of the frames and data of the
+    request as attributes and the retries as events. Downloads become
+    'pcloud.download' spans.
+
+        tracing = PCloudTracing(opentelemetry.trace.get_tracer('pcloudapi'))
+        api = PCloudAPI(connection=PCloudBinaryConnection(
+                                instrumentation=tracing).connect(),
+                        instrumentation=tracing)
+
+    The spans are created when the request finishes, with the measured
+    start time (they are not the current span while it runs).
+    """
+
+    def __init__(self, tracer):
+        self.tracer = tracer
+        self._local = threading.local()
+
+    def _pending(self):
+        """What happened in this thread since the last request."""
+        pending = getattr(self._local, 'pending', None)
+        if pending is None:
+            pending = self._local.pending = {'attributes': {}, 'events': []}
+        return pending
+
+    def _add(self, attribute, value):
+        attributes = self._pending()['attributes']
+        attributes[attribute] = attributes.get(attribute, 0) + value
+
+    def on_retry(self, method, attempt, error=None, response=None):
+        self._pending()['events'].append(
+                ('retry', {'pcloud.attempt': attempt,
+                           'pcloud.reason': _reason(error, response)},
+                 time.time_ns()))
+
+    def on_frame(self, direction, size, method=None):
+        self._add('pcloud.frame_bytes.' + direction, size)
+
+    def on_data(self, direction, size, seconds):
+        if direction == 'downloaded':
+            self._span('pcloud.download', seconds,
+                       {'pcloud.data_bytes.downloaded': size})
+        else:
+            self._add('pcloud.data_bytes.' + direction, size)
+
+    def on_request(self, method, seconds, result=None, error=None):
+        pending, self._local.pending = self._pending(), None
+        attributes = pending['attributes']
+        attributes['pcloud.method'] = method
+        if result is not None:
+            attributes['pcloud.result'] = result
+        self._span('pcloud.' + method, seconds, attributes,
+                   pending['events'],
+                   error=error, failed=error is not None or result != 0)
+
+    def _span(self, name, seconds, attributes, events=(), error=None,
+              failed=False):
+        end = time.time_ns()
+        span = self.tracer.start_span(name,
+                                      attributes=attributes,
+                                      start_time=end - int(seconds * 1e9))
+        for event, event_attributes, timestamp in events:
+            span.add_event(event, event_attributes, timestamp)
+        if error is not None:
+            span.record_exception(error)
+        if failed and Status is not None:
+            span.set_status(Status(StatusCode.ERROR))
+        span.end(end_time=end)
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+
+import json
+import sqlite3
+import threading
+
+from .cache import normalize_path
+
+# metadata kept out of the stored json
+_SKIPPED_FIELDS = ('contents', 'parentpath', 'path')
+
+# rows are inserted in batches of this size while bootstrapping
+BATCH_SIZE = 10000
+
+_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS entries (
+        id TEXT PRIMARY KEY,        -- metadata 'id', e.g. d12 or f34
+        parentid TEXT,              -- id of the parent folder, NULL for root
+        name TEXT NOT NULL,
+        isfolder INTEGER NOT NULL,
+        size INTEGER,
+        hash TEXT,                  -- decimal, unsigned 64-bit
+        metadata TEXT NOT NULL      -- json
+    );
+    CREATE UNIQUE INDEX IF NOT EXISTS entries_parent
+        ON entries (parentid, name);
+    CREATE INDEX IF NOT EXISTS entries_size ON entries (size);
+    CREATE INDEX IF NOT EXISTS entries_hash ON entries (hash);
+    CREATE TABLE IF NOT EXISTS state (
+        key TEXT PRIMARY KEY,
+        value
+    );
+"""
+
+
+def _row(metadata):
+    """Returns the entries row of metadata."""
+    metadata = {k: v for k, v in metadata.items() if k not in _SKIPPED_FIELDS}
+    if 'parentfolderid' in metadata:
+        parentid = 'd{0}'.format(metadata['parentfolderid'])
+    else:
+        parentid = None
+    return (metadata['id'],
+            parentid,
+            metadata.get('name', ''),
+            int(bool(metadata.get('isfolder'))),
+            metadata.get('size'),
+            _hash_key(metadata.get('hash')),
+            json.dumps(metadata))
+
+
+def _hash_key(value):
+    """The hash is unsigned 64-bit, too large for an SQLite INTEGER."""
+    return None if value is None else str(int(value))
+
+
+class PCloudMirror(object):
+    """Persistent local index of the metadata of the whole account.
+
+    The index is an SQLite database bootstrapped from a recursive listing
+    and then kept up to date by replaying the diff events since the
+    stored diffid:
+
+        mirror = PCloudMirror(api, 'pcloud.db')
+        mirror.update() # bootstraps the first time
+        mirror.get('/photos/cat.jpg')
+
+    Entries are stored by their parent and name, so renaming or moving a
+    folder is a single row update. It is thread-safe, the queries do not
+    call the api. It is kept live by a subscription, see .on_changes.
+    """
+
+    def __init__(self, api, db_path, diff_limit=10000):
+        """Opens (or creates) the database.
+
+        :param api: PCloudAPI used by bootstrap and update
+        :param db_path: path of the SQLite database
+        :param diff_limit: maximum number of events requested per diff call
+        """
+        self.api = api
+        self.db_path = db_path
+        self.diff_limit = diff_limit
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        with self._db:
+            self._db.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def diffid(self):
+        """The diffid the mirror is up to date with, None if empty."""
+        with self._lock:
+            row = self._db.execute(
+                        "SELECT value FROM state WHERE key = 'diffid'"
+                    ).fetchone()
+        return row and row[0]
+
+    def _set_diffid(self, diffid):
+        """Call locked, within a transaction."""
+        self._db.execute(
+                "INSERT OR REPLACE INTO state (key, value) VALUES ('diffid', ?)",
+                (diffid,))
+
+    def _iter_tree(self):
+        """Yields the metadata of everything in the account."""
+        if hasattr(self.api.connection, 'iter_listfolder'):
+            yield from self.api.iter_listfolder(path='/', recursive=1)
+            return
+        # json connection, the whole listing is in memory anyway
+        stack = [self.api.make_request('listfolder',
+                                       path='/',
+                                       recursive=1)['metadata']]
+        while stack:
+            metadata = stack.pop()
+            stack.extend(metadata.get('contents', ()))
+            yield metadata
+
+    def bootstrap(self):
+        """Replaces the mirror with a fresh listing of the account.
+
+        The diffid is taken before listing, so changes made during the
+        listing are replayed by the next update.
+        """
+        diffid = self.api.make_request('diff', last=0)['diffid']
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM entries")
+            batch = []
+            for metadata in self._iter_tree():
+                batch.append(_row(metadata))
+                if len(batch) >= BATCH_SIZE:
+                    self._db.executemany(
+                        "INSERT OR REPLACE INTO entries VALUES (?,?,?,?,?,?,?)",
+                        batch)
+                    batch = []
+            self._db.executemany(
+                "INSERT OR REPLACE INTO entries VALUES (?,?,?,?,?,?,?)",
+                batch)
+            self._set_diffid(diffid)
+
+    def update(self):
+        """Applies the changes since the last update, returns their number.
+
+        Bootstraps the mirror if it is empty or the server asks for a reset.
+        """
+        if self.diffid is None:
+            self.bootstrap()
+            return 0
+        applied = 0
+        while True:
+            response = self.api.make_request('diff',
+                                             diffid=self.diffid,
+                                             limit=self.diff_limit)
+            entries = response.get('entries', [])
+            if not self.apply(entries, response.get('diffid')):
+                self.bootstrap()
+                return applied
+            applied += len(entries)
+            if len(entries) < self.diff_limit:
+                return applied
+
+    def apply(self, entries, diffid=None):
+        """Applies diff entries in a single transaction.
+
+        :param entries: the 'entries' of a diff response
+        :param diffid: the diffid reached, defaults to the last entry's one
+        :returns False if the entries contain a reset (nothing is applied)
+        """
+        if any(entry.get('event') == 'reset' for entry in entries):
+            return False
+        with self._lock, self._db:
+            for entry in entries:
+                self._apply_event(entry.get('event', ''),
+                                  entry.get('metadata'))
+                diffid = max(diffid or 0, entry.get('diffid', 0))
+            if diffid is not None:
+                self._set_diffid(diffid)
+        return True
+
+    def on_changes(self, entries, diffid):
+        """Applies a batch of a PCloudSubscription, bootstraps on a reset.
+
+            api.subscribe(mirror.on_changes, diffid=mirror.diffid)
+
+        The entries already in the mirror (e.g. listed by a bootstrap
+        newer than the subscription) are skipped.
+        """
+        current = self.diffid or 0
+        if diffid is not None and diffid <= current:
+            return
+        entries = [entry for entry in entries
+                   if entry.get('diffid', current + 1) > current]
+        if not self.apply(entries, diffid):
+            self.bootstrap()
+
+    def _apply_event(self, event, metadata):
+        """Call locked, within a transaction."""
+        if not isinstance(metadata, dict) or 'id' not in metadata:
+            return # e.g. share and user info events
+        if event.startswith('delete'):
+            self._db.execute("""
+                WITH RECURSIVE subtree(id) AS (
+                    VALUES (?)
+                    UNION ALL
+                    SELECT entries.id FROM entries, subtree
+                        WHERE entries.parentid = subtree.id
+                )
+                DELETE FROM entries WHERE id IN subtree
+                """, (metadata['id'],))
+        elif event.startswith('create') or event.startswith('modify'):
+            # also replaces another entry with the same parent and name
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?,?,?,?,?,?,?)",
+                _row(metadata))
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return [json.loads(row[0])
+                    for row in self._db.execute(sql, params).fetchall()]
+
+    def _id_of(self, path):
+        """Returns the id of path or None. Call locked."""
+        item_id = 'd0'
+        for name in normalize_path(path).split('/')[1:]:
+            if not name:
+                continue
+            row = self._db.execute(
+                        "SELECT id FROM entries WHERE parentid = ? AND name = ?",
+                        (item_id, name)).fetchone()
+            if row is None:
+                return None
+            item_id = row[0]
+        return item_id
+
+    def get(self, path):
+        """Returns the metadata of path or None."""
+        with self._lock:
+            item_id = self._id_of(path)
+            if item_id is None:
+                return None
+            return self.get_by_id(item_id)
+
+    def get_by_id(self, item_id=None, fileid=None, folderid=None):
+        """Returns the metadata by 'id' (d12, f34), fileid or folderid."""
+        if fileid is not None:
+            item_id = 'f{0}'.format(fileid)
+        elif folderid is not None:
+            item_id = 'd{0}'.format(folderid)
+        result = self._query("SELECT metadata FROM entries WHERE id = ?",
+                             (item_id,))
+        return result[0] if result else None
+
+    def path_of(self, item_id=None, fileid=None, folderid=None):
+        """Returns the path of an 'id', fileid or folderid or None."""
+        if fileid is not None:
+            item_id = 'f{0}'.format(fileid)
+        elif folderid is not None:
+            item_id = 'd{0}'.format(folderid)
+        names = []
+        with self._lock:
+            while item_id != 'd0':
+                row = self._db.execute(
+                            "SELECT parentid, name FROM entries WHERE id = ?",
+                            (item_id,)).fetchone()
+                if row is None:
+                    return None
+                item_id = row[0]
+                names.append(row[1])
+        return '/' + '/'.join(reversed(names))
+
+    def children(self, path=None, folderid=None):
+        """Returns the metadata of the contents of a folder."""
+        with self._lock:
+            if folderid is not None:
+                item_id = 'd{0}'.format(folderid)
+            else:
+                item_id = self._id_of(path)
+            return self._query(
+                        "SELECT metadata FROM entries WHERE parentid = ?",
+                        (item_id,))
+
+    def find(self, size=None, hash=None, isfolder=None):
+        """Returns the metadata of the entries matching all given criteria.
+
+        :param hash: the pcloud content hash, see checksumfile
+        """
+        criteria = []
+        params = []
+        for column, value, convert in (('size', size, int),
+                                       ('hash', hash, _hash_key),
+                                       ('isfolder', isfolder, int)):
+            if value is not None:
+                criteria.append('{0} = ?'.format(column))
+                params.append(convert(value))
+        sql = "SELECT metadata FROM entries"
+        if criteria:
+            sql += " WHERE " + " AND ".join(criteria)
+        return self._query(sql, params)
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
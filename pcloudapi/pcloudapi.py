@@ -1,19 +1,42 @@
 #!/usr/bin/env python3
 
 import hashlib
-import re
+import os
 import requests
 import sys
+import time
+import urllib.parse
 from pprint import pprint as pp
 
+from .cache import PCloudMetadataCache
+from .checksums import HashingReader, new_digests, verify_checksums, \
+                       checksums_match
 from .exceptions import PCloudException
 from .connection import AbstractPCloudConnection
-from .pcloudbin import PCloudBinaryConnection
+from .delta import PCloudDeltaUploader, BLOCK_SIZE as DELTA_BLOCK_SIZE
+from .directories import PCloudDirectories
+from .hashcache import hash_file
+from .download import PCloudRangeDownloader, RANGE_SIZE, CHECKPOINT_SUFFIX
+from .pcloudbin import PCloudBinaryConnection, PCLOUD_BINAPI_SERVER
+from .remotefile import PCloudRemoteFile
+from .retry import PCloudRetryPolicy
+from .subscription import PCloudSubscription
+from .upload import PCloudChunkedUploader
 
 
 PCLOUD_SERVER_SUFFIX = '.pcloud.com'  # only allow downloads from pcloud servers
 
 
+def password_digest(username, password, digest):
+    """Returns passworddigest for digest login (see getdigest)."""
+    return hashlib.sha1(
+                (password +
+                 hashlib.sha1(username.lower().encode('utf-8')
+                     ).hexdigest().lower() +
+                 digest).encode('utf-8')
+            ).hexdigest()
+
+
 class PCloudAPIMetaclass(type):
 
     @classmethod
@@ -41,6 +64,8 @@ class PCloudAPIMetaclass(type):
                   listuploadlinks normalizehash getpubthumbslinks
                   uploadlinkprogress removeshare getfilepublink
                   deletefolderrecursive
+                  upload_create upload_write upload_info upload_save
+                  upload_delete createfolderifnotexists getapiserver
                   """.strip().split()
         return {method :
                     (lambda method :
@@ -59,19 +84,43 @@ class PCloudAPI(metaclass=PCloudAPIMetaclass):
         (PCloudException, requests.RequestException, IOError)
     """
 
-    def __init__(self, connection=PCloudBinaryConnection, debug=False):
+    def __init__(self, connection=PCloudBinaryConnection, debug=False,
+                 cache=None, content_index=None, retry_policy=None,
+                 download_endpoints=None, instrumentation=None):
         """Initializes the API.
 
         connection can be either a concrete class of AbstractPCloudConnection
         or an AbstractPCloudConnection-derived object.
         If debug is true dumps the parameters
+        cache can be a PCloudMetadataCache (or True for a default one), used
+        by get_folderid, exists_file and create_directory to skip lookups
+        content_index can be a PCloudContentIndex, used by upload to copy
+        remote files with the same content instead of uploading
+        retry_policy can be a PCloudRetryPolicy retrying the failed
+        commands of make_request (True for a default one), by default
+        nothing is retried
+        download_endpoints can be a PCloudEndpointSelector (e.g. with an
+        http_probe) ordering the download hosts, fastest first
+        instrumentation can be a PCloudInstrumentation (e.g. PCloudMetrics)
+        told about the requests, retries and downloads
         """
-        if issubclass(connection, AbstractPCloudConnection):
+        if (isinstance(connection, type) and
+                issubclass(connection, AbstractPCloudConnection)):
             connection = connection().connect()
         assert isinstance(connection, AbstractPCloudConnection), \
                 ("PCloud instance expected, got %s" % connection.__class__)
         self.connection = connection
         self.debug = debug
+        if cache is True:
+            cache = PCloudMetadataCache()
+        self.cache = cache
+        self.content_index = content_index
+        if retry_policy is True:
+            retry_policy = PCloudRetryPolicy()
+        self.retry_policy = retry_policy
+        self.download_endpoints = download_endpoints
+        self.instrumentation = instrumentation
+        self.directories = PCloudDirectories(self)
 
     def make_request(self, method, check_result=True, **params):
         """Performs send_command through the connection.
@@ -80,20 +129,80 @@ class PCloudAPI(metaclass=PCloudAPIMetaclass):
         :param **params: the parameters for the connection
         :param _data: file data in the form of bytes or stream of bytes
         :param check_result: check that the ['result'] == 0 and raise if not
-        :returns response in the form of a dictionary
+        :returns response in the form of a dictionary, None with _noresult
+            (nothing is checked nor observed then)
         :raises PCloudException
         """
         if self.debug:
             pp((method, params), stream=sys.stderr)
-        response = self.connection.send_command(method, **params)
+        if self.instrumentation is not None:
+            started = time.monotonic()
+            try:
+                response = self._send_command(method, params)
+            except Exception as e:
+                self.instrumentation.on_request(method,
+                                                time.monotonic() - started,
+                                                error=e)
+                raise
+            self.instrumentation.on_request(
+                    method, time.monotonic() - started,
+                    result=None if response is None else response.get('result'))
+        else:
+            response = self._send_command(method, params)
         if self.debug:
             pp(response, stream=sys.stderr)
+        if response is None:
+            return response # _noresult, the reply is read by the caller
+        if self.cache is not None:
+            self.cache.observe(method, params, response)
+        self.directories.observe(method, params, response)
+        if self.content_index is not None:
+            self.content_index.observe(method, params, response)
         if check_result:
             result = response.get('result', None)
             if result != 0:
                 raise PCloudException(result_code=result)
         return response
 
+    def _send_command(self, method, params):
+        if self.retry_policy is not None:
+            return self.retry_policy.send_command(self.connection,
+                                                  method, params,
+                                                  self.instrumentation)
+        return self.connection.send_command(method, **params)
+
+    def iter_listfolder(self, **params):
+        """Yields the flattened metadata entries of listfolder.
+
+        Takes the parameters of listfolder, see
+        PCloudBinaryConnection.iter_listfolder.
+        NOTE: requires a binary connection
+        """
+        return self.connection.iter_listfolder(**params)
+
+    def pipeline(self, max_in_flight=32):
+        """Returns a pipeline for sending many commands without waiting.
+
+        Futures of commands with result != 0 raise PCloudException.
+        The commands are reported to instrumentation as they are answered.
+        NOTE: requires a connection supporting pipelining (binary)
+        """
+        return self.connection.pipeline(max_in_flight=max_in_flight,
+                                        check_result=True,
+                                        instrumentation=self.instrumentation)
+
+    def subscribe(self, callback=None, diffid=None, **kwargs):
+        """Subscribes to the changes in the account.
+
+        With callback the changes are delivered from a background thread,
+        otherwise iterate the returned subscription asynchronously.
+        See PCloudSubscription for the parameters.
+        """
+        subscription = PCloudSubscription(self, callback, diffid, **kwargs)
+        if callback is not None:
+            subscription.start()
+        return subscription
+
     def login(self, username, password):
         """Perform login though the connection.
 
@@ -104,12 +213,7 @@ class PCloudAPI(metaclass=PCloudAPIMetaclass):
         Also sets .auth and in turn .connection.auth to the returned token.
         """
         digest = self.make_request('getdigest')['digest']
-        passworddigest = hashlib.sha1(
-                            (password +
-                             hashlib.sha1(username.lower().encode('utf-8')
-                                 ).hexdigest().lower() +
-                             digest).encode('utf-8')
-                        ).hexdigest()
+        passworddigest = password_digest(username, password, digest)
         auth = self.make_request('userinfo',
                                  getauth=1,
                                  username=username,
@@ -119,6 +223,10 @@ class PCloudAPI(metaclass=PCloudAPIMetaclass):
         return auth
 
     def get_folderid(self, path):
+        if self.cache is not None:
+            metadata = self.cache.get(path)
+            if metadata is not None and metadata.get('isfolder'):
+                return metadata['folderid']
         return self.make_request('listfolder',
                                  path=path,
                                  nofiles=1,
@@ -128,28 +236,54 @@ class PCloudAPI(metaclass=PCloudAPIMetaclass):
         """Creates directory recursively.
 
         Does not raise any errors if the file exists.
+        See PCloudDirectories, the existing directories are remembered.
         """
-        if path == '/':
-            return # HACK: pcloud fails otherwise
         if path == "":
             return # nothing to do
-        # really ugly, sadly there is no mkdir -p
-        try:
-            self.make_request('createfolder', path=path)
-        except PCloudException as e:
-            if e.result_code == 2002:
-                # parent does not exist
-                # stack danger
-                self.create_directory(re.sub('(^/?|/+)[^/]+/?$', '', path))
-                self.make_request('createfolder', path=path)
-            elif e.result_code == 2004:
-                # file/folder exists, assume everything is OK
-                pass
-            else:
-                raise
+        self.directories.ensure(path)
+
+    def api_servers(self):
+        """Returns the binary api servers to choose from.
+
+        The servers nearest to the client reported by getapiserver,
+        then the default one. See PCloudEndpointSelector.
+        """
+        response = self.make_request('getapiserver')
+        servers = list(response.get('binapi', []))
+        if PCLOUD_BINAPI_SERVER not in servers:
+            servers.append(PCLOUD_BINAPI_SERVER)
+        return servers
+
+    def _download_urls(self, response, enforced_server_suffix):
+        """Returns the download urls from a getfilelink response.
+
+        The urls are in the order of the hosts, the first should be
+        the closest server, or fastest first with download_endpoints.
+        """
+        hosts = response['hosts']
+        for server in hosts:
+            if enforced_server_suffix:
+                if '/' in server or not server.lower().endswith(enforced_server_suffix):
+                    raise ValueError(
+                        "Received download server {!r} which does not match expected suffix {!r}".format(
+                            server, enforced_server_suffix
+                        )
+                    )
+        if self.download_endpoints is not None:
+            # validated above, before probing any of them
+            hosts = self.download_endpoints.rank(hosts)
+        return ["{protocol}://{server}:{port}{path}".format(
+                    protocol=self.connection.use_ssl and 'https' or 'http',
+                    server=server,
+                    port=self.connection.use_ssl and 443 or 80,
+                    path=response['path']
+                )
+                for server in hosts]
 
     def download(self, remote_path, local_path, progress_callback=None,
-                 enforced_server_suffix=PCLOUD_SERVER_SUFFIX):
+                 enforced_server_suffix=PCLOUD_SERVER_SUFFIX,
+                 connections=1, range_size=RANGE_SIZE, retries=3,
+                 resume=False, verify=False):
         """Downloads file from remote_path to local_path.
 
         :param progress_callback: called each time with the number of bytes
@@ -157,49 +291,180 @@ class PCloudAPI(metaclass=PCloudAPIMetaclass):
         :param enforced_server_suffix: only allow downloads from servers having
             the expected suffix (this together with ssl prevents a downloading
             of non-pcloud controlled resource)
-        :returns pcloud api response
-        """
-        response = self.make_request('getfilelink',
-                                     path=remote_path,
-                                     forcedownload=1)
-        server = response['hosts'][0]  # should be the closest server
-        if enforced_server_suffix:
-            if '/' in server or not server.lower().endswith(enforced_server_suffix):
-                raise ValueError(
-                    "Received download server {!r} which does not match expected suffix {!r}".format(
-                        server, enforced_server_suffix
-                    )
-                )
-        url = "{protocol}://{server}:{port}{path}".format(
-                protocol=self.connection.use_ssl and 'https' or 'http',
-                server=server,
-                port=self.connection.use_ssl and 443 or 80,
-                path=response['path']
-            )
-        r = requests.get(url, stream=True, allow_redirects=False, timeout=self.connection.timeout)
-        r.raise_for_status()
+        :param connections: if more than 1 the file is downloaded as ranges
+            of range_size fetched concurrently from all the hosts returned by
+            getfilelink, see PCloudRangeDownloader
+        :param retries: how many times a range is retried (connections > 1)
+        :param resume: keep a checkpoint next to local_path (with suffix
+            CHECKPOINT_SUFFIX) and resume an interrupted download from it,
+            the downloaded file is verified against checksumfile
+        :param verify: verify the file against checksumfile, hashed while
+            it is downloaded (read back if connections > 1)
+        :returns pcloud api response (of checksumfile if resume or verify
+            is set)
+        """
+        args = (remote_path, local_path, progress_callback,
+                enforced_server_suffix, connections, range_size, retries,
+                resume, verify)
+        if self.instrumentation is None:
+            return self._download(*args)
+        started = time.monotonic()
+        response = self._download(*args)
+        self.instrumentation.on_data('downloaded',
+                                     os.path.getsize(local_path),
+                                     time.monotonic() - started)
+        return response
+
+    def _download(self, remote_path, local_path, progress_callback,
+                  enforced_server_suffix, connections, range_size, retries,
+                  resume, verify):
+        if resume or (verify and connections > 1):
+            return self._download_resumable(remote_path, local_path,
+                                            progress_callback,
+                                            enforced_server_suffix,
+                                            connections, range_size, retries,
+                                            resume)
+
+        if verify:
+            checksums = self.make_request('checksumfile', path=remote_path)
+            response = self.make_request(
+                                'getfilelink',
+                                fileid=checksums['metadata']['fileid'],
+                                forcedownload=1)
+            digests = new_digests()
+        else:
+            response = self.make_request('getfilelink',
+                                         path=remote_path,
+                                         forcedownload=1)
+            digests = {}
+        urls = self._download_urls(response, enforced_server_suffix)
+
+        if connections > 1:
+            PCloudRangeDownloader(urls, local_path,
+                                  connections=connections,
+                                  range_size=range_size,
+                                  retries=retries,
+                                  timeout=self.connection.timeout,
+                                  progress_callback=progress_callback
+                                  ).download()
+            return response
+
+        # reuse the kept alive connections of PCloudJSONConnection if any
+        http = getattr(self.connection, 'session', requests)
+        r = self._open_download(http, urls)
 
         with open(local_path, 'wb') as fd:
             for chunk in r.iter_content(8192):
                 written = fd.write(chunk)
+                for digest in digests.values():
+                    digest.update(chunk)
                 if progress_callback:
                     progress_callback(written)
 
+        if verify:
+            verify_checksums(digests, checksums, local_path)
+            return checksums
         return response
 
+    def _open_download(self, http, urls):
+        """Returns the response of the first url that answers,
+        reporting the failed hosts to download_endpoints.
+        """
+        for index, url in enumerate(urls):
+            try:
+                r = http.get(url, stream=True, allow_redirects=False, timeout=self.connection.timeout)
+                r.raise_for_status()
+                return r
+            except requests.RequestException:
+                if self.download_endpoints is not None:
+                    self.download_endpoints.report_failure(
+                                urllib.parse.urlsplit(url).hostname)
+                if index == len(urls) - 1:
+                    raise
+
+    def _download_resumable(self, remote_path, local_path, progress_callback,
+                            enforced_server_suffix,
+                            connections, range_size, retries, resume=True):
+        checksums = self.make_request('checksumfile', path=remote_path)
+        metadata = checksums['metadata']
+
+        def get_urls():
+            # the links expire, the file is referred by id in case it moved
+            response = self.make_request('getfilelink',
+                                         fileid=metadata['fileid'],
+                                         forcedownload=1)
+            return self._download_urls(response, enforced_server_suffix)
+
+        checkpoint_path = resume and local_path + CHECKPOINT_SUFFIX or None
+        PCloudRangeDownloader(get_urls(), local_path,
+                              connections=connections,
+                              range_size=range_size,
+                              retries=retries,
+                              timeout=self.connection.timeout,
+                              progress_callback=progress_callback,
+                              checkpoint_path=checkpoint_path,
+                              identity=[metadata['fileid'],
+                                        metadata['hash'],
+                                        metadata['size']],
+                              refresh_urls=get_urls,
+                              ).download()
+
+        # the ranges arrive out of order (and partly before a resume)
+        algorithm = 'sha256' if 'sha256' in checksums else 'sha1'
+        digest = hashlib.new(algorithm)
+        with open(local_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        verify_checksums({algorithm: digest}, checksums, local_path)
+        return checksums
+
     def upload(self, local_path, remote_path,
-               create_parent=True, progress_callback=None):
+               create_parent=True, progress_callback=None,
+               chunk_size=None, connections=1, verify=False,
+               hash_cache=None):
         """Uploads file from local_path to remote_path.
 
         :param create_parent: whether to create the parent
         :param progress_callback: called each time with the number of bytes
             written in the iteration
-        :returns pcloud api response
+        :param chunk_size: if set the file is uploaded in chunks of chunk_size
+            through a resumable upload session, see PCloudChunkedUploader
+        :param connections: chunks uploaded concurrently, requires
+            a PCloudConnectionPool
+        :param verify: hash the file while it is sent and compare it with
+            the checksums returned by uploadfile (without chunk_size)
+        :param hash_cache: PCloudHashCache, the upload is skipped if the
+            remote file has the same content (see checksumfile)
+        :returns pcloud api response (of upload_save if chunk_size is set,
+            of checksumfile if the upload is skipped, of copyfile if the
+            content is copied, see .content_index)
         """
+        digests = None
+        if hash_cache is not None:
+            checksums = self._remote_checksums([remote_path])[0]
+            digests = hash_cache.digests(local_path)
+            if checksums is not None and checksums_match(digests, checksums):
+                return checksums
         remote_dir, filename = remote_path.rsplit('/', 1)
         if create_parent:
             self.create_directory(remote_dir)
+        if self.content_index is not None:
+            if digests is None:
+                digests = hash_file(local_path)
+            response = self._copy_content(digests,
+                                          os.path.getsize(local_path),
+                                          remote_path)
+            if response is not None:
+                return response
+        if chunk_size:
+            return PCloudChunkedUploader(self, local_path, remote_path,
+                                         chunk_size=chunk_size,
+                                         connections=connections,
+                                         progress_callback=progress_callback
+                                         ).upload()
         with open(local_path, 'rb') as fd:
+            if verify:
+                fd = HashingReader(fd)
             response = self.make_request('uploadfile',
                                          _data=fd,
                                          path=remote_dir or '/',
@@ -208,10 +473,122 @@ class PCloudAPI(metaclass=PCloudAPIMetaclass):
                                          _data_progress_callback=progress_callback)
             if not response['fileids']:
                 raise PCloudException("Upload failed, no files reported back")
+            if verify:
+                verify_checksums(fd.digests, response['checksums'][0],
+                                 local_path)
         return response
 
+    def open_remote(self, path=None, fileid=None, **kwargs):
+        """Opens a remote file for random access reading.
+
+        See PCloudRemoteFile, requires a binary connection.
+        """
+        return PCloudRemoteFile(self, path=path, fileid=fileid, **kwargs)
+
+    def upload_delta(self, local_path, remote_path, create_parent=True,
+                     block_size=DELTA_BLOCK_SIZE, progress_callback=None,
+                     verify=True):
+        """Updates remote_path to the content of local_path in place,
+        writing only the blocks that differ (creates it if missing).
+
+        See PCloudDeltaUploader, requires a binary connection.
+        :returns dict with the 'size', 'blocks' compared, 'changed' blocks
+            and bytes 'written'
+        """
+        if create_parent:
+            self.create_directory(remote_path.rsplit('/', 1)[0])
+        return PCloudDeltaUploader(self, local_path, remote_path,
+                                   block_size=block_size,
+                                   progress_callback=progress_callback,
+                                   verify=verify).upload()
+
+    def _copy_content(self, digests, size, remote_path):
+        """Copies a remote file with the given content to remote_path.
+
+        The candidates of the index are checked with checksumfile first,
+        they may have been modified or deleted by another client.
+        Returns the copyfile response or None if there is no such file.
+        """
+        for fileid in self.content_index.lookup(digests, size):
+            # reindexes the file (or forgets it if deleted)
+            checksums = self.make_request('checksumfile',
+                                          check_result=False,
+                                          fileid=fileid)
+            result = checksums.get('result')
+            if result == 2009:
+                continue
+            if result != 0:
+                raise PCloudException(result_code=result)
+            if (checksums['metadata'].get('size') != size or
+                    not checksums_match(digests, checksums)):
+                continue
+            response = self.make_request('copyfile',
+                                         check_result=False,
+                                         fileid=fileid,
+                                         topath=remote_path)
+            result = response.get('result')
+            if result == 0:
+                return response
+            if result != 2009:
+                raise PCloudException(result_code=result)
+            # deleted meanwhile, forgotten by the index
+        return None
+
+    def _remote_checksums(self, remote_paths):
+        """Returns the checksumfile responses (None if missing) of the
+        remote_paths, pipelined when the connection supports it.
+        """
+        if hasattr(self.connection, 'pipeline'):
+            with self.connection.pipeline(
+                        check_result=False,
+                        instrumentation=self.instrumentation) as pipeline:
+                responses = list(pipeline.map('checksumfile',
+                                              ({'path': path}
+                                               for path in remote_paths)))
+        else:
+            responses = [self.make_request('checksumfile',
+                                           check_result=False,
+                                           path=path)
+                         for path in remote_paths]
+        result = []
+        for response in responses:
+            code = response.get('result')
+            if code in (2002, 2009):
+                result.append(None)
+            elif code != 0:
+                raise PCloudException(result_code=code)
+            else:
+                result.append(response)
+        return result
+
+    def changed_files(self, files, hash_cache):
+        """Returns the (local_path, remote_path) pairs whose content differs.
+
+        The remote checksums are requested in a single pipeline and the
+        local digests come from hash_cache, so unchanged files are
+        neither hashed nor uploaded again:
+
+            for local_path, remote_path in api.changed_files(files, cache):
+                api.upload(local_path, remote_path)
+
+        :param files: iterable of (local_path, remote_path)
+        :param hash_cache: PCloudHashCache
+        """
+        files = list(files)
+        checksums = self._remote_checksums([remote for _, remote in files])
+        return [(local_path, remote_path)
+                for (local_path, remote_path), remote_checksums
+                in zip(files, checksums)
+                if remote_checksums is None or
+                    not checksums_match(hash_cache.digests(local_path),
+                                        remote_checksums)]
+
     def exists_file(self, remote_path):
         """Checks if file exists. Does not work for folders."""
+        if self.cache is not None:
+            metadata = self.cache.get(remote_path)
+            if metadata is not None and not metadata.get('isfolder'):
+                return True
         try:
             self.make_request('checksumfile',
                               path=remote_path)
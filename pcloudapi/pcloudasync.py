@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+
+import asyncio
+import collections
+import io
+import sys
+from pprint import pprint as pp
+
+from .directories import AsyncPCloudDirectories
+from .exceptions import PCloudException
+from .pcloudapi import PCloudAPIMetaclass, password_digest
+from .pcloudbin import (_PCloudBinaryCodec,
+                        PCLOUD_BINAPI_SERVER, PCLOUD_PORT, PCLOUD_SSL_PORT)
+from .utils import DEFAULT_TRANSPORT
+
+CHUNK_SIZE = 65536
+
+
+class AsyncPCloudBinaryConnection(_PCloudBinaryCodec):
+    """asyncio connection to pcloud.com based on their binary protocol.
+
+    Commands from concurrent tasks are pipelined over the single stream,
+    replies are matched to requests by their order.
+
+    NOTE: replies carrying data (e.g. file_read, getzip) have the data read
+        into memory and stored in the result under '_data'.
+    NOTE: await .connect() must be called to establish network communication.
+    """
+
+    def __init__(self,
+                 use_ssl=True, server=PCLOUD_BINAPI_SERVER, port=None,
+                 timeout=30,
+                 auth=None,
+                 persistent_params=None,
+                 transport=None):
+        """Initializes the connection.
+
+        :param persistent_params: a dict that augments params on each command,
+            this is useful for storing auth data.
+        :param transport: PCloudTransport whose SSLContext is used
+
+        NOTE: persistent_params overrides any values in params on send_command
+        """
+        self.use_ssl = use_ssl
+        self.server = server
+        self.port = port or (self.use_ssl and PCLOUD_SSL_PORT or PCLOUD_PORT)
+        self.timeout = timeout
+        self.transport = transport or DEFAULT_TRANSPORT
+        self.reader = None
+        self.writer = None
+        if persistent_params is None:
+            self.persistent_params = {}
+        else:
+            self.persistent_params = persistent_params
+        if auth is not None:
+            self.auth = auth
+        self._write_lock = None
+        self._pending = collections.deque()
+        self._reader_task = None
+        self._error = None
+
+    @property
+    def auth(self):
+        return self.persistent_params['auth']
+    @auth.setter
+    def auth(self, auth):
+        if auth:
+            self.persistent_params['auth'] = auth
+        else:
+            self.persistent_params.pop('auth', None)
+
+    async def connect(self):
+        """Establish connection and return self."""
+        if self.writer:
+            raise ValueError("maybe connect called twice?")
+        ssl_context = None
+        if self.use_ssl:
+            ssl_context = self.transport.ssl_context
+        self.reader, self.writer = await asyncio.wait_for(
+                asyncio.open_connection(
+                    self.server, self.port,
+                    ssl=ssl_context,
+                    server_hostname=self.use_ssl and self.server or None),
+                self.timeout)
+        self._write_lock = asyncio.Lock()
+        self._reader_task = asyncio.ensure_future(self._read_responses())
+        return self
+
+    async def send_command(self, method, **params):
+        """Sends command and returns result.
+
+        :param method: the pcloud method to call
+        :param **params: parameters to be passed to the api, except:
+            - _data is the file data (bytes or binary file)
+            - _data_progress_callback is the upload callback
+        :returns dictionary returned by the api
+        :raises ValueError if the connection is not connected
+        """
+        if self._write_lock is None:
+            raise ValueError("Not connected, await connect() first")
+        data = params.pop('_data', None)
+        data_progress_callback = params.pop('_data_progress_callback', None)
+        data_len = self._determine_data_len(data)
+        req = self._encode_request(method, params, data_len)
+
+        future = asyncio.get_running_loop().create_future()
+        async with self._write_lock:
+            if self._error is not None:
+                raise self._error
+            self._pending.append(future)
+            try:
+                self.writer.write(req)
+                if data is not None:
+                    await self._send_raw_data(data, data_len,
+                                              data_progress_callback)
+                await self.writer.drain()
+            except BaseException as e:
+                # including cancellation, a partial request breaks the stream
+                self._break(e)
+                raise
+        return await future
+
+    async def _send_raw_data(self, data, data_len, progress_callback):
+        if isinstance(data, io.IOBase):
+            while data_len > 0:
+                chunk = data.read(min(data_len, CHUNK_SIZE))
+                if not chunk:
+                    raise IOError("Mismatch between bytes written and supplied data length")
+                self.writer.write(chunk)
+                await self.writer.drain()
+                data_len -= len(chunk)
+                if progress_callback:
+                    progress_callback(len(chunk))
+        else:
+            self.writer.write(data)
+
+    async def _read_responses(self):
+        try:
+            while True:
+                frame_len = int.from_bytes(await self.reader.readexactly(4),
+                                           'little')
+                frame = await self.reader.readexactly(frame_len)
+                future = self._pending.popleft()
+                try:
+                    result = self._decode_frame(frame)
+                except Exception as e:
+                    if not future.done():
+                        future.set_exception(e)
+                    continue
+                if isinstance(result, dict) and 'data' in result:
+                    result['_data'] = await self.reader.readexactly(
+                                                            result['data'])
+                if not future.done():
+                    future.set_result(result)
+        except asyncio.CancelledError:
+            self._break(IOError("Connection closed"))
+        except Exception as e:
+            self._break(e)
+
+    def _break(self, error):
+        if self._error is None:
+            self._error = IOError("Connection broken: {0!r}".format(error))
+        while self._pending:
+            future = self._pending.popleft()
+            if not future.done():
+                future.set_exception(self._error)
+
+    async def close(self):
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            try:
+                await self._reader_task
+            except asyncio.CancelledError:
+                pass
+        if self.writer is not None:
+            self.writer.close()
+            await self.writer.wait_closed()
+
+    async def __aenter__(self):
+        return await self.connect()
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+
+class AsyncPCloudAPI(metaclass=PCloudAPIMetaclass):
+    """asyncio counterpart of PCloudAPI.
+
+    All pcloud api methods are available as coroutine .method shortcuts for
+    make_request(method, ...).
+
+        async with AsyncPCloudAPI() as api:
+            await api.login(username, password)
+            await api.listfolder(path='/')
+    """
+
+    def __init__(self, connection=AsyncPCloudBinaryConnection, debug=False):
+        """Initializes the API.
+
+        connection can be either AsyncPCloudBinaryConnection (or a derived
+        class) or an instance of it.
+        NOTE: await .connect() must be called unless the connection is
+            already connected.
+        """
+        if isinstance(connection, type):
+            connection = connection()
+        self.connection = connection
+        self.debug = debug
+        self.directories = AsyncPCloudDirectories(self)
+
+    async def connect(self):
+        """Connects the underlying connection and returns self."""
+        await self.connection.connect()
+        return self
+
+    async def close(self):
+        await self.connection.close()
+
+    async def __aenter__(self):
+        return await self.connect()
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def make_request(self, method, check_result=True, **params):
+        """Performs send_command through the connection.
+
+        See PCloudAPI.make_request.
+        """
+        if self.debug:
+            pp((method, params), stream=sys.stderr)
+        response = await self.connection.send_command(method, **params)
+        if self.debug:
+            pp(response, stream=sys.stderr)
+        self.directories.observe(method, params, response)
+        if check_result:
+            result = response.get('result', None)
+            if result != 0:
+                raise PCloudException(result_code=result)
+        return response
+
+    async def login(self, username, password):
+        """Perform login though the connection.
+
+        See PCloudAPI.login.
+        """
+        digest = (await self.make_request('getdigest'))['digest']
+        response = await self.make_request(
+                        'userinfo',
+                        getauth=1,
+                        username=username,
+                        digest=digest,
+                        passworddigest=password_digest(username,
+                                                       password,
+                                                       digest))
+        self.auth = response['auth']
+        return self.auth
+
+    async def get_folderid(self, path):
+        return (await self.make_request('listfolder',
+                                        path=path,
+                                        nofiles=1,
+                                        ))['metadata']['folderid']
+
+    async def create_directory(self, path):
+        """Creates directory recursively.
+
+        Does not raise any errors if the file exists.
+        See AsyncPCloudDirectories, the existing directories are remembered.
+        """
+        if path == "":
+            return # nothing to do
+        await self.directories.ensure(path)
+
+    async def download(self, remote_path, local_path, progress_callback=None,
+                       chunk_size=CHUNK_SIZE, window=4):
+        """Downloads file from remote_path to local_path.
+
+        Unlike PCloudAPI.download the data is read over the binary
+        connection (file_pread), window reads are kept in flight.
+
+        :param progress_callback: called each time with the number of bytes
+            written in the iteration
+        :returns pcloud api response of file_open
+        """
+        response = await self.make_request('file_open',
+                                           path=remote_path,
+                                           flags=0)
+        fd = response['fd']
+        try:
+            size = (await self.make_request('file_size', fd=fd))['size']
+            pending = collections.deque()
+            try:
+                with open(local_path, 'wb') as f:
+                    for offset in range(0, size, chunk_size):
+                        pending.append(asyncio.ensure_future(
+                                self.make_request('file_pread',
+                                                  fd=fd,
+                                                  offset=offset,
+                                                  count=chunk_size)))
+                        if len(pending) >= window:
+                            self._write_chunk(f, await pending.popleft(),
+                                              progress_callback)
+                    while pending:
+                        self._write_chunk(f, await pending.popleft(),
+                                          progress_callback)
+            finally:
+                for task in pending:
+                    task.cancel()
+        finally:
+            await self.make_request('file_close', fd=fd)
+        return response
+
+    @staticmethod
+    def _write_chunk(f, response, progress_callback):
+        written = f.write(response['_data'])
+        if progress_callback:
+            progress_callback(written)
+
+    async def upload(self, local_path, remote_path,
+                     create_parent=True, progress_callback=None):
+        """Uploads file from local_path to remote_path.
+
+        See PCloudAPI.upload.
+        """
+        remote_dir, filename = remote_path.rsplit('/', 1)
+        if create_parent:
+            await self.create_directory(remote_dir)
+        with open(local_path, 'rb') as fd:
+            response = await self.make_request(
+                                    'uploadfile',
+                                    _data=fd,
+                                    path=remote_dir or '/',
+                                    filename=filename,
+                                    nopartial=1,
+                                    _data_progress_callback=progress_callback)
+            if not response['fileids']:
+                raise PCloudException("Upload failed, no files reported back")
+        return response
+
+    async def exists_file(self, remote_path):
+        """Checks if file exists. Does not work for folders."""
+        try:
+            await self.make_request('checksumfile',
+                                    path=remote_path)
+            return True
+        except PCloudException as e:
+            if e.result_code in [2002, 2009]:
+                return False
+            else:
+                raise
+
+    async def delete_file(self, remote_path):
+        """Delete file at remote_path."""
+        try:
+            await self.make_request('deletefile',
+                                    path=remote_path)
+        except PCloudException as e:
+            if e.result_code in [2002, 2009]:
+                return False
+            else:
+                raise
+
+    @property
+    def auth(self):
+        return self.connection.auth
+    @auth.setter
+    def auth(self, auth):
+        self.connection.auth = auth
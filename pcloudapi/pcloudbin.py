@@ -1,16 +1,206 @@
 #!/usr/bin/env python3
+import contextlib
 import io
+import mmap
+import os
 import socket
+import ssl
+import stat
+import time
 
 from .connection import AbstractPCloudConnection
-from .utils import create_connection, PCloudBuffer
+from .decoder import decode, iter_events, iter_folder_entries
+from .pipeline import PCloudPipeline
+from .utils import create_connection, PCloudBuffer, ProgressThrottle, \
+    DEFAULT_TRANSPORT
 
 PCLOUD_BINAPI_SERVER = "binapi.pcloud.com"
 PCLOUD_PORT = 80
 PCLOUD_SSL_PORT = 443
 
+# chunks of sent data
+SEND_CHUNK_SIZE = 1024 * 1024
+SENDFILE_CHUNK_SIZE = 16 * 1024 * 1024
+
+# chunks of received data in write_data grow from the first to the second
+RECV_CHUNK_SIZE = 64 * 1024
+MAX_RECV_CHUNK_SIZE = 1024 * 1024
+
+
+def _file_descriptor(data):
+    """Returns the descriptor of a regular file data reads from, or None."""
+    try:
+        fileno = data.fileno()
+        if not data.seekable() or not stat.S_ISREG(os.fstat(fileno).st_mode):
+            return None
+    except (AttributeError, OSError, ValueError):
+        # io.UnsupportedOperation is both OSError and ValueError
+        return None
+    return fileno
+
+
+# (key, type flag) -> encoded key with its type/length byte
+_KEY_PREFIXES = {}
+_KEY_PREFIXES_MAX = 4096
+
+
+def _encode_param(parts, key, value):
+    """Appends the encoding of a single parameter to parts."""
+    cls = value.__class__
+    if cls is str:
+        value = value.encode('utf-8')
+        flag = 0
+    elif cls is int and value >= 0:
+        flag = 0x40
+    else:
+        if isinstance(value, int) and value < 0:
+            # negative numbers are converted to string
+            value = str(value)
+
+        if isinstance(value, list):
+            # lists (usually ints) are joined with ,
+            value = ','.join(map(str, value))
+
+        if isinstance(value, str):
+            value = value.encode('utf-8')
+
+        # NOTE: bools are ints, so they are sent as ints
+        if isinstance(value, bytes):
+            flag = 0
+        elif isinstance(value, int):
+            flag = 0x40
+        else:
+            raise ValueError("Unknown value type {0}".format(type(value)))
+
+    prefix = _KEY_PREFIXES.get((key, flag))
+    if prefix is None:
+        encoded_key = key.encode('utf-8')
+        key_len = len(encoded_key)
+        assert key_len < 64, "Parameter name too long"
+        prefix = (key_len | flag).to_bytes(1, 'little') + encoded_key
+        if len(_KEY_PREFIXES) >= _KEY_PREFIXES_MAX:
+            _KEY_PREFIXES.clear()
+        _KEY_PREFIXES[(key, flag)] = prefix
+
+    if flag:
+        parts += (prefix, value.to_bytes(8, 'little'))
+    else:
+        parts += (prefix, len(value).to_bytes(4, 'little'), value)
+
+
+class _PCloudBinaryCodec(object):
+    """Encoding of requests and decoding of responses of the binary protocol.
+
+    Shared by the blocking and the asyncio connections.
+
+    The constant part of the requests (the method and the encoded
+    persistent_params) is kept in templates, so only the parameters of
+    the call are encoded each time.
+    """
+
+    _templates = None
+    _templates_params = None
+
+    def _request_template(self, method, has_data):
+        """Returns (method length and name, persistent params block, count).
+
+        The templates are rebuilt when persistent_params changes.
+        """
+        persistent_params = tuple(self.persistent_params.items())
+        if persistent_params != self._templates_params:
+            self._templates = {}
+            try:
+                hash(persistent_params)
+                self._templates_params = persistent_params
+            except TypeError:
+                # unhashable values (e.g. lists), do not cache
+                self._templates_params = None
+
+        template = self._templates.get((method, has_data))
+        if template is None:
+            method_name = method.encode('utf-8')
+            method_len = len(method_name)
+            assert method_len < 128
+
+            if has_data:
+                method_len |= 0x80
+
+            block = []
+            for key, value in persistent_params:
+                _encode_param(block, key, value)
+            template = (method_len.to_bytes(1, 'little') + method_name,
+                        b''.join(block),
+                        len(persistent_params))
+            if self._templates_params is not None:
+                self._templates[(method, has_data)] = template
+        return template
+
+    def _encode_request(self, method, params, data_len):
+        """Returns the request frame including its length.
+
+        NOTE: persistent_params overrides any values in params
+        """
+        method_head, persistent_block, persistent_count = \
+            self._request_template(method, data_len is not None)
+        persistent_params = self.persistent_params
+
+        parts = []
+        overridden = False
+        for key, value in params.items():
+            if key in persistent_params:
+                value = persistent_params[key]
+                overridden = True
+            _encode_param(parts, key, value)
+        count = len(params) + persistent_count
+        if overridden:
+            # keep the order of params.update(persistent_params): the
+            # overridden keys stay where params has them, so the cached
+            # block does not apply
+            block = []
+            count = len(params)
+            for key, value in persistent_params.items():
+                if key not in params:
+                    _encode_param(block, key, value)
+                    count += 1
+            persistent_block = b''.join(block)
+
+        if data_len is not None:
+            # the data length goes between the method length and name
+            method_head = b''.join((method_head[:1],
+                                    data_len.to_bytes(8, 'little'),
+                                    method_head[1:]))
+        req_len = (len(method_head) + 1 + sum(map(len, parts)) +
+                   len(persistent_block))
+        assert req_len < 65536, "Request too long {0}".format(req_len)
+
+        return b''.join((req_len.to_bytes(2, 'little'),
+                         method_head,
+                         count.to_bytes(1, 'little'),
+                         b''.join(parts),
+                         persistent_block))
+
+    def _determine_data_len(self, data, data_len=None):
+        if data is None:
+            data_len = None
+        elif data_len is None: # and data is not None
+            try:
+                data_len = memoryview(data).nbytes
+            except TypeError:
+                data_len = getattr(data, '__len__', lambda : None)()
+            if data_len is None:
+                if isinstance(data, io.IOBase) and data.seekable():
+                    pos = data.tell()
+                    data_len = data.seek(0, io.SEEK_END) - pos
+                    data.seek(pos, io.SEEK_SET)
+            if data_len is None:
+                raise ValueError("Unable to determine data length")
+        return data_len
 
-class PCloudBinaryConnection(AbstractPCloudConnection):
+    def _decode_frame(self, frame):
+        return decode(frame)
+
+
+class PCloudBinaryConnection(_PCloudBinaryCodec, AbstractPCloudConnection):
     """Connection to pcloud.com based on their json protocol.
 
     NOTE: .connect() must be called to establish network communication.
@@ -20,21 +210,37 @@ class PCloudBinaryConnection(AbstractPCloudConnection):
                  use_ssl=True, server=PCLOUD_BINAPI_SERVER, port=None,
                  timeout=30,
                  auth=None,
-                 persistent_params=None):
+                 persistent_params=None,
+                 transport=None,
+                 endpoints=None,
+                 instrumentation=None):
         """Initializes the API.
 
+        :param server: the server or a list of candidate servers, the first
+            is used unless endpoints is given
         :param persistent_params: a dict that augments params on each command,
             this is useful for storing auth data.
+        :param transport: PCloudTransport establishing the connection, share
+            one between connections to reuse its SSLContext and TLS sessions
+        :param endpoints: PCloudEndpointSelector, the connection goes to the
+            fastest of the servers (failing over to the next ones)
+        :param instrumentation: PCloudInstrumentation told about the frames
+            and data sent and received
 
         NOTE: persistent_params overrides any values in params on send_command
         NOTE: .connect() must be called to establish network communication.
         """
         self.use_ssl = use_ssl
-        self.server = server
+        self.servers = [server] if isinstance(server, str) else list(server)
+        self.server = self.servers[0] # the connected one after .connect()
         self.port = port or (self.use_ssl and PCLOUD_SSL_PORT or PCLOUD_PORT)
         self.timeout = timeout
+        self.transport = transport or DEFAULT_TRANSPORT
+        self.endpoints = endpoints
+        self.instrumentation = instrumentation
         self.socket = None
         self.fp = None
+        self._broken = False
         if persistent_params is None:
             self.persistent_params = {}
         else:
@@ -54,6 +260,9 @@ class PCloudBinaryConnection(AbstractPCloudConnection):
             - _noresult - if no result should be returned (you must call
                 .get_result manually)
         :returns dictionary returned by the api or None if _noresult is set
+
+        NOTE: a failure while sending or receiving leaves the stream out
+            of sync, the connection is reconnected before the next command.
         """
         data = params.pop('_data', None)
         data_progress_callback = params.pop('_data_progress_callback', None)
@@ -65,100 +274,109 @@ class PCloudBinaryConnection(AbstractPCloudConnection):
         if not noresult:
             return self.get_result()
 
+    @contextlib.contextmanager
+    def _breaking(self):
+        """Marks the connection broken if the block fails, it may have
+        sent or received part of a request or response.
+        """
+        try:
+            yield
+        except:
+            self._broken = True
+            raise
+
+    def _read(self, size):
+        with self._breaking():
+            return self.fp.read(size)
+
     def connect(self):
         """Establish connection and return self."""
         if self.socket:
             raise ValueError("maybe connect called twice?")
-        self.socket = create_connection(self.server,
-                                        self.port,
-                                        self.timeout,
-                                        self.use_ssl)
+        if self.endpoints is not None:
+            self.server, self.socket = self.endpoints.connect(
+                    self.servers,
+                    lambda server: create_connection(server,
+                                                     self.port,
+                                                     self.timeout,
+                                                     self.use_ssl,
+                                                     self.transport))
+        else:
+            self.socket = create_connection(self.server,
+                                            self.port,
+                                            self.timeout,
+                                            self.use_ssl,
+                                            self.transport)
         raw = socket.SocketIO(self.socket, 'rwb')
         self.socket._io_refs += 1
         self.fp = PCloudBuffer(raw, raw, 8192)
+        self._broken = False
         return self
 
-    def _prepare_send_request(self, method, params, data_len):
-        req = bytearray()
-        # actually preallocating would be more efficient but...
-
-        method_name = method.encode('utf-8')
-        method_len = len(method_name)
-        assert method_len < 128
-
-        if data_len is not None:
-            method_len |= 0x80
-
-        req.extend(method_len.to_bytes(1, 'little'))
-        if data_len is not None:
-            req.extend(data_len.to_bytes(8, 'little'))
-
-        req.extend(method_name)
-        req.extend(len(params).to_bytes(1, 'little'))
-
-        for key,value in params.items():
-            key = key.encode('utf-8')
-            key_len = len(key)
-            assert key_len < 64, "Parameter name too long"
-
-            if isinstance(value, int) and value < 0:
-                # negative numbers are converted to string
-                value = str(value)
-
-            if isinstance(value, list):
-                # lists (usually ints) are joined with ,
-                value = ','.join(map(str, value))
-
-            if isinstance(value, str):
-                value = value.encode('utf-8')
-
-            if isinstance(value, bytes):
-                req.extend(key_len.to_bytes(1, 'little'))
-                req.extend(key)
-                req.extend(len(value).to_bytes(4, 'little'))
-                req.extend(value)
-            elif isinstance(value, int):
-                req.extend((key_len | 0x40).to_bytes(1, 'little'))
-                req.extend(key)
-                req.extend(value.to_bytes(8, 'little'))
-            elif isinstance(value, bool):
-                req.extend((key_len | 0x80).to_bytes(1, 'little'))
-                req.extend(key)
-                req.extend(value.to_bytes(1, 'little'))
-            else:
-                raise ValueError("Unknown value type {0}".format(type(value)))
-
-        return req
-
     def _send_raw_data(self, data, data_len, progress_callback):
-        """Sends data at the end of send_command."""
+        """Sends data at the end of send_command.
+
+        Files are sent with sendfile on plain sockets and from a memory
+        map with ssl, other streams are read in SEND_CHUNK_SIZE chunks.
+        Buffers (bytes, memoryview, mmap, ...) are sent without copies.
+        """
+        instrumentation = self.instrumentation
+        if instrumentation is not None:
+            started = time.monotonic()
+            size = data_len
+        if progress_callback:
+            progress_callback = ProgressThrottle(progress_callback)
         if isinstance(data, io.IOBase):
-            written_bytes, to_write = 0, data_len
-            while data_len > 0:
-                to_write = min(data_len, 8192)
-                if to_write != self.fp.write(data.read(to_write)):
+            fileno = _file_descriptor(data)
+            if fileno is not None and data_len > 0:
+                pos = data.tell()
+                if not isinstance(self.socket, ssl.SSLSocket):
+                    self._sendfile(data, pos, data_len, progress_callback)
+                else:
+                    with mmap.mmap(fileno, 0, access=mmap.ACCESS_READ) as mapped:
+                        if pos + data_len > len(mapped):
+                            raise IOError("Mismatch between bytes written and supplied data length")
+                        with memoryview(mapped) as view:
+                            self._send_buffer(view[pos:pos + data_len],
+                                              progress_callback)
+                    data.seek(pos + data_len)
+            else:
+                while data_len > 0:
+                    to_write = min(data_len, SEND_CHUNK_SIZE)
+                    if to_write != self.fp.write(data.read(to_write)):
+                        raise IOError("Mismatch between bytes written and supplied data length")
+                    data_len -= to_write
+                    if progress_callback:
+                        progress_callback(to_write)
+        else:
+            with memoryview(data) as view, view.cast('B') as view:
+                if view.nbytes != data_len:
                     raise IOError("Mismatch between bytes written and supplied data length")
-                data_len -= to_write
+                self._send_buffer(view, progress_callback)
+        if progress_callback:
+            progress_callback.flush()
+        if instrumentation is not None:
+            instrumentation.on_data('sent', size, time.monotonic() - started)
+
+    def _send_buffer(self, view, progress_callback):
+        for offset in range(0, len(view), SEND_CHUNK_SIZE):
+            with view[offset:offset + SEND_CHUNK_SIZE] as chunk:
+                self.fp.write(chunk)
                 if progress_callback:
-                    progress_callback(to_write)
-        else:
-            written_bytes = self.fp.write(data)
-            if written_bytes != data_len:
+                    progress_callback(len(chunk))
+
+    def _sendfile(self, data, pos, data_len, progress_callback):
+        """Sends data_len bytes of the file data from pos by sendfile."""
+        self.fp.flush() # the request goes first
+        end = pos + data_len
+        while pos < end:
+            count = min(end - pos, SENDFILE_CHUNK_SIZE)
+            sent = self.socket.sendfile(data, pos, count)
+            if sent != count:
                 raise IOError("Mismatch between bytes written and supplied data length")
-
-    def _determine_data_len(self, data, data_len=None):
-        if data is None:
-            data_len = None
-        elif data_len is None: # and data is not None
-            data_len = getattr(data, '__len__', lambda : None)()
-            if data_len is None:
-                if isinstance(data, io.IOBase) and data.seekable():
-                    pos = data.tell()
-                    data_len = data.seek(0, io.SEEK_END) - pos
-                    data.seek(pos, io.SEEK_SET)
-            if data_len is None:
-                raise ValueError("Unable to determine data length")
-        return data_len
+            pos += sent
+            if progress_callback:
+                progress_callback(sent)
 
     def send_command_nb(self,
                         method, params,
@@ -166,90 +384,108 @@ class PCloudBinaryConnection(AbstractPCloudConnection):
                         data_progress_callback=None):
         """Send command without blocking.
 
-        NOTE: params is updated with self.persistent_params
-
         :param data_len: if not None should be consistent with data.
         :param data_progress_callback: called only for data which is io.IOBase
         """
+        if self._broken:
+            # nothing of this command is sent yet, safe for any method
+            self.reconnect()
+        if self.fp is None:
+            raise IOError("Not connected")
         data_len = self._determine_data_len(data, data_len)
 
-        params.update(self.persistent_params)
+        # the whole request with a single write
+        request = self._encode_request(method, params, data_len)
+        with self._breaking():
+            self.fp.write(request)
+            if self.instrumentation is not None:
+                self.instrumentation.on_frame('sent', len(request), method)
 
-        req = self._prepare_send_request(method, params, data_len)
-        assert len(req) < 65536, "Request too long {0}".format(len(req))
+            if data is not None:
+                self._send_raw_data(data, data_len, data_progress_callback)
 
-        self.fp.write(len(req).to_bytes(2, 'little'))
-        self.fp.write(req)
-
-        if data is not None:
-            self._send_raw_data(data, data_len, data_progress_callback)
-
-        self.fp.flush()
+            self.fp.flush()
 
     def get_result(self):
         """Return the result from a call to the pcloud API."""
-        self.fp.read(4) # FIXME: ignores length, seems it is not needed? ASK
-        return self._read_object(strings=dict())
+        return self._decode_frame(self._read_frame())
+
+    def _read_frame(self):
+        """Reads a whole response (without any data following it).
+
+        The response is prefixed by its length, so even if decoding fails
+        the stream stays in sync for the following responses.
+        """
+        frame_len = int.from_bytes(self._read(4), 'little')
+        if self.instrumentation is not None:
+            self.instrumentation.on_frame('received', frame_len)
+        return self._read(frame_len)
+
+    def iter_result_events(self):
+        """Returns the result of a command as an iterator of parse events.
+
+        The result is decoded incrementally as it is read from the socket,
+        see decoder.iter_events.
+        NOTE: exhaust or close the iterator before the next command.
+        """
+        frame_len = int.from_bytes(self._read(4), 'little')
+        if self.instrumentation is not None:
+            self.instrumentation.on_frame('received', frame_len)
+        return iter_events(self._read, frame_len)
+
+    def iter_listfolder(self, **params):
+        """Calls listfolder and yields the metadata entries as they arrive.
+
+        Useful with recursive=1 on big trees, the result is never built in
+        memory, see decoder.iter_folder_entries for the entries.
+        NOTE: the command is sent when the iteration starts, exhaust or
+            close the iterator before the next command.
+
+        :raises PCloudException if the result is not 0
+        """
+        root_path = params.get('path')
+        # sent lazily, an iterator closed before starting leaves no reply
+        self.send_command_nb('listfolder', params)
+        events = self.iter_result_events()
+        try:
+            yield from iter_folder_entries(events, root_path=root_path)
+        finally:
+            events.close() # drains the rest of the reply
+
+    def pipeline(self, max_in_flight=32, check_result=False,
+                 instrumentation=None):
+        """Returns a PCloudPipeline sending commands over this connection.
+
+        :param max_in_flight: maximum number of unanswered commands
+        :param check_result: futures raise PCloudException if result != 0
+        :param instrumentation: PCloudInstrumentation told about the commands
+        """
+        return PCloudPipeline(self,
+                              max_in_flight=max_in_flight,
+                              check_result=check_result,
+                              instrumentation=instrumentation)
 
-    def _read_object(self, strings):
-        obj_type = self.fp.read(1)[0]
-        # TODO: optimize checks based on actual usage
+    def read_data(self, data_len, buffer=None):
+        """Reads the data of a response.
 
-        if (obj_type <= 3) or (100 <= obj_type <= 149):
-            # new string
-            if 100 <= obj_type:
-                str_len = obj_type - 100
+        :param buffer: writable buffer (e.g. bytearray, memoryview, mmap) of
+            at least data_len bytes to read the data into, without copies
+        :returns the data, or a memoryview of buffer holding it
+        """
+        if self.instrumentation is not None:
+            started = time.monotonic()
+        with self._breaking():
+            if buffer is None:
+                data = self.fp.read(data_len)
             else:
-                str_len = int.from_bytes(self.fp.read(obj_type + 1), 'little')
-            string = self.fp.read(str_len).decode('utf-8')
-            strings[len(strings)] = string
-            return string
-        if 4 <= obj_type <= 7:
-            # existing string, long index
-            return strings[int.from_bytes(self.fp.read(obj_type - 3), 'little')]
-        if 8 <= obj_type <= 15:
-            # int
-            return int.from_bytes(self.fp.read(obj_type - 7), 'little')
-        if obj_type == 16:
-            # hash
-            # FIXME: potential stack overflow
-            # FIXME: with the current api, only listfolder(recursive=1)
-            result = dict()
-            while self.fp.peek(1)[0] != 255:
-                key = self._read_object(strings)
-                result[key] = self._read_object(strings)
-            self.fp.read(1) # consume byte 255
-            return result
-        if obj_type == 17:
-            # list
-            # FIXME: potential stack overflow
-            # FIXME: with the current api, only listfolder(recursive=1)
-            result = []
-            while self.fp.peek(1)[0] != 255:
-                result.append(self._read_object(strings))
-            self.fp.read(1) # consume byte 255
-            return result
-        if obj_type == 18:
-            return False
-        if obj_type == 19:
-            return True
-        if obj_type == 20:
-            # data, return data_length
-            # be sure to consume the data
-            return int.from_bytes(self.fp.read(8), 'little')
-        if 150 <= obj_type <= 199:
-            # existing string, short index
-            return strings[obj_type - 150]
-        if 200 <= obj_type <= 219:
-            # int, inline
-            return obj_type - 200
-        #if obj_type == 255: raise StopIteration
-
-        # nothing matched
-        raise ValueError("Unknown value returned: {0}".format(obj_type))
-
-    def read_data(self, data_len):
-        return self.fp.read(data_len)
+                data = memoryview(buffer).cast('B')[:data_len]
+                if len(data) != data_len:
+                    raise ValueError("Buffer smaller than the data")
+                self.fp.readinto(data)
+        if self.instrumentation is not None:
+            self.instrumentation.on_data('received', data_len,
+                                         time.monotonic() - started)
+        return data
 
     def get_data_stream(self):
         """Returns raw stream, from the socket.
@@ -259,18 +495,103 @@ class PCloudBinaryConnection(AbstractPCloudConnection):
         """
         return self.fp
 
-    def write_data(self, writer, data_len, progress_callback=None):
+    def write_data(self, writer, data_len, progress_callback=None,
+                   digests=(), chunk_size=None):
         """Write data from response.
 
+        The data is received into a reused buffer, starting with
+        RECV_CHUNK_SIZE chunks growing up to MAX_RECV_CHUNK_SIZE.
+
+        :param digests: hashlib objects updated with the data written,
+            e.g. the values of checksums.new_digests()
+        :param chunk_size: fixed size of the chunks instead
         NOTE: Be sure to consume all of it.
         """
-        while data_len > 0:
-            to_write = min(8192, data_len)
-            assert to_write == writer.write(self.fp.read(to_write))
-            data_len -= to_write
-            if progress_callback:
-                progress_callback(to_write)
+        if self.instrumentation is not None:
+            started = time.monotonic()
+            total = data_len
+        with self._breaking():
+            size = chunk_size or RECV_CHUNK_SIZE
+            max_size = chunk_size or MAX_RECV_CHUNK_SIZE
+            buf = memoryview(bytearray(min(max_size, data_len)))
+            while data_len > 0:
+                to_write = min(size, data_len)
+                chunk = buf[:to_write]
+                self.fp.readinto(chunk)
+                for digest in digests:
+                    digest.update(chunk)
+                while chunk:
+                    # raw files may write less than given
+                    written = writer.write(chunk)
+                    if not written:
+                        raise IOError("Writer did not accept the data")
+                    chunk = chunk[written:]
+                data_len -= to_write
+                if progress_callback:
+                    progress_callback(to_write)
+                size = min(2 * size, max_size)
+        if self.instrumentation is not None:
+            self.instrumentation.on_data('received', total,
+                                         time.monotonic() - started)
+
+    def write_data_to_file(self, path, data_len, progress_callback=None,
+                           digests=()):
+        """Write data from response directly into a new file at path.
+
+        The file is preallocated and mapped into memory, so the data is
+        received straight into it.
+        NOTE: Be sure to consume all of it (an exception leaves the stream
+            out of sync, the connection is reconnected before the next
+            command).
+        """
+        if self.instrumentation is not None:
+            started = time.monotonic()
+        with self._breaking(), open(path, 'w+b') as f:
+            if data_len > 0: # empty files cannot be mapped
+                if hasattr(os, 'posix_fallocate'):
+                    os.posix_fallocate(f.fileno(), 0, data_len)
+                else:
+                    f.truncate(data_len)
+                with mmap.mmap(f.fileno(), data_len) as mapped, \
+                        memoryview(mapped) as view:
+                    offset = 0
+                    size = RECV_CHUNK_SIZE
+                    while offset < data_len:
+                        with view[offset:offset + size] as chunk:
+                            self.fp.readinto(chunk)
+                            for digest in digests:
+                                digest.update(chunk)
+                            received = len(chunk)
+                        offset += received
+                        if progress_callback:
+                            progress_callback(received)
+                        size = min(2 * size, MAX_RECV_CHUNK_SIZE)
+        if self.instrumentation is not None:
+            self.instrumentation.on_data('received', data_len,
+                                         time.monotonic() - started)
+
+    def reconnect(self):
+        """Drops the connection and establishes a new one, returns self.
+
+        A failure in the middle of a command (e.g. a truncated frame)
+        leaves the stream out of sync, the connection is unusable until
+        reconnected.
+        NOTE: the file descriptors (file_open) of the old connection are lost.
+        """
+        if self.endpoints is not None:
+            self.endpoints.report_failure(self.server) # fail over
+        sock, fp = self.socket, self.fp
+        self.socket = self.fp = None
+        for closeable in (fp, sock):
+            if closeable is not None:
+                try:
+                    closeable.close()
+                except (IOError, ValueError):
+                    pass
+        return self.connect()
 
     def close(self):
+        # TLS 1.3 tickets arrive after the handshake
+        self.transport.save_session(self.socket, self.server, self.port)
         self.socket.close()
 
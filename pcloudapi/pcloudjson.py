@@ -1,6 +1,9 @@
 #!/usr/bin/env python3
 
+import io
+
 import requests
+from requests.adapters import HTTPAdapter
 
 from .connection import AbstractPCloudConnection
 
@@ -8,11 +11,47 @@ PCLOUD_SERVER = "api.pcloud.com"
 PCLOUD_PORT = 80
 PCLOUD_SSL_PORT = 443
 
+CHUNK_SIZE = 65536
+
+
+class _ProgressReader(object):
+    """File-like wrapper reporting the bytes read to a callback.
+
+    Has __len__, so requests streams it with a Content-Length.
+    """
+
+    def __init__(self, fp, length, callback):
+        self.fp = fp
+        self.length = length
+        self.callback = callback
+
+    def __len__(self):
+        return self.length
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.length:
+            size = self.length
+        data = self.fp.read(size)
+        self.length -= len(data)
+        if data and self.callback:
+            self.callback(len(data))
+        return data
+
+
+def _iter_progress(data, callback):
+    for chunk in data:
+        if callback:
+            callback(len(chunk))
+        yield chunk
+
+
 class PCloudJSONConnection(AbstractPCloudConnection):
 
     """Connection to pcloud.com based on their json protocol.
 
-    NOTE: loads the whole file in memory on data upload.
+    Commands go through a requests.Session, so the connections to the
+    server are kept alive and reused.
+    Data is streamed from files and iterators, bytes are sent as they are.
     """
 
     def __init__(self,
@@ -20,11 +59,14 @@ class PCloudJSONConnection(AbstractPCloudConnection):
                  server=PCLOUD_SERVER, port=None,
                  timeout=30,
                  auth=None,
-                 persistent_params=None):
+                 persistent_params=None,
+                 pool_size=10):
         """Connection to pcloud.com based on their json protocol.
 
         persistent_params is a dict that augments params on each command,
         this is useful for storing auth data.
+        pool_size is the number of connections kept alive, set it to the
+        number of threads sharing the connection.
 
         NOTE: persistent_params overrides any values in params on send_command
         """
@@ -41,13 +83,19 @@ class PCloudJSONConnection(AbstractPCloudConnection):
                             server=server,
                             port=port or (use_ssl and 443 or 80)
                         )
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size,
+                              pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
 
     def send_command(self, method, **params):
         """Sends command and returns result. Blocks if result is needed.
 
         :param method: the pcloud method to call
         :param **params: parameters to be passed to the api, except:
-            - '_data' is the file data
+            - '_data' is the file data: bytes, binary file or
+                an iterator of bytes (sent with chunked encoding)
             - '_data_progress_callback' is the upload callback
         :returns dictionary returned by the api
         """
@@ -56,10 +104,12 @@ class PCloudJSONConnection(AbstractPCloudConnection):
 
         params.update(self.persistent_params)
 
-        #TODO: actually use the callback, probably chunk encoding
-        execute_request = data is None and requests.get or requests.put
+        if data is None:
+            execute_request = self.session.get
+        else:
+            execute_request = self.session.put
+            data = self._prepare_data(data, data_progress_callback)
 
-        #FIXME: currently loads the whole file into memory
         r = execute_request(self.baseurl + method,
                             params=params,
                             data=data,
@@ -69,4 +119,20 @@ class PCloudJSONConnection(AbstractPCloudConnection):
 
         return r.json()
 
-
+    def _prepare_data(self, data, progress_callback):
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            if not progress_callback:
+                return data
+            data = io.BytesIO(data)
+        if isinstance(data, io.IOBase):
+            if data.seekable():
+                pos = data.tell()
+                length = data.seek(0, io.SEEK_END) - pos
+                data.seek(pos, io.SEEK_SET)
+                return _ProgressReader(data, length, progress_callback)
+            fp = data
+            data = iter(lambda: fp.read(CHUNK_SIZE), b'')
+        return _iter_progress(data, progress_callback)
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+
+import collections
+import time
+from concurrent.futures import Future
+
+from .exceptions import PCloudException
+
+
+class PCloudPipeline(object):
+    """Pipelines commands over a single PCloudBinaryConnection.
+
+    Commands are sent without waiting for the previous replies, keeping at
+    most max_in_flight of them unanswered. Results are delivered in order
+    as concurrent.futures.Future objects.
+
+    NOTE: the connection must not be used for anything else while the
+        pipeline has commands in flight.
+    NOTE: replies carrying data (e.g. file_read, getzip) have the data read
+        into memory and stored in the result under '_data'.
+
+    Usage:
+        with conn.pipeline() as pipe:
+            futures = [pipe.submit('stat', path=p) for p in paths]
+        results = [f.result() for f in futures]
+    """
+
+    def __init__(self, connection, max_in_flight=32, check_result=False,
+                 instrumentation=None):
+        """Initializes the pipeline.
+
+        :param connection: connected PCloudBinaryConnection
+        :param max_in_flight: maximum number of commands sent but not
+            yet answered
+        :param check_result: if set futures of commands with
+            result != 0 raise PCloudException
+        :param instrumentation: PCloudInstrumentation told about each
+            command (on_request) when its reply arrives, like
+            PCloudAPI.make_request does
+        """
+        if max_in_flight < 1:
+            raise ValueError("max_in_flight must be positive")
+        self.connection = connection
+        self.max_in_flight = max_in_flight
+        self.check_result = check_result
+        self.instrumentation = instrumentation
+        self._in_flight = collections.deque() # (future, method, sent at)
+        self._error = None
+
+    def submit(self, method, **params):
+        """Sends the command and returns a Future for its result.
+
+        Blocks reading replies while max_in_flight commands are unanswered.
+        Accepts the same parameters as PCloudBinaryConnection.send_command.
+        """
+        if self._error is not None:
+            raise self._error
+        while len(self._in_flight) >= self.max_in_flight:
+            self._receive_one()
+
+        data = params.pop('_data', None)
+        data_progress_callback = params.pop('_data_progress_callback', None)
+        future = Future()
+        started = time.monotonic()
+        try:
+            self.connection.send_command_nb(
+                                method,
+                                params,
+                                data=data,
+                                data_progress_callback=data_progress_callback)
+        except Exception as e:
+            # the request might have been partially written
+            self._break(e)
+            self._report(method, started, error=e)
+            raise
+        future.set_running_or_notify_cancel()
+        self._in_flight.append((future, method, started))
+        return future
+
+    def map(self, method, params_list):
+        """Submits method once for each params dict, yields results in order.
+
+        Results are yielded as soon as they arrive, so params_list can be
+        an arbitrarily long iterator.
+        """
+        pending = collections.deque()
+        for params in params_list:
+            pending.append(self.submit(method, **params))
+            while pending and pending[0].done():
+                yield pending.popleft().result()
+        while pending:
+            if not pending[0].done():
+                self._receive_one()
+            else:
+                yield pending.popleft().result()
+
+    def results(self):
+        """Yields the results of all in flight commands in order.
+
+        Raises the exception of the first failed command.
+        """
+        while self._in_flight:
+            future = self._in_flight[0][0]
+            self._receive_one()
+            yield future.result()
+
+    def flush(self):
+        """Waits for all in flight commands to finish."""
+        while self._in_flight:
+            self._receive_one()
+
+    def _report(self, method, started, result=None, error=None):
+        if self.instrumentation is not None:
+            self.instrumentation.on_request(method,
+                                            time.monotonic() - started,
+                                            result=result, error=error)
+
+    def _receive_one(self):
+        future, method, started = self._in_flight.popleft()
+        try:
+            frame = self.connection._read_frame()
+        except Exception as e:
+            # the stream is out of sync, nothing more can be received
+            future.set_exception(e)
+            self._report(method, started, error=e)
+            self._break(e)
+            return
+
+        try:
+            result = self.connection._decode_frame(frame)
+        except Exception as e:
+            # the frame length is known, so the next reply can still be read
+            future.set_exception(e)
+            self._report(method, started, error=e)
+            return
+
+        if isinstance(result, dict) and 'data' in result:
+            try:
+                result['_data'] = self.connection.read_data(result['data'])
+            except Exception as e:
+                future.set_exception(e)
+                self._report(method, started, error=e)
+                self._break(e)
+                return
+
+        self._report(method, started, result=result.get('result'))
+        if self.check_result and result.get('result') != 0:
+            future.set_exception(
+                    PCloudException(result_code=result.get('result')))
+        else:
+            future.set_result(result)
+
+    def _break(self, error):
+        self._error = IOError("Pipeline broken: {0}".format(error))
+        # reconnected before its next command
+        self.connection._broken = True
+        while self._in_flight:
+            future, method, started = self._in_flight.popleft()
+            future.set_exception(self._error)
+            self._report(method, started, error=self._error)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        if self._error is None:
+            self.flush()
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+
+import collections
+import contextlib
+import select
+import threading
+import time
+
+from .connection import AbstractPCloudConnection
+from .pcloudbin import PCloudBinaryConnection
+from .pipeline import PCloudPipeline
+
+
+def is_connection_clean(connection):
+    """Default health check for idle connections.
+
+    An idle connection should have nothing to read, readable means either
+    the server closed it or there are leftovers from an unconsumed response.
+    """
+    sock = getattr(connection, 'socket', None)
+    if sock is None:
+        return True # nothing to check, e.g. PCloudJSONConnection
+    if sock.fileno() == -1:
+        return False
+    if getattr(sock, 'pending', lambda: 0)():
+        return False
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+    except (OSError, ValueError):
+        return False
+    return not readable
+
+
+class PCloudConnectionPool(AbstractPCloudConnection):
+    """Thread-safe pool of pcloud connections.
+
+    Each command borrows a connection, so a single PCloudAPI using the pool
+    can be shared between threads:
+
+        api = PCloudAPI(connection=PCloudConnectionPool(max_size=16))
+
+    Connections are created lazily up to max_size, connections idle for
+    more than idle_timeout are closed (keeping min_size) and connections
+    that fail during a command are dropped instead of being reused.
+
+    NOTE: commands returning data (e.g. getzip, file_read) must be executed
+        through .connection() so the data can be consumed, send_command
+        discards the connection in that case.
+    """
+
+    def __init__(self,
+                 connection=PCloudBinaryConnection,
+                 min_size=0, max_size=8,
+                 idle_timeout=300,
+                 wait_timeout=None,
+                 health_check=is_connection_clean,
+                 auth=None,
+                 persistent_params=None,
+                 **connection_kwargs):
+        """Initializes the pool.
+
+        :param connection: AbstractPCloudConnection class or a callable
+            creating (not yet connected) connections, called with
+            persistent_params and **connection_kwargs
+        :param min_size: connections kept open even when idle
+        :param max_size: maximum number of open connections
+        :param idle_timeout: seconds after which idle connections are closed
+        :param wait_timeout: seconds to wait for a free connection when
+            max_size is reached, None waits forever
+        :param health_check: callable(connection) -> bool run on each idle
+            connection before lending it, None disables it
+        :param persistent_params: shared by all connections in the pool
+        :param **connection_kwargs: passed to connection, e.g. use_ssl
+        """
+        if not 0 <= min_size <= max_size or max_size < 1:
+            raise ValueError("Expected 0 <= min_size <= max_size, 1 <= max_size")
+        self.connection_factory = connection
+        self.connection_kwargs = connection_kwargs
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.wait_timeout = wait_timeout
+        self.health_check = health_check
+        self.use_ssl = connection_kwargs.get('use_ssl', True)
+        self.timeout = connection_kwargs.get('timeout', 30)
+        if persistent_params is None:
+            self.persistent_params = {}
+        else:
+            self.persistent_params = persistent_params
+        if auth is not None:
+            self.auth = auth
+
+        self._lock = threading.Condition()
+        self._idle = collections.deque() # (connection, last_used), newest last
+        self._size = 0 # idle + lent connections
+        self._closed = False
+
+    def connect(self):
+        """Opens min_size connections and returns self."""
+        connections = [self.acquire() for _ in range(self.min_size)]
+        for conn in connections:
+            self.release(conn)
+        return self
+
+    def _create_connection(self):
+        return self.connection_factory(
+                        persistent_params=self.persistent_params,
+                        **self.connection_kwargs
+                    ).connect()
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _evict_idle(self):
+        """Removes expired idle connections, returns them. Call locked."""
+        if self.idle_timeout is None:
+            return []
+        expired = []
+        deadline = time.monotonic() - self.idle_timeout
+        # oldest are first
+        while (self._idle and self._size > self.min_size
+               and self._idle[0][1] < deadline):
+            expired.append(self._idle.popleft()[0])
+            self._size -= 1
+        return expired
+
+    def acquire(self):
+        """Borrows a connection, it must be given back by .release()."""
+        deadline = (None if self.wait_timeout is None
+                    else time.monotonic() + self.wait_timeout)
+        while True:
+            conn = None
+            with self._lock:
+                if self._closed:
+                    raise ValueError("Pool is closed")
+                expired = self._evict_idle()
+                while not self._idle and self._size >= self.max_size:
+                    timeout = None
+                    if deadline is not None:
+                        timeout = deadline - time.monotonic()
+                        if timeout <= 0:
+                            raise TimeoutError("No free connection in pool")
+                    self._lock.wait(timeout)
+                    if self._closed:
+                        raise ValueError("Pool is closed")
+                if self._idle:
+                    conn = self._idle.pop()[0]
+                else:
+                    self._size += 1
+            for expired_conn in expired:
+                self._discard(expired_conn)
+
+            if conn is None:
+                try:
+                    return self._create_connection()
+                except BaseException: # e.g. KeyboardInterrupt too
+                    self._forget()
+                    raise
+            if self.health_check is None or self.health_check(conn):
+                return conn
+            self._discard(conn)
+            self._forget()
+
+    def _forget(self):
+        with self._lock:
+            self._size -= 1
+            self._lock.notify()
+
+    def release(self, conn, broken=False):
+        """Returns a borrowed connection to the pool.
+
+        :param broken: the connection is in unknown state and is closed
+        """
+        with self._lock:
+            if not (broken or self._closed):
+                self._idle.append((conn, time.monotonic()))
+                self._lock.notify()
+                return
+        self._discard(conn)
+        self._forget()
+
+    @contextlib.contextmanager
+    def connection(self):
+        """Lends a connection for the duration of the with block.
+
+        The connection is dropped if the block raises, GeneratorExit too
+        (a generator closed early may leave a reply unread).
+        NOTE: be sure to consume the whole response (including data).
+        """
+        conn = self.acquire()
+        broken = True
+        try:
+            yield conn
+            broken = False
+        finally:
+            self.release(conn, broken=broken)
+
+    def send_command(self, method, **params):
+        """Sends command on a borrowed connection and returns result.
+
+        See AbstractPCloudConnection.send_command.
+        """
+        if params.get('_noresult'):
+            raise ValueError("_noresult is not supported by the pool")
+        conn = self.acquire()
+        broken = True
+        try:
+            response = conn.send_command(method, **params)
+            # unconsumed data leaves the stream out of sync
+            broken = isinstance(response, dict) and 'data' in response
+        finally:
+            self.release(conn, broken=broken)
+        return response
+
+    def iter_listfolder(self, **params):
+        """See PCloudBinaryConnection.iter_listfolder.
+
+        The connection is borrowed until the iterator is exhausted or closed.
+        """
+        conn = self.acquire()
+        broken = True
+        try:
+            yield from conn.iter_listfolder(**params)
+            broken = False
+        except GeneratorExit:
+            # closed early, the reply was drained by conn.iter_listfolder
+            broken = False
+            raise
+        finally:
+            self.release(conn, broken=broken)
+
+    def pipeline(self, max_in_flight=32, check_result=False,
+                 instrumentation=None):
+        """Returns a pipeline over a borrowed connection.
+
+        The connection is returned to the pool when the pipeline is used
+        as a context manager and the with block ends.
+        """
+        return _PooledPipeline(self, self.acquire(),
+                               max_in_flight=max_in_flight,
+                               check_result=check_result,
+                               instrumentation=instrumentation)
+
+    def close(self):
+        """Closes idle connections, lent ones are closed on release."""
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, collections.deque()
+            self._size -= len(idle)
+            self._lock.notify_all()
+        for conn, _ in idle:
+            self._discard(conn)
+
+    @property
+    def size(self):
+        """Number of open connections, idle or lent."""
+        return self._size
+
+    @property
+    def idle_size(self):
+        """Number of idle connections."""
+        return len(self._idle)
+
+
+class _PooledPipeline(PCloudPipeline):
+
+    def __init__(self, pool, connection, **kwargs):
+        super().__init__(connection, **kwargs)
+        self.pool = pool
+
+    def __exit__(self, *args):
+        try:
+            super().__exit__(*args)
+        finally:
+            self.pool.release(self.connection,
+                              broken=(self._error is not None
+                                      or bool(self._in_flight)))
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+
+import collections
+import io
+import time
+
+from .exceptions import PCloudException
+from .pool import PCloudConnectionPool
+
+BLOCK_SIZE = 64 * 1024
+CACHE_BLOCKS = 256
+MAX_READ_AHEAD = 4 * 1024 * 1024
+
+
+class PCloudRemoteFile(io.RawIOBase):
+    """Read-only random access file over a remote pcloud file.
+
+    Reads are served from an LRU cache of blocks; missing blocks are read
+    with file_pread, consecutive ones in a single command and separate
+    runs pipelined. Sequential reads grow a read-ahead window (doubling up
+    to max_read_ahead), a seek elsewhere resets it, so scattered reads
+    (e.g. ZIP or Parquet footers) fetch little more than what they touch.
+
+        with api.open_remote('/archive.zip') as f:
+            zipfile.ZipFile(f).namelist()
+
+    The file holds an fd on a binary connection (borrowed from the pool
+    until closed if the api uses a PCloudConnectionPool). The position is
+    kept locally, so seeking costs nothing. It is not thread-safe.
+    """
+
+    def __init__(self, api, path=None, fileid=None,
+                 block_size=BLOCK_SIZE, cache_blocks=CACHE_BLOCKS,
+                 max_read_ahead=MAX_READ_AHEAD):
+        """Opens the remote file by path or fileid.
+
+        :param api: PCloudAPI using a binary connection (or a pool of them)
+        :param block_size: unit of reading and caching
+        :param cache_blocks: number of blocks kept in the cache
+        :param max_read_ahead: maximum bytes read past a sequential read
+        """
+        super().__init__()
+        self.block_size = block_size
+        self.cache_blocks = cache_blocks
+        self.max_read_ahead = max_read_ahead
+        self.name = path if path is not None else fileid
+        self.hits = 0
+        self.misses = 0
+        self._blocks = collections.OrderedDict() # index -> bytes
+        self._pos = 0
+        self._read_ahead = 0
+        self._next_sequential = 0
+
+        self._instrumentation = getattr(api, 'instrumentation', None)
+        self._pool = None
+        connection = api.connection
+        if isinstance(connection, PCloudConnectionPool):
+            self._pool = connection
+            connection = connection.acquire()
+        self._connection = connection
+        self._fd = None
+        try:
+            params = {'path': path} if path is not None else {'fileid': fileid}
+            self._fd = self._command('file_open', flags=0, **params)['fd']
+            self.size = self._command('file_size', fd=self._fd)['size']
+        except Exception:
+            if self._fd is not None:
+                try:
+                    self._command('file_close', fd=self._fd)
+                except (PCloudException, IOError):
+                    pass # broken connection, the fd is closed with it
+            self._release(broken=True)
+            raise
+
+    def _command(self, method, **params):
+        if self._instrumentation is None:
+            response = self._connection.send_command(method, **params)
+        else:
+            started = time.monotonic()
+            try:
+                response = self._connection.send_command(method, **params)
+            except Exception as e:
+                self._instrumentation.on_request(method,
+                                                 time.monotonic() - started,
+                                                 error=e)
+                raise
+            self._instrumentation.on_request(method,
+                                             time.monotonic() - started,
+                                             result=response.get('result'))
+        if response.get('result') != 0:
+            raise PCloudException(result_code=response.get('result'))
+        return response
+
+    def _release(self, broken=False):
+        connection, self._connection = self._connection, None
+        if self._pool is not None and connection is not None:
+            self._pool.release(connection, broken=broken)
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self._fd is not None and self._connection is not None:
+                self._command('file_close', fd=self._fd)
+            self._release()
+        except Exception:
+            self._release(broken=True)
+            raise
+        finally:
+            super().close()
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            pos = self.size + offset
+        else:
+            raise ValueError("Invalid whence {0}".format(whence))
+        if pos < 0:
+            raise ValueError("Negative seek position {0}".format(pos))
+        self._pos = pos
+        return pos
+
+    def _fetch(self, first, last):
+        """Reads the blocks first..last (inclusive) missing from the cache."""
+        runs = [] # [first block, last block] of the missing blocks
+        for index in range(first, last + 1):
+            if index in self._blocks:
+                continue
+            if runs and runs[-1][1] == index - 1:
+                runs[-1][1] = index
+            else:
+                runs.append([index, index])
+        if not runs:
+            return
+
+        block_size = self.block_size
+        if len(runs) == 1:
+            start, end = runs[0]
+            response = self._command('file_pread',
+                                     fd=self._fd,
+                                     offset=start * block_size,
+                                     count=(end - start + 1) * block_size)
+            datas = [self._connection.read_data(response['data'])]
+        else:
+            with self._connection.pipeline(
+                    check_result=True,
+                    instrumentation=self._instrumentation) as pipeline:
+                futures = [pipeline.submit('file_pread',
+                                           fd=self._fd,
+                                           offset=start * block_size,
+                                           count=(end - start + 1) * block_size)
+                           for start, end in runs]
+            datas = [future.result()['_data'] for future in futures]
+
+        for (start, _), data in zip(runs, datas):
+            for offset in range(0, len(data), block_size):
+                self._blocks[start + offset // block_size] = \
+                    data[offset:offset + block_size]
+
+    def _read_uncached(self, view, pos, end):
+        """Reads pos..end into view with pipelined block sized preads,
+        returns the number of bytes read (less at the end of the file).
+        """
+        block_size = self.block_size
+        counts = [(offset, min(block_size, end - offset))
+                  for offset in range(pos, end, block_size)]
+        written = 0
+        with self._connection.pipeline(
+                    check_result=True,
+                    instrumentation=self._instrumentation) as pipeline:
+            responses = pipeline.map('file_pread',
+                                     ({'fd': self._fd,
+                                       'offset': offset,
+                                       'count': count}
+                                      for offset, count in counts))
+            for (offset, count), response in zip(counts, responses):
+                data = response['_data']
+                view[written:written + len(data)] = data
+                written += len(data)
+                if len(data) < count:
+                    break # the replies still in flight are drained
+        return written
+
+    def readinto(self, b):
+        view = memoryview(b).cast('B')
+        pos = self._pos
+        end = min(pos + len(view), self.size)
+        if pos >= end:
+            return 0
+
+        if pos == self._next_sequential:
+            self._read_ahead = min(max(2 * self._read_ahead, self.block_size),
+                                   self.max_read_ahead)
+        else:
+            self._read_ahead = 0
+        self._next_sequential = end
+
+        block_size = self.block_size
+        first = pos // block_size
+        last = (end - 1) // block_size
+        if last - first + 1 > self.cache_blocks:
+            # larger than the cache, bypass it
+            written = self._read_uncached(view, pos, end)
+            self._pos = pos + written
+            return written
+
+        fetch_last = min(last + self._read_ahead // block_size,
+                         (self.size - 1) // block_size,
+                         first + self.cache_blocks - 1)
+        if all(index in self._blocks for index in range(first, last + 1)):
+            self.hits += 1
+        else:
+            # read ahead only on misses, so the window is fetched at once
+            self.misses += 1
+            self._fetch(first, fetch_last)
+
+        written = 0
+        for index in range(first, last + 1):
+            block = self._blocks.get(index)
+            if block is None:
+                break # short read, e.g. truncated meanwhile
+            self._blocks.move_to_end(index)
+            start = max(pos - index * block_size, 0)
+            stop = min(end - index * block_size, len(block))
+            chunk = block[start:stop]
+            view[written:written + len(chunk)] = chunk
+            written += len(chunk)
+            if len(block) < block_size:
+                break
+        self._pos = pos + written
+        while len(self._blocks) > self.cache_blocks:
+            self._blocks.popitem(last=False)
+        return written
+
+    def readall(self):
+        return self.read(max(self.size - self._pos, 0))
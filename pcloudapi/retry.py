@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+
+import io
+import random
+import threading
+import time
+
+import requests
+
+# "Try again later" results, the command was not performed
+RETRY_CODES = frozenset([5000, 5001, 5002])
+
+# methods that can be sent again without changing the outcome
+IDEMPOTENT_METHODS = frozenset("""
+    userinfo getdigest supportedlanguages setlanguage currentserver
+    getapiserver diff
+    listfolder stat checksumfile createfolderifnotexists
+    getfilelink getvideolink getaudiolink gethlslink getzip getziplink
+    getthumb getthumblink getthumbslinks
+    listshares sharerequestinfo listpublinks showpublink getpublinkdownload
+    getfolderpublink getfilepublink gettreepublink
+    getpubzip getpubziplink getpubthumb getpubthumblink getpubthumbslinks
+    getpubaudiolink listuploadlinks showuploadlink uploadprogress
+    uploadlinkprogress listrevisions normalizehash listplshort
+    listitunesproducts
+    upload_info upload_write
+    file_pread file_pread_ifmod file_pwrite file_checksum file_size
+    file_truncate
+    """.split())
+
+
+class RetryBudget(object):
+    """Limits the retries to a ratio of the requests.
+
+    Each request deposits ratio tokens (up to reserve) and each retry
+    withdraws one, so when everything fails (an outage, an overloaded
+    server) the retries stay a fraction of the traffic instead of
+    multiplying it. It is thread-safe.
+    """
+
+    def __init__(self, ratio=0.2, reserve=10):
+        """
+        :param ratio: retries allowed per request in the long run
+        :param reserve: retries allowed in a burst
+        """
+        self.ratio = ratio
+        self.reserve = reserve
+        self._tokens = float(reserve)
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self._tokens = min(self._tokens + self.ratio, self.reserve)
+
+    def withdraw(self):
+        """Returns True if a retry is allowed (and takes it)."""
+        with self._lock:
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+class PCloudRetryPolicy(object):
+    """Retries failed commands with exponential backoff and jitter.
+
+    A command is retried when the connection fails (IOError, including
+    requests.RequestException, the connection is reconnected first) or
+    pcloud answers with one of retry_codes, but only if the method is
+    in the idempotent table: sending it twice must be harmless, since a
+    command whose connection failed may have been performed. Commands on
+    file descriptors (fd) are bound to the connection and are not retried
+    after a reconnect, nor are those with data that cannot be rewound.
+    HTTP client errors (4xx) of the json connection are not retried. The
+    connection is reconnected here only before a retry, after a failure
+    that is not retried the binary connection reconnects by itself before
+    its next command (the file descriptors went with the broken socket).
+
+    rule(method, params, attempt, error, response) can override the
+    decision by returning True or False (None keeps it), error is the
+    exception or None and response the response or None, attempt
+    starts at 1.
+
+    Commands are not retried unless a policy is given to PCloudAPI
+    (retry_policy=True for a default one).
+    """
+
+    def __init__(self, retries=3, min_backoff=0.1, max_backoff=10,
+                 retry_codes=RETRY_CODES, idempotent=IDEMPOTENT_METHODS,
+                 rule=None, budget=True):
+        """Initializes the policy.
+
+        :param retries: maximum number of retries of a command
+        :param min_backoff: seconds to wait before the first retry, doubled
+            on each following one up to max_backoff (randomized by half)
+        :param retry_codes: pcloud results that are retried
+        :param idempotent: methods that are retried
+        :param rule: callable overriding the decision, see above
+        :param budget: RetryBudget shared by the commands (True for
+            a default one), None does not limit the retries
+        """
+        self.retries = retries
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.retry_codes = frozenset(retry_codes)
+        self.idempotent = frozenset(idempotent)
+        self.rule = rule
+        if budget is True:
+            budget = RetryBudget()
+        self.budget = budget
+
+    def should_retry(self, method, params, attempt, error=None, response=None):
+        """Returns True if the failed command should be sent again."""
+        if attempt > self.retries:
+            return False
+        decision = None
+        if self.rule is not None:
+            decision = self.rule(method, params, attempt, error, response)
+        if decision is None:
+            decision = (method in self.idempotent and
+                        (error is None or 'fd' not in params) and
+                        not _client_error(error))
+        return bool(decision)
+
+    def backoff(self, attempt):
+        """Returns the seconds to wait before the attempt-th retry."""
+        backoff = min(self.min_backoff * 2 ** (attempt - 1), self.max_backoff)
+        return backoff * random.uniform(0.5, 1)
+
+    def send_command(self, connection, method, params, instrumentation=None):
+        """Sends the command through connection, retrying it as needed.
+
+        :param instrumentation: PCloudInstrumentation told about the retries
+
+        :returns the response, which can have a result in retry_codes when
+            the retries are exhausted
+        :raises the error of the last attempt
+        """
+        if self.budget is not None:
+            self.budget.deposit()
+        data = params.get('_data')
+        rewind = None
+        if isinstance(data, io.IOBase):
+            rewind = data.tell() if data.seekable() else False
+
+        attempt = 0
+        reconnect = False
+        while True:
+            error = response = None
+            try:
+                if reconnect:
+                    connection.reconnect()
+                    reconnect = False
+                response = connection.send_command(method, **params)
+            except IOError as e:
+                error = e
+                reconnect = True
+            if error is None and (not isinstance(response, dict) or
+                    response.get('result') not in self.retry_codes):
+                return response
+
+            attempt += 1
+            if (rewind is False or
+                    not self.should_retry(method, params, attempt,
+                                          error, response) or
+                    (self.budget is not None and not self.budget.withdraw())):
+                if error is None:
+                    return response
+                raise error
+            if instrumentation is not None:
+                instrumentation.on_retry(method, attempt, error, response)
+            time.sleep(self.backoff(attempt))
+            if rewind is not None:
+                data.seek(rewind)
+
+
+def _client_error(error):
+    """Returns True if error is an HTTP 4xx, sending again would not help."""
+    response = getattr(error, 'response', None)
+    return (isinstance(error, requests.HTTPError) and response is not None and
+            400 <= response.status_code < 500)
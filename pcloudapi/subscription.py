@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+
+import asyncio
+import random
+import socket
+import threading
+
+from .exceptions import PCloudException
+from .pcloudbin import PCloudBinaryConnection
+
+
+def _binary_settings(connection):
+    """Returns the settings of a binary connection (or of a pool of them)
+    for opening another one to the same server.
+    """
+    if isinstance(connection, PCloudBinaryConnection):
+        return {'server': connection.servers,
+                'port': connection.port,
+                'transport': connection.transport,
+                'endpoints': connection.endpoints}
+    factory = getattr(connection, 'connection_factory', None)
+    if isinstance(factory, type) and issubclass(factory,
+                                                PCloudBinaryConnection):
+        return {key: value
+                for key, value in connection.connection_kwargs.items()
+                if key in ('server', 'port', 'transport', 'endpoints')}
+    return {} # e.g. a json connection, the default binary server
+
+
+class PCloudSubscription(object):
+    """Live feed of the changes in the account.
+
+    Waits for changes with a blocking diff (block=1) on a dedicated
+    connection and delivers them in batches (the entries of each diff
+    response), either to a callback called from a background thread:
+
+        api.subscribe(lambda entries, diffid: print(entries))
+
+    or through asynchronous iteration:
+
+        async for entries in api.subscribe():
+            ...
+
+    The subscription is stopped when the iteration ends, call .stop()
+    after breaking out of it.
+
+    Failed connections are reopened with exponential backoff and the
+    feed resumes from the last diffid, so no change is lost or repeated.
+    The diffid advances once a batch is delivered. When the callback
+    raises, the exception is passed to on_error and the batch is
+    delivered again after a backoff. Without on_error, or when on_error
+    raises, the subscription stops and keeps the exception in .error,
+    a new subscription from .diffid gets the batch again.
+    E.g. a PCloudMirror is kept live with
+    api.subscribe(mirror.on_changes, diffid=mirror.diffid).
+    """
+
+    def __init__(self, api, callback=None, diffid=None, limit=1000,
+                 connection_factory=None, timeout=900,
+                 min_backoff=1, max_backoff=60, on_error=None):
+        """Initializes the subscription, see .start().
+
+        :param api: PCloudAPI whose connection parameters (ssl, server,
+            port, transport, endpoints, auth) are used
+        :param callback: callable(entries, diffid) called with each batch
+        :param diffid: changes after it are delivered, None starts with
+            the changes from now on
+        :param limit: maximum number of entries per batch
+        :param connection_factory: callable returning a new connected
+            connection, defaults to a binary one
+        :param timeout: socket timeout in seconds, the connection is
+            silently reopened when a diff blocks longer
+        :param min_backoff: seconds to wait after the first failure,
+            doubled on each following failure up to max_backoff
+        :param on_error: callable(exception) called on each failure (of
+            the connection or of callback), raising from it stops the
+            subscription
+        """
+        self.api = api
+        self.callback = callback
+        self.diffid = diffid
+        self.limit = limit
+        self.connection_factory = connection_factory
+        self.timeout = timeout
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.on_error = on_error
+        self.error = None # the exception that stopped the subscription
+        self._connection = None
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def _connect(self):
+        if self.connection_factory is not None:
+            return self.connection_factory()
+        connection = self.api.connection
+        # sharing persistent_params keeps the auth in sync
+        return PCloudBinaryConnection(
+                    use_ssl=connection.use_ssl,
+                    timeout=self.timeout,
+                    persistent_params=connection.persistent_params,
+                    **_binary_settings(connection)
+                ).connect()
+
+    def _disconnect(self):
+        connection, self._connection = self._connection, None
+        if connection is not None:
+            try:
+                connection.close()
+            except Exception:
+                pass
+
+    def _request(self, **params):
+        response = self._connection.send_command('diff', **params)
+        if response.get('result') != 0:
+            raise PCloudException(result_code=response.get('result'))
+        return response
+
+    def poll(self):
+        """Waits for the next batch of changes and returns its entries.
+
+        Returns None once the subscription is stopped.
+        NOTE: not thread-safe, poll from a single thread at a time.
+        """
+        batch = self._next_batch()
+        if batch is None:
+            return None
+        entries, self.diffid = batch
+        return entries
+
+    def _next_batch(self):
+        """Waits for the next batch, returns (entries, diffid) or None.
+
+        self.diffid is left before the batch, to be advanced to diffid
+        once the batch is delivered.
+        """
+        backoff = self.min_backoff
+        while not self._stopped.is_set():
+            try:
+                if self._connection is None:
+                    self._connection = self._connect()
+                if self.diffid is None:
+                    self.diffid = self._request(last=0)['diffid']
+                response = self._request(diffid=self.diffid,
+                                         block=1,
+                                         limit=self.limit)
+            except socket.timeout:
+                self._disconnect() # no changes for a while
+                continue
+            except (PCloudException, IOError, ValueError) as e:
+                self._disconnect()
+                if self._stopped.is_set():
+                    break
+                if self.on_error is not None:
+                    self.on_error(e)
+                self._stopped.wait(backoff * random.uniform(0.5, 1))
+                backoff = min(backoff * 2, self.max_backoff)
+                continue
+            if self._stopped.is_set():
+                break # left for a subscription resuming from self.diffid
+            backoff = self.min_backoff
+            entries = response.get('entries', [])
+            diffid = response.get('diffid')
+            for entry in entries:
+                diffid = max(diffid or 0, entry.get('diffid', 0))
+            if entries:
+                return entries, diffid
+            if diffid is not None:
+                self.diffid = diffid # nothing to deliver
+        self._disconnect()
+        return None
+
+    def run(self):
+        """Delivers the changes to callback until stopped.
+
+        :raises the exception that stopped the subscription, see .error
+        """
+        try:
+            backoff = self.min_backoff
+            while True:
+                batch = self._next_batch()
+                if batch is None:
+                    return
+                entries, diffid = batch
+                try:
+                    self.callback(entries, diffid)
+                except Exception as e:
+                    if self.on_error is None:
+                        raise
+                    self.on_error(e)
+                    # self.diffid is kept, the batch is delivered again
+                    self._stopped.wait(backoff * random.uniform(0.5, 1))
+                    backoff = min(backoff * 2, self.max_backoff)
+                    continue
+                backoff = self.min_backoff
+                self.diffid = diffid
+        except Exception as e:
+            self.error = e
+            self._stopped.set()
+            raise
+        finally:
+            self._disconnect()
+
+    def _run_in_thread(self):
+        try:
+            self.run()
+        except Exception:
+            pass # kept in .error
+
+    def start(self):
+        """Starts delivering the changes to callback in a daemon thread."""
+        if self.callback is None:
+            raise ValueError("No callback to deliver the changes to")
+        self._thread = threading.Thread(target=self._run_in_thread,
+                                        name='pcloud-subscription',
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        """Stops the subscription, waits for the thread if started.
+
+        NOTE: a blocked diff is interrupted only on binary connections.
+        """
+        self._stopped.set()
+        sock = getattr(self._connection, 'socket', None)
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR) # wakes up the blocked diff
+            except OSError:
+                pass
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout)
+
+    @property
+    def stopped(self):
+        """True once stopped, by .stop() or by an error (see .error)."""
+        return self._stopped.is_set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    async def __aiter__(self):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                batch = await loop.run_in_executor(None, self._next_batch)
+                if batch is None:
+                    return
+                entries, diffid = batch
+                yield entries
+                self.diffid = diffid # the consumer asked for the next one
+        finally:
+            self.stop()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .exceptions import PCloudException
+from .pool import PCloudConnectionPool
+from .retry import PCloudRetryPolicy
+
+CHUNK_SIZE = 8 * 1024 * 1024
+SESSION_SUFFIX = '.pcloudupload'
+
+
+class PCloudChunkedUploader(object):
+    """Uploads a file in chunks through an upload session.
+
+    The chunks are written with upload_write at their offsets, concurrently
+    if the api uses a PCloudConnectionPool. The session is saved in a json
+    file next to the local file after each chunk, so an interrupted upload
+    is resumed by the next upload of the same (unchanged) file to the same
+    remote path. The file appears at remote_path only when the session is
+    committed with upload_save.
+    """
+
+    def __init__(self, api, local_path, remote_path,
+                 chunk_size=CHUNK_SIZE, connections=1, retries=3,
+                 progress_callback=None, session_path=None):
+        """Initializes the uploader.
+
+        :param api: PCloudAPI
+        :param chunk_size: bytes sent by each upload_write
+        :param connections: chunks written concurrently, requires a
+            thread-safe connection (PCloudConnectionPool)
+        :raises ValueError if connections > 1 without a PCloudConnectionPool
+        :param retries: how many times a chunk is retried, see
+            PCloudRetryPolicy (stored in .retry_policy)
+        :param progress_callback: called each time with the number of bytes
+            written (from multiple threads, serialized)
+        :param session_path: where the session is saved, by default
+            local_path + SESSION_SUFFIX, False disables saving
+        """
+        if connections > 1 and not isinstance(api.connection,
+                                              PCloudConnectionPool):
+            raise ValueError("Writing chunks concurrently requires "
+                             "a PCloudConnectionPool")
+        self.api = api
+        self.local_path = local_path
+        self.remote_path = remote_path
+        self.chunk_size = chunk_size
+        self.connections = connections
+        self.retry_policy = PCloudRetryPolicy(retries=retries)
+        self.progress_callback = progress_callback
+        if session_path is None:
+            session_path = local_path + SESSION_SUFFIX
+        self.session_path = session_path
+        self._lock = threading.Lock()
+        self._session = None
+
+    def _new_session(self, stat):
+        return {'uploadid': self.api.make_request('upload_create')['uploadid'],
+                'remote_path': self.remote_path,
+                'size': stat.st_size,
+                'mtime_ns': stat.st_mtime_ns,
+                'chunk_size': self.chunk_size,
+                'done': []}
+
+    def _load_session(self, stat):
+        """Returns the saved session if it is still usable, else None."""
+        if not self.session_path:
+            return None
+        try:
+            with open(self.session_path) as f:
+                session = json.load(f)
+        except (IOError, ValueError):
+            return None
+        if (session.get('remote_path') != self.remote_path or
+                session.get('size') != stat.st_size or
+                session.get('mtime_ns') != stat.st_mtime_ns or
+                session.get('chunk_size') != self.chunk_size):
+            return None
+        try:
+            self.api.make_request('upload_info', uploadid=session['uploadid'])
+        except PCloudException:
+            return None # expired or already saved
+        return session
+
+    def _save_session(self):
+        if not self.session_path:
+            return
+        with self._lock:
+            tmp_path = self.session_path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(self._session, f)
+            os.replace(tmp_path, self.session_path)
+
+    def upload(self):
+        """Uploads the file, returns the upload_save response."""
+        stat = os.stat(self.local_path)
+        self._session = self._load_session(stat) or self._new_session(stat)
+        self._save_session()
+
+        size = stat.st_size
+        done = set(self._session['done'])
+        offsets = [offset for offset in range(0, size, self.chunk_size)
+                   if offset not in done]
+        if self.connections > 1:
+            with ThreadPoolExecutor(self.connections) as executor:
+                futures = [executor.submit(self._write_chunk, offset)
+                           for offset in offsets]
+                try:
+                    for future in futures:
+                        future.result()
+                except:
+                    for future in futures:
+                        future.cancel()
+                    raise
+        else:
+            for offset in offsets:
+                self._write_chunk(offset)
+
+        remote_dir, filename = self.remote_path.rsplit('/', 1)
+        response = self.api.make_request('upload_save',
+                                         uploadid=self._session['uploadid'],
+                                         path=remote_dir or '/',
+                                         name=filename)
+        if self.session_path and os.path.exists(self.session_path):
+            os.remove(self.session_path)
+        return response
+
+    def _write_chunk(self, offset):
+        with open(self.local_path, 'rb') as f:
+            f.seek(offset)
+            data = f.read(self.chunk_size)
+        response = self.retry_policy.send_command(
+                self.api.connection, 'upload_write',
+                {'uploadid': self._session['uploadid'],
+                 'uploadoffset': offset,
+                 '_data': data},
+                self.api.instrumentation)
+        if response.get('result') != 0:
+            raise PCloudException(result_code=response.get('result'))
+        with self._lock:
+            self._session['done'].append(offset)
+            if self.progress_callback:
+                self.progress_callback(len(data))
+        self._save_session()
@@ -1,6 +1,13 @@
+import collections
+import errno
 import io
+import itertools
+import os
+import selectors
 import socket
 import ssl
+import threading
+import time
 
 
 class PCloudBuffer(io.BufferedRWPair):
@@ -12,6 +19,45 @@ class PCloudBuffer(io.BufferedRWPair):
             raise IOError("Requested {0} bytes, got {1}".format(size, len(result)))
         return result
 
+    def readinto(self, b):
+        """Fills b completely (large reads go straight from the socket)."""
+        view = memoryview(b).cast('B')
+        size = len(view)
+        filled = 0
+        while filled < size:
+            received = super().readinto(view[filled:])
+            if not received:
+                raise IOError("Requested {0} bytes, got {1}".format(size, filled))
+            filled += received
+        return filled
+
+
+class ProgressThrottle(object):
+    """Progress callback wrapper reporting the accumulated bytes at most
+    once per min_bytes or min_interval seconds, whichever comes first.
+
+    NOTE: call .flush() at the end to report the rest.
+    """
+
+    def __init__(self, callback, min_bytes=1024 * 1024, min_interval=0.1):
+        self.callback = callback
+        self.min_bytes = min_bytes
+        self.min_interval = min_interval
+        self._pending = 0
+        self._reported_at = time.monotonic()
+
+    def __call__(self, size):
+        self._pending += size
+        if (self._pending >= self.min_bytes or
+                time.monotonic() - self._reported_at >= self.min_interval):
+            self.flush()
+
+    def flush(self):
+        if self._pending:
+            pending, self._pending = self._pending, 0
+            self._reported_at = time.monotonic()
+            self.callback(pending)
+
 
 ### Misc functionality that should be in python but is not ###
 
@@ -86,40 +132,192 @@ except ImportError:
         return context
 
 
-def create_connection(server=None, port=None, timeout=None, use_ssl=False):
-    """Create a socket or a secure ssl socket.
+class PCloudTransport(object):
+    """How connections to the servers are established.
 
-    Hopefully some day such functionality will be included in python3.
+    Shared by the connections using it (e.g. all connections of a pool):
+     - the SSLContext is created once
+     - the TLS sessions are kept per server and reused by the following
+       connections to it (abbreviated handshakes)
+     - TCP_NODELAY, buffer sizes and keepalive are set on the sockets
+     - the resolved addresses are tried concurrently, starting the next
+       attempt every happy_eyeballs_delay seconds (alternating IPv6 and
+       IPv4), the first connected wins
 
-    :returns socket
-    :rtype socket.SocketType
+    It is thread-safe.
     """
-    # based on socket.create_connection()
-    if use_ssl:
-        context = ssl_create_default_context()
-    err = None
-    for af, socktype, proto, canonname, sa in \
-            socket.getaddrinfo(server, port, 0, socket.SOCK_STREAM):
-        sock = None
+
+    def __init__(self, ssl_context=None, session_reuse=True,
+                 tcp_nodelay=True, send_buffer_size=None,
+                 recv_buffer_size=None, keepalive=None,
+                 happy_eyeballs_delay=0.25):
+        """Initializes the transport.
+
+        :param ssl_context: SSLContext to use, by default a default one
+        :param session_reuse: resume TLS sessions when reconnecting
+        :param tcp_nodelay: disable Nagle's algorithm (small commands)
+        :param send_buffer_size: SO_SNDBUF, None keeps the system default
+        :param recv_buffer_size: SO_RCVBUF, None keeps the system default
+        :param keepalive: seconds of idleness before TCP keepalive probes,
+            None disables keepalive
+        :param happy_eyeballs_delay: seconds before trying the next address,
+            None tries the addresses sequentially
+        """
+        self._ssl_context = ssl_context
+        self.session_reuse = session_reuse
+        self.tcp_nodelay = tcp_nodelay
+        self.send_buffer_size = send_buffer_size
+        self.recv_buffer_size = recv_buffer_size
+        self.keepalive = keepalive
+        self.happy_eyeballs_delay = happy_eyeballs_delay
+        self._lock = threading.Lock()
+        self._sessions = {} # (server, port) -> ssl.SSLSession
+
+    @property
+    def ssl_context(self):
+        with self._lock:
+            if self._ssl_context is None:
+                self._ssl_context = ssl_create_default_context()
+            return self._ssl_context
+
+    def save_session(self, sock, server, port):
+        """Keeps the TLS session of sock for the next connections.
+
+        NOTE: with TLS 1.3 the session arrives after the handshake, call
+            this before closing the socket.
+        """
+        session = getattr(sock, 'session', None)
+        if self.session_reuse and session is not None:
+            with self._lock:
+                self._sessions[(server, port)] = session
+
+    def _set_options(self, sock):
+        if self.tcp_nodelay and sock.family in (socket.AF_INET,
+                                                socket.AF_INET6):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if self.send_buffer_size:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF,
+                            self.send_buffer_size)
+        if self.recv_buffer_size:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF,
+                            self.recv_buffer_size)
+        if self.keepalive is not None:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            idle = max(int(self.keepalive), 1)
+            for option, value in (('TCP_KEEPIDLE', idle),
+                                  ('TCP_KEEPINTVL', max(idle // 3, 1)),
+                                  ('TCP_KEEPCNT', 3)):
+                if hasattr(socket, option):
+                    sock.setsockopt(socket.IPPROTO_TCP,
+                                    getattr(socket, option), value)
+
+    def connect(self, server, port, timeout=None, use_ssl=False):
+        """Returns a connected (ssl) socket.
+
+        :raises socket.error
+        """
+        addresses = socket.getaddrinfo(server, port, 0, socket.SOCK_STREAM)
+        if not addresses:
+            raise socket.error("getaddrinfo returns an empty list")
+        sock = self._connect_any(_interleave_families(addresses), timeout)
         try:
-            sock = socket.socket(af, socktype, proto)
-            if timeout is not None:
-                sock.settimeout(timeout)
-            if use_ssl:
-                sock = context.wrap_socket(sock, server_hostname=server)
-            sock.connect(sa)
+            sock.settimeout(timeout)
+            self._set_options(sock)
             if use_ssl:
+                with self._lock:
+                    session = self._sessions.get((server, port))
+                sock = self.ssl_context.wrap_socket(sock,
+                                                    server_hostname=server,
+                                                    session=session)
                 match_hostname(sock.getpeercert(), server)
-            return sock
+                self.save_session(sock, server, port)
+        except:
+            sock.close()
+            raise
+        return sock
+
+    def _connect_any(self, addresses, timeout):
+        """Connects to the first address that accepts, returns the socket."""
+        if self.happy_eyeballs_delay is None or len(addresses) == 1:
+            err = None
+            for af, socktype, proto, _, sa in addresses:
+                sock = socket.socket(af, socktype, proto)
+                try:
+                    sock.settimeout(timeout)
+                    sock.connect(sa)
+                    return sock
+                except socket.error as e:
+                    err = e
+                    sock.close()
+            raise err
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        addresses = list(addresses)
+        selector = selectors.DefaultSelector()
+        attempts = []
+        err = None
+        next_attempt = 0
+        try:
+            while addresses or attempts:
+                now = time.monotonic()
+                if deadline is not None and now >= deadline:
+                    raise socket.timeout("timed out")
+                if addresses and (not attempts or now >= next_attempt):
+                    af, socktype, proto, _, sa = addresses.pop(0)
+                    sock = socket.socket(af, socktype, proto)
+                    sock.setblocking(False)
+                    code = sock.connect_ex(sa)
+                    if code not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+                        sock.close()
+                        err = OSError(code, os.strerror(code))
+                        continue
+                    selector.register(sock, selectors.EVENT_WRITE)
+                    attempts.append(sock)
+                    next_attempt = now + self.happy_eyeballs_delay
+                    continue
 
-        except socket.error as _:
-            err = _
-            if sock is not None:
+                wait = next_attempt - now if addresses else None
+                if deadline is not None:
+                    wait = min(wait if wait is not None else deadline - now,
+                               deadline - now)
+                for key, _ in selector.select(wait):
+                    sock = key.fileobj
+                    selector.unregister(sock)
+                    attempts.remove(sock)
+                    code = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                    if code == 0:
+                        return sock
+                    sock.close()
+                    err = OSError(code, os.strerror(code))
+                    next_attempt = 0 # failed, try the next one right away
+            raise err
+        finally:
+            for sock in attempts:
                 sock.close()
+            selector.close()
 
-    if err is not None:
-        raise err
-    else:
-        raise socket.error("getaddrinfo returns an empty list")
 
+def _interleave_families(addresses):
+    """Orders addresses alternating the address families (RFC 8305)."""
+    by_family = collections.OrderedDict()
+    for address in addresses:
+        by_family.setdefault(address[0], []).append(address)
+    result = []
+    for group in itertools.zip_longest(*by_family.values()):
+        result.extend(address for address in group if address is not None)
+    return result
 
+
+DEFAULT_TRANSPORT = PCloudTransport()
+
+
+def create_connection(server=None, port=None, timeout=None, use_ssl=False,
+                      transport=None):
+    """Create a socket or a secure ssl socket.
+
+    :param transport: PCloudTransport, DEFAULT_TRANSPORT if None
+    :returns socket
+    :rtype socket.SocketType
+    """
+    return (transport or DEFAULT_TRANSPORT).connect(server, port,
+                                                    timeout, use_ssl)
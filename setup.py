@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 import os
-from setuptools import setup
+from setuptools import setup, Extension
 
 def read(fname):
     # Utility function to read the README file.
@@ -16,6 +16,10 @@ setup(
     keywords = "pcloud pcloudapi",
     url = "https://github.com/tochev/python3-pcloudapi",
     packages=['pcloudapi'],
+    # optional, pcloudapi.decoder falls back to pure python
+    ext_modules=[Extension('pcloudapi._speedups',
+                           sources=['pcloudapi/_speedups.c'],
+                           optional=True)],
     long_description=read('README.txt'),
     classifiers=[
         "Development Status :: 3 - Alpha",
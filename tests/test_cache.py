@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+
+import unittest
+
+from pcloudapi.cache import PCloudMetadataCache
+
+
+class ObserveNotFoundTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = PCloudMetadataCache()
+        self.cache.put('/a', {'id': 'd1', 'isfolder': True})
+        self.cache.put('/a/b', {'id': 'd2', 'isfolder': True})
+        self.cache.put('/a/b/c.txt', {'id': 'f3', 'isfolder': False})
+        self.cache.put('/a/d.txt', {'id': 'f4', 'isfolder': False})
+
+    def test_missing_file_drops_only_its_key(self):
+        self.cache.invalidate = self.track(self.cache.invalidate)
+        self.cache.observe('checksumfile', {'path': '/a/d.txt'},
+                           {'result': 2009})
+        self.assertEqual(self.invalidated, [('/a/d.txt', False)])
+        self.assertIsNone(self.cache.get('/a/d.txt'))
+        self.assertIsNotNone(self.cache.get('/a/b/c.txt'))
+
+    def test_missing_folder_drops_descendants(self):
+        self.cache.observe('listfolder', {'path': '/a/b'}, {'result': 2005})
+        self.assertIsNone(self.cache.get('/a/b'))
+        self.assertIsNone(self.cache.get('/a/b/c.txt'))
+        self.assertIsNotNone(self.cache.get('/a/d.txt'))
+
+    def test_missing_cached_folder_drops_descendants(self):
+        self.cache.observe('stat', {'path': '/a/b'}, {'result': 2009})
+        self.assertIsNone(self.cache.get('/a/b'))
+        self.assertIsNone(self.cache.get('/a/b/c.txt'))
+
+    def track(self, invalidate):
+        self.invalidated = []
+
+        def tracked(path, recursive=False):
+            self.invalidated.append((path, recursive))
+            return invalidate(path, recursive)
+        return tracked
+
+
+class ObserveFileDescriptorTest(unittest.TestCase):
+
+    METADATA = {'id': 'f7', 'fileid': 7, 'size': 10, 'isfolder': False}
+
+    def setUp(self):
+        self.cache = PCloudMetadataCache()
+        self.cache.put('/a/f', self.METADATA)
+        self.cache.put('/a/g', {'id': 'f8', 'fileid': 8, 'isfolder': False})
+
+    def open(self, flags, fd=3):
+        self.cache.observe('file_open', {'path': '/a/f', 'flags': flags},
+                           {'result': 0, 'fd': fd, 'fileid': 7})
+
+    def test_opened_for_writing(self):
+        self.open(0x0002 | 0x0200)
+        self.assertIsNone(self.cache.get('/a/f'))
+        self.assertIsNotNone(self.cache.get('/a/g'))
+
+    def test_write_and_close_invalidate(self):
+        self.open(0x0002)
+        for method, params in (('file_pwrite', {'fd': 3, 'offset': 0}),
+                               ('file_write', {'fd': 3}),
+                               ('file_truncate', {'fd': 3, 'length': 1}),
+                               ('file_close', {'fd': 3})):
+            self.cache.put('/a/f', self.METADATA) # e.g. a stat meanwhile
+            self.cache.observe(method, params, {'result': 0})
+            self.assertIsNone(self.cache.get('/a/f'), method)
+        # the fd is closed, the number may be reused for another file
+        self.cache.put('/a/f', self.METADATA)
+        self.cache.observe('file_pwrite', {'fd': 3}, {'result': 0})
+        self.assertIsNotNone(self.cache.get('/a/f'))
+
+    def test_read_only_fd(self):
+        self.open(0, fd=4)
+        self.cache.observe('file_pread', {'fd': 4}, {'result': 0, 'data': 1})
+        self.cache.observe('file_close', {'fd': 4}, {'result': 0})
+        self.assertIsNotNone(self.cache.get('/a/f'))
+
+
+if __name__ == '__main__':
+    unittest.main()
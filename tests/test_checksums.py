@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+import hashlib
+import io
+import os
+import tempfile
+import unittest
+
+from pcloudapi import PCloudAPI, PCloudException
+from pcloudapi.checksums import HashingReader, checksums_match, \
+    new_digests, verify_checksums
+from pcloudapi.connection import AbstractPCloudConnection
+
+from .test_pcloudbin import connection_reading
+
+CONTENT = b"0123456789" * 1000
+
+
+def checksums(content):
+    """Returns the checksums pcloud reports for content."""
+    return {'sha1': hashlib.sha1(content).hexdigest(),
+            'sha256': hashlib.sha256(content).hexdigest()}
+
+
+class VerifyChecksumsTest(unittest.TestCase):
+
+    def test_match(self):
+        digests = new_digests()
+        for digest in digests.values():
+            digest.update(CONTENT)
+        expected = {algorithm: value.upper()
+                    for algorithm, value in checksums(CONTENT).items()}
+        verify_checksums(digests, expected, 'f')
+        self.assertTrue(checksums_match(checksums(CONTENT), expected))
+
+    def test_mismatch(self):
+        self.assertRaises(PCloudException, verify_checksums,
+                          checksums(CONTENT), checksums(b"other"), 'f')
+        self.assertFalse(checksums_match(checksums(CONTENT),
+                                         checksums(b"other")))
+
+    def test_only_common_algorithms(self):
+        sha1 = {'sha1': checksums(CONTENT)['sha1']}
+        verify_checksums(checksums(CONTENT), sha1, 'f')
+        self.assertTrue(checksums_match(checksums(CONTENT), sha1))
+
+    def test_nothing_to_compare(self):
+        md5 = {'md5': hashlib.md5(CONTENT).hexdigest()}
+        self.assertRaises(PCloudException, verify_checksums,
+                          checksums(CONTENT), md5, 'f')
+        self.assertFalse(checksums_match(checksums(CONTENT), md5))
+
+
+class HashingReaderTest(unittest.TestCase):
+
+    def test_hashed_while_sent(self):
+        connection = connection_reading(b"")
+        reader = HashingReader(io.BytesIO(CONTENT))
+        connection.send_command_nb('uploadfile', {'path': '/'}, data=reader)
+        self.assertTrue(connection.sent.getvalue().endswith(CONTENT))
+        self.assertEqual(reader.hexdigests(), checksums(CONTENT))
+
+    def test_seek_before_reading(self):
+        reader = HashingReader(io.BytesIO(CONTENT))
+        self.assertEqual(reader.seek(0, io.SEEK_END), len(CONTENT))
+        reader.seek(0)
+        self.assertEqual(reader.read(), CONTENT)
+        self.assertEqual(reader.hexdigests(), checksums(CONTENT))
+
+    def test_hashed_while_received(self):
+        connection = connection_reading(CONTENT)
+        digests = new_digests()
+        out = io.BytesIO()
+        connection.write_data(out, len(CONTENT), digests=digests.values(),
+                              chunk_size=1000)
+        self.assertEqual(out.getvalue(), CONTENT)
+        self.assertEqual({algorithm: digest.hexdigest()
+                          for algorithm, digest in digests.items()},
+                         checksums(CONTENT))
+
+
+class _FakeConnection(AbstractPCloudConnection):
+    """Answers uploadfile with the checksums of .reported."""
+
+    def __init__(self, reported):
+        self.persistent_params = {}
+        self.reported = reported
+
+    def send_command(self, method, **params):
+        if method == 'uploadfile':
+            self.uploaded = params['_data'].read()
+            return {'result': 0, 'fileids': [1], 'metadata': [{'fileid': 1}],
+                    'checksums': [checksums(self.reported)]}
+        raise AssertionError(method)
+
+
+class UploadVerifyTest(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.write(fd, CONTENT)
+        os.close(fd)
+        self.addCleanup(os.remove, self.path)
+
+    def upload(self, reported):
+        connection = _FakeConnection(reported)
+        api = PCloudAPI(connection=connection)
+        response = api.upload(self.path, '/f', create_parent=False,
+                              verify=True)
+        self.assertEqual(connection.uploaded, CONTENT)
+        return response
+
+    def test_verified(self):
+        self.assertEqual(self.upload(CONTENT)['fileids'], [1])
+
+    def test_corrupted(self):
+        self.assertRaises(PCloudException, self.upload, CONTENT[:-1] + b"x")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+import os
+import tempfile
+import unittest
+
+from pcloudapi import PCloudAPI
+from pcloudapi.connection import AbstractPCloudConnection
+from pcloudapi.contentindex import PCloudContentIndex
+
+from .test_checksums import checksums
+
+
+class _FakeConnection(AbstractPCloudConnection):
+    """Keeps files by fileid, answers what upload and copyfile send."""
+
+    def __init__(self):
+        self.persistent_params = {}
+        self.files = {} # fileid -> content
+        self.methods = []
+
+    def store(self, content):
+        fileid = len(self.files) + 1
+        self.files[fileid] = content
+        return {'fileid': fileid, 'size': len(content), 'isfolder': False}
+
+    def send_command(self, method, **params):
+        self.methods.append(method)
+        if method == 'createfolderifnotexists':
+            return {'result': 0, 'metadata': {'isfolder': True}}
+        if method == 'uploadfile':
+            content = params['_data'].read()
+            return {'result': 0, 'fileids': [len(self.files) + 1],
+                    'metadata': [self.store(content)],
+                    'checksums': [checksums(content)]}
+        content = self.files.get(params.get('fileid'))
+        if content is None:
+            return {'result': 2009}
+        if method == 'checksumfile':
+            response = checksums(content)
+            response.update(result=0, metadata={'fileid': params['fileid'],
+                                                 'size': len(content)})
+            return response
+        if method == 'copyfile':
+            return {'result': 0, 'metadata': self.store(content)}
+        raise AssertionError(method)
+
+
+class ContentIndexUploadTest(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.write(fd, b'content')
+        os.close(fd)
+        self.addCleanup(os.remove, self.path)
+        self.connection = _FakeConnection()
+        self.index = PCloudContentIndex()
+        self.api = PCloudAPI(connection=self.connection, retry_policy=None,
+                             content_index=self.index)
+
+    def test_copies_checked_content(self):
+        metadata = self.connection.store(b'content')
+        self.index.add(metadata['fileid'], 7, checksums(b'content'))
+        response = self.api.upload(self.path, '/dir/copy')
+        self.assertEqual(self.connection.methods,
+                         ['createfolderifnotexists', 'checksumfile',
+                          'copyfile'])
+        # the copy is indexed too
+        self.assertEqual(self.index.lookup(checksums(b'content'), 7),
+                         [1, response['metadata']['fileid']])
+
+    def test_overwritten_file_is_uploaded(self):
+        metadata = self.connection.store(b'content')
+        self.index.add(metadata['fileid'], 7, checksums(b'content'))
+        self.connection.files[metadata['fileid']] = b'changed'
+        self.api.upload(self.path, '/dir/file')
+        self.assertEqual(self.connection.methods,
+                         ['createfolderifnotexists', 'checksumfile',
+                          'uploadfile'])
+        self.assertEqual(self.index.lookup(checksums(b'changed'), 7), [1])
+
+    def test_deleted_file_is_uploaded(self):
+        self.index.add(42, 7, checksums(b'content'))
+        self.api.upload(self.path, '/dir/file')
+        self.assertEqual(self.connection.methods,
+                         ['createfolderifnotexists', 'checksumfile',
+                          'uploadfile'])
+        self.assertNotIn(42, self.index)
+
+
+class ContentIndexTest(unittest.TestCase):
+
+    def test_add_replaces_old_digests(self):
+        index = PCloudContentIndex()
+        index.add(1, 3, checksums(b'old'))
+        index.add(1, 3, checksums(b'new'))
+        self.assertEqual(index.lookup(checksums(b'old'), 3), [])
+        self.assertEqual(index.lookup({'sha1': checksums(b'old')['sha1']}, 3),
+                         [])
+        self.assertEqual(index.lookup(checksums(b'new'), 3), [1])
+
+    def test_lookup_by_any_algorithm(self):
+        index = PCloudContentIndex()
+        index.add(1, 3, {'sha1': checksums(b'abc')['sha1']})
+        self.assertEqual(index.lookup(checksums(b'abc'), 3), [1])
+        self.assertEqual(index.lookup(checksums(b'abc'), 4), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+import unittest
+
+from pcloudapi.decoder import decode_python
+
+try:
+    from pcloudapi._speedups import decode as decode_c
+except ImportError:
+    decode_c = None
+
+from .test_pcloudbin import encode
+
+
+def hash_of(*pairs):
+    return bytes([16]) + b"".join(pairs) + bytes([255])
+
+
+def short_string(value):
+    encoded = value.encode('utf-8')
+    return bytes([100 + len(encoded)]) + encoded
+
+
+# every kind of value, each with the object it decodes to
+SAMPLES = [
+    (bytes([200]), 0),
+    (bytes([219]), 19),
+    (bytes([8, 0xff]), 255),
+    (bytes([11]) + (2 ** 32 - 1).to_bytes(4, 'little'), 2 ** 32 - 1),
+    (bytes([15]) + (2 ** 64 - 1).to_bytes(8, 'little'), 2 ** 64 - 1),
+    (bytes([18]), False),
+    (bytes([19]), True),
+    (bytes([20]) + (5).to_bytes(8, 'little'), 5),
+    (short_string(""), ""),
+    (short_string("név"), "név"),
+    (bytes([0, 3]) + b"abc", "abc"),
+    (bytes([1]) + (300).to_bytes(2, 'little') + b"x" * 300, "x" * 300),
+    (bytes(encode("ünicode" * 10)), "ünicode" * 10),
+    (bytes([17, 255]), []),
+    (bytes([16, 255]), {}),
+    # old strings refer to the strings seen before by index
+    (bytes([17]) + short_string("a") + short_string("b") +
+     bytes([150, 151, 4, 1, 255]), ["a", "b", "a", "b", "b"]),
+    (hash_of(short_string("name"), short_string("a"),
+             short_string("parent"), hash_of(short_string("name"),
+                                             bytes([151]))),
+     {'name': "a", 'parent': {'name': "a"}}),
+    (bytes(encode({'result': 0, 'metadata': {'contents': [
+            {'name': "f", 'size': 10, 'isfolder': False}]}})),
+     {'result': 0, 'metadata': {'contents': [
+            {'name': "f", 'size': 10, 'isfolder': False}]}}),
+]
+
+MALFORMED = [
+    b"",
+    bytes([21]),                        # unknown type
+    bytes([255]),                       # end outside of a container
+    bytes([16, 105, 255]),              # hash key without a value
+    bytes([17, 200]),                   # unterminated list
+    bytes([105]) + b"ab",               # truncated string
+    bytes([15, 1, 2]),                  # truncated int
+    bytes([150]),                       # unknown string index
+    bytes([0, 200]) + b"x",             # string longer than the frame
+]
+
+
+class _DecoderTests(object):
+
+    def test_samples(self):
+        for frame, expected in SAMPLES:
+            self.assertEqual(self.decode(frame), expected, frame)
+
+    def test_deep_nesting(self):
+        depth = 100000
+        decoded = self.decode(bytes([17]) * depth + bytes([255]) * depth)
+        for _ in range(depth - 1):
+            decoded, = decoded
+        self.assertEqual(decoded, [])
+
+    def test_malformed(self):
+        for frame in MALFORMED:
+            self.assertRaises(ValueError, self.decode, frame)
+
+    def test_buffers(self):
+        frame = bytes(encode({'result': 0, 'name': "a"}))
+        for buffer in (bytearray(frame), memoryview(frame)):
+            self.assertEqual(self.decode(buffer), {'result': 0, 'name': "a"})
+
+
+class PythonDecoderTest(_DecoderTests, unittest.TestCase):
+
+    decode = staticmethod(decode_python)
+
+
+@unittest.skipIf(decode_c is None, "_speedups extension not built")
+class SpeedupsDecoderTest(_DecoderTests, unittest.TestCase):
+
+    decode = staticmethod(decode_c)
+
+    def test_same_as_python(self):
+        for frame, _ in SAMPLES:
+            self.assertEqual(decode_c(frame), decode_python(frame))
+        for frame in MALFORMED:
+            with self.assertRaises(ValueError) as c_error:
+                decode_c(frame)
+            with self.assertRaises(ValueError) as python_error:
+                decode_python(frame)
+            self.assertEqual(type(c_error.exception),
+                             type(python_error.exception))
+
+
+if __name__ == '__main__':
+    unittest.main()
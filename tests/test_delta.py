@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+
+import hashlib
+import os
+import tempfile
+import unittest
+
+from pcloudapi import PCloudAPI, PCloudContentIndex, PCloudMetadataCache
+from pcloudapi.connection import AbstractPCloudConnection
+
+from .test_remotefile import _FakeFileConnection
+
+
+class _FakeWritableConnection(_FakeFileConnection, AbstractPCloudConnection):
+    """A remote file that can be checksummed, written and truncated."""
+
+    def __init__(self, content):
+        super().__init__(bytearray(content))
+        self.persistent_params = {}
+        self.writes = [] # (offset, size)
+        self.truncated = None
+
+    def _answer(self, method, params):
+        content = self.content
+        if method == 'file_open':
+            return {'result': 0, 'fd': 3, 'fileid': 7}, None
+        if method == 'file_size':
+            return {'result': 0, 'size': len(content)}, None
+        if method == 'file_checksum':
+            block = bytes(content[params['offset']:
+                                  params['offset'] + params['count']])
+            return {'result': 0, 'sha1': hashlib.sha1(block).hexdigest()}, \
+                   None
+        if method == 'file_pwrite':
+            data = params['_data']
+            self.writes.append((params['offset'], len(data)))
+            content[params['offset']:params['offset'] + len(data)] = data
+            return {'result': 0, 'bytes': len(data)}, None
+        if method == 'file_truncate':
+            self.truncated = params['length']
+            del content[params['length']:]
+            return {'result': 0}, None
+        if method == 'checksumfile':
+            return {'result': 0,
+                    'sha1': hashlib.sha1(content).hexdigest(),
+                    'metadata': {'fileid': 7, 'size': len(content),
+                                 'isfolder': False}}, None
+        return super()._answer(method, params)
+
+    def send_command_nb(self, method, params, data=None,
+                        data_progress_callback=None):
+        if data is not None:
+            params = dict(params, _data=data)
+        super().send_command_nb(method, params)
+
+
+class DeltaUploadTest(unittest.TestCase):
+
+    REMOTE = os.urandom(1000)
+
+    def upload(self, local, progress_callback=None, **kwargs):
+        fd, path = tempfile.mkstemp()
+        os.write(fd, local)
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        self.connection = _FakeWritableConnection(self.REMOTE)
+        self.api = PCloudAPI(connection=self.connection, **kwargs)
+        self.progress = []
+        return self.api.upload_delta(
+                    path, '/f', create_parent=False, block_size=100,
+                    progress_callback=progress_callback or self.progress.append)
+
+    def test_writes_changed_blocks(self):
+        local = bytearray(self.REMOTE)
+        local[150] ^= 1
+        local[720] ^= 1
+        summary = self.upload(bytes(local))
+        self.assertEqual(self.connection.writes, [(100, 100), (700, 100)])
+        self.assertEqual(bytes(self.connection.content), bytes(local))
+        self.assertEqual(summary, {'size': 1000, 'blocks': 10,
+                                   'changed': 2, 'written': 200})
+        self.assertEqual(self.progress, [100, 100])
+
+    def test_grows_and_shrinks(self):
+        local = self.REMOTE[:300] + os.urandom(250)
+        self.upload(local)
+        self.assertEqual(self.connection.writes, [(300, 100), (400, 100),
+                                                  (500, 50)])
+        self.assertEqual(bytes(self.connection.content), local)
+        local = self.REMOTE[:420]
+        self.upload(local)
+        self.assertEqual(self.connection.writes, [])
+        self.assertEqual(self.connection.truncated, 420)
+        self.assertEqual(bytes(self.connection.content), local)
+
+    def test_progress_reported_when_acknowledged(self):
+        local = os.urandom(1000)
+        acknowledged = []
+        original = _FakeWritableConnection._read_frame
+
+        def read_frame(connection):
+            response = original(connection)
+            if 'bytes' in response:
+                acknowledged.append(response['bytes'])
+            return response
+        _FakeWritableConnection._read_frame = read_frame
+        self.addCleanup(setattr, _FakeWritableConnection, '_read_frame',
+                        original)
+        progress = []
+
+        def progress_callback(size):
+            progress.append(size)
+            self.assertLessEqual(sum(progress), sum(acknowledged))
+        self.upload(local, progress_callback)
+        self.assertEqual(sum(progress), 1000)
+
+    def test_cache_and_index_forget_the_old_content(self):
+        cache = PCloudMetadataCache()
+        cache.put('/f', {'fileid': 7, 'size': 1000, 'hash': 1,
+                         'isfolder': False})
+        index = PCloudContentIndex()
+        index.add(7, 1000, {'sha1': hashlib.sha1(self.REMOTE).hexdigest()})
+        local = os.urandom(1000)
+        self.upload(local, cache=cache, content_index=index)
+        self.assertNotEqual(cache.get('/f').get('hash'), 1)
+        self.assertEqual(index.lookup(
+                            {'sha1': hashlib.sha1(self.REMOTE).hexdigest()},
+                            1000), [])
+        self.assertEqual(index.lookup(
+                            {'sha1': hashlib.sha1(local).hexdigest()},
+                            1000), [7])
+
+    def test_forgotten_without_verify(self):
+        cache = PCloudMetadataCache()
+        cache.put('/f', {'fileid': 7, 'size': 1000, 'isfolder': False})
+        index = PCloudContentIndex()
+        index.add(7, 1000, {'sha1': hashlib.sha1(self.REMOTE).hexdigest()})
+        fd, path = tempfile.mkstemp()
+        os.write(fd, b'other')
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        api = PCloudAPI(connection=_FakeWritableConnection(self.REMOTE),
+                        cache=cache, content_index=index)
+        api.upload_delta(path, '/f', create_parent=False, verify=False)
+        self.assertIsNone(cache.get('/f'))
+        self.assertNotIn(7, index)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+
+import threading
+import time
+import unittest
+
+from pcloudapi import PCloudAPI
+from pcloudapi.cache import PCloudMetadataCache
+from pcloudapi.connection import AbstractPCloudConnection
+from pcloudapi.directories import PCloudDirectories
+from pcloudapi.exceptions import PCloudException
+from pcloudapi.metrics import PCloudMetrics
+
+from .test_pcloudbin import connection_reading, frame
+
+
+class _FakeAPI(object):
+    """Creates folders like createfolderifnotexists, counting the calls."""
+
+    cache = None
+
+    def __init__(self, existing=()):
+        self.existing = set(['/']) | set(existing)
+        self.requests = []
+
+    def make_request(self, method, path):
+        self.requests.append(path)
+        if (path.rsplit('/', 1)[0] or '/') not in self.existing:
+            raise PCloudException(result_code=2002)
+        self.existing.add(path)
+        return {'result': 0}
+
+
+class EnsureTest(unittest.TestCase):
+
+    def test_nothing_known_creates_every_level(self):
+        api = _FakeAPI(['/a', '/a/b'])
+        PCloudDirectories(api).ensure('/a/b/c')
+        self.assertEqual(api.requests, ['/a', '/a/b', '/a/b/c'])
+
+    def test_missing_levels_created_top_down(self):
+        api = _FakeAPI(['/a'])
+        directories = PCloudDirectories(api)
+        directories.ensure('/a')
+        del api.requests[:]
+        directories.ensure('/a/b/c/d')
+        # from the remembered /a, no failed round trips
+        self.assertEqual(api.requests, ['/a/b', '/a/b/c', '/a/b/c/d'])
+        self.assertIn('/a/b/c/d', api.existing)
+
+    def test_cached_folder_is_known(self):
+        api = _FakeAPI(['/a', '/a/b'])
+        api.cache = PCloudMetadataCache()
+        api.cache.put('/a/b', {'isfolder': True})
+        PCloudDirectories(api).ensure('/a/b/c')
+        self.assertEqual(api.requests, ['/a/b/c'])
+
+    def test_remembered_parent_removed(self):
+        api = _FakeAPI(['/a'])
+        directories = PCloudDirectories(api)
+        directories.ensure('/a/b')
+        api.existing = set(['/'])
+        del api.requests[:]
+        directories.ensure('/a/b/c')
+        # the remembered /a/b fails once, then every level is created
+        self.assertEqual(api.requests, ['/a/b/c', '/a', '/a/b', '/a/b/c'])
+        self.assertIn('/a/b/c', api.existing)
+
+    def test_known_folders_take_no_request(self):
+        api = _FakeAPI(['/a'])
+        directories = PCloudDirectories(api)
+        directories.ensure('/a/b')
+        del api.requests[:]
+        directories.ensure('/a/b')
+        self.assertEqual(api.requests, [])
+
+    def test_concurrent_callers_create_once(self):
+        api = _FakeAPI()
+        make_request = api.make_request
+
+        def slow_request(method, path):
+            time.sleep(0.01)
+            return make_request(method, path)
+        api.make_request = slow_request
+        directories = PCloudDirectories(api)
+        threads = [threading.Thread(target=directories.ensure,
+                                    args=('/a/b/c',))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(api.requests, ['/a', '/a/b', '/a/b/c'])
+
+
+class _FakeConnection(AbstractPCloudConnection):
+    """Keeps the remote folders, answers createfolderifnotexists and
+    uploadfile.
+    """
+
+    def __init__(self):
+        self.persistent_params = {}
+        self.folders = set(['/'])
+
+    def send_command(self, method, **params):
+        path = params['path']
+        if method == 'createfolderifnotexists':
+            if (path.rsplit('/', 1)[0] or '/') not in self.folders:
+                return {'result': 2002}
+            self.folders.add(path)
+            return {'result': 0, 'metadata': {'isfolder': True}}
+        if method == 'uploadfile':
+            if path not in self.folders:
+                return {'result': 2005}
+            return {'result': 0, 'fileids': [1], 'metadata': [{}]}
+        raise AssertionError(method)
+
+
+class ApiDirectoriesTest(unittest.TestCase):
+
+    def test_folder_removed_remotely_is_created_again(self):
+        connection = _FakeConnection()
+        api = PCloudAPI(connection=connection)
+        api.create_directory('/a/b')
+        connection.folders = set(['/']) # removed by another client
+        with self.assertRaises(PCloudException):
+            api.uploadfile(path='/a/b', filename='f', _data=b'x')
+        api.create_directory('/a/b')
+        self.assertIn('/a/b', connection.folders)
+        api.uploadfile(path='/a/b', filename='f', _data=b'x')
+
+    def test_noresult_is_not_observed(self):
+        connection = connection_reading(frame({'result': 2005}))
+        api = PCloudAPI(connection=connection, cache=True,
+                        instrumentation=PCloudMetrics())
+        self.assertIsNone(api.make_request('uploadfile', path='/a',
+                                           _noresult=True))
+        self.assertEqual(connection.get_result(), {'result': 2005})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+
+import hashlib
+import http.server
+import os
+import re
+import tempfile
+import threading
+import unittest
+
+import requests
+
+from pcloudapi import PCloudAPI, PCloudException
+from pcloudapi.connection import AbstractPCloudConnection
+from pcloudapi.download import PCloudRangeDownloader, CHECKPOINT_SUFFIX
+
+DATA = os.urandom(100000)
+
+
+class _RangeHandler(http.server.BaseHTTPRequestHandler):
+    """Serves ranges of DATA (or the whole of it without a Range), the
+    ranges starting at the server's fail_from or later fail while it is
+    set. The starts requested go to the server's starts.
+    """
+
+    def do_GET(self):
+        if self.path == '/broken':
+            self.send_error(503)
+            return
+        if self.path == '/expired':
+            self.send_error(410)
+            return
+        data = b'' if self.path == '/empty' else DATA
+        if 'Range' not in self.headers or self.path == '/norange':
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+        start, end = map(int, re.match(r'bytes=(\d+)-(\d+)',
+                                       self.headers['Range']).groups())
+        self.server.starts.append(start)
+        if start >= len(data):
+            self.send_response(416)
+            self.send_header('Content-Range', 'bytes */{0}'.format(len(data)))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if self.server.fail_from is not None and start >= self.server.fail_from:
+            self.send_error(503)
+            return
+        end = min(end, len(DATA) - 1)
+        self.send_response(206)
+        if self.path != '/nocontentrange':
+            self.send_header('Content-Range',
+                             'bytes {0}-{1}/{2}'.format(start, end, len(DATA)))
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+        self.wfile.write(DATA[start:end + 1])
+
+    def log_message(self, *args):
+        pass
+
+
+class _ServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0),
+                                                      _RangeHandler)
+        self.server.starts = []
+        self.server.fail_from = None
+        threading.Thread(target=self.server.serve_forever,
+                         daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, self.path)
+
+    def url(self, path):
+        return 'http://127.0.0.1:{0}{1}'.format(self.server.server_port, path)
+
+
+class RangeDownloaderTest(_ServerTest):
+
+    def download(self, urls, **kwargs):
+        PCloudRangeDownloader(urls, self.path, connections=2,
+                              range_size=10000, **kwargs).download()
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), DATA)
+
+    def test_server_error_fails_over(self):
+        # the first range goes to the working url, the others fail over
+        self.download([self.url('/ok'), self.url('/broken')])
+
+    def test_client_error_without_refresh_fails_over(self):
+        self.download([self.url('/ok'), self.url('/expired')])
+
+    def test_client_error_refreshes(self):
+        self.download([self.url('/ok'), self.url('/expired')],
+                      refresh_urls=lambda: [self.url('/ok')])
+
+    def test_whole_file_answer_downloads_single_stream(self):
+        self.download([self.url('/norange')])
+
+    def test_no_content_range_downloads_single_stream(self):
+        self.download([self.url('/nocontentrange')])
+        # the first range only, then the whole file
+        self.assertEqual(self.server.starts, [0])
+
+    def test_empty_file(self):
+        size = PCloudRangeDownloader([self.url('/empty')], self.path,
+                                     connections=2).download()
+        self.assertEqual(size, 0)
+        self.assertEqual(os.path.getsize(self.path), 0)
+
+
+class CheckpointTest(_ServerTest):
+
+    def setUp(self):
+        super().setUp()
+        self.checkpoint_path = self.path + CHECKPOINT_SUFFIX
+        self.addCleanup(self.remove_checkpoint)
+
+    def remove_checkpoint(self):
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
+    def downloader(self, identity='a', **kwargs):
+        return PCloudRangeDownloader([self.url('/ok')], self.path,
+                                     connections=2, range_size=10000,
+                                     checkpoint_path=self.checkpoint_path,
+                                     identity=identity, **kwargs)
+
+    def interrupt(self):
+        """Downloads the first half, leaving a checkpoint."""
+        self.server.fail_from = 50000
+        with self.assertRaises(requests.HTTPError):
+            self.downloader(retries=0).download()
+        self.assertTrue(os.path.exists(self.checkpoint_path))
+        self.server.fail_from = None
+        del self.server.starts[:]
+
+    def assert_downloaded(self):
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), DATA)
+        self.assertFalse(os.path.exists(self.checkpoint_path))
+
+    def test_resumes(self):
+        self.interrupt()
+        self.assertEqual(self.downloader().download(), len(DATA))
+        self.assert_downloaded()
+        # only the missing ranges
+        self.assertEqual(sorted(self.server.starts),
+                         list(range(50000, len(DATA), 10000)))
+
+    def test_other_identity_starts_over(self):
+        self.interrupt()
+        self.downloader(identity='b').download()
+        self.assert_downloaded()
+        self.assertEqual(sorted(self.server.starts),
+                         list(range(0, len(DATA), 10000)))
+
+    def test_other_size_starts_over(self):
+        self.interrupt()
+        with open(self.path, 'ab') as f:
+            f.write(b'changed')
+        self.downloader().download()
+        self.assert_downloaded()
+        self.assertIn(0, self.server.starts)
+
+
+class _FakeConnection(AbstractPCloudConnection):
+    """Answers checksumfile with the checksums of content and
+    getfilelink with the path /ok.
+    """
+
+    use_ssl = False
+    timeout = 5
+
+    def __init__(self, content=DATA):
+        self.persistent_params = {}
+        self.content = content
+
+    def send_command(self, method, **params):
+        if method == 'checksumfile':
+            return {'result': 0,
+                    'sha256': hashlib.sha256(self.content).hexdigest(),
+                    'metadata': {'fileid': 1, 'hash': 7,
+                                 'size': len(self.content)}}
+        if method == 'getfilelink':
+            return {'result': 0, 'hosts': ['127.0.0.1'], 'path': '/ok'}
+        raise AssertionError(method)
+
+
+class ApiDownloadTest(_ServerTest):
+
+    def api(self, connection):
+        api = PCloudAPI(connection=connection)
+        # the test server is not on the default http port
+        api._download_urls = lambda response, suffix: [
+                self.url(response['path'])]
+        return api
+
+    def test_resumable_verified(self):
+        checkpoint_path = self.path + CHECKPOINT_SUFFIX
+        response = self.api(_FakeConnection()).download(
+                        '/f', self.path, connections=2, range_size=10000,
+                        resume=True)
+        self.assertEqual(response['sha256'], hashlib.sha256(DATA).hexdigest())
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), DATA)
+        self.assertFalse(os.path.exists(checkpoint_path))
+
+    def test_parallel(self):
+        progress = []
+        response = self.api(_FakeConnection()).download(
+                        '/f', self.path, connections=2, range_size=10000,
+                        progress_callback=progress.append)
+        self.assertEqual(response['path'], '/ok')
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), DATA)
+        self.assertEqual(sum(progress), len(DATA))
+        self.assertEqual(sorted(self.server.starts),
+                         list(range(0, len(DATA), 10000)))
+
+    def test_resumable_mismatch(self):
+        with self.assertRaises(PCloudException):
+            self.api(_FakeConnection(bytes(len(DATA)))).download(
+                        '/f', self.path, connections=2, range_size=10000,
+                        resume=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+import unittest
+
+from pcloudapi import PCloudAPI, PCloudEndpointSelector
+from pcloudapi.connection import AbstractPCloudConnection
+from pcloudapi.pcloudbin import PCLOUD_BINAPI_SERVER
+
+
+class _FakeConnection(AbstractPCloudConnection):
+
+    def __init__(self, responses):
+        self.persistent_params = {}
+        self.responses = responses
+
+    def send_command(self, method, **params):
+        return self.responses[method]
+
+
+class _Probe(object):
+    """Answers the latencies, raises IOError for None."""
+
+    def __init__(self, latencies):
+        self.latencies = latencies
+        self.probed = []
+
+    def __call__(self, host):
+        self.probed.append(host)
+        if self.latencies[host] is None:
+            raise IOError("unreachable")
+        return self.latencies[host]
+
+
+class ApiServersTest(unittest.TestCase):
+
+    def test_servers_of_getapiserver(self):
+        connection = _FakeConnection({
+            'getapiserver': {'result': 0,
+                             'binapi': ['eapi1.pcloud.com', 'eapi2.pcloud.com'],
+                             'api': ['eapi1.pcloud.com']},
+            'currentserver': {'result': 0, 'ip': '10.0.0.1',
+                              'ipbin': '10.0.0.2', 'ipv6': '::1',
+                              'hostname': 'eapi1.pcloud.com'},
+        })
+        api = PCloudAPI(connection=connection, retry_policy=None)
+        self.assertEqual(api.api_servers(), ['eapi1.pcloud.com',
+                                             'eapi2.pcloud.com',
+                                             PCLOUD_BINAPI_SERVER])
+
+
+class EndpointSelectorTest(unittest.TestCase):
+
+    def test_rank_fastest_first_failed_last(self):
+        probe = _Probe({'a': 0.3, 'b': None, 'c': 0.1, 'd': 0.3})
+        selector = PCloudEndpointSelector(probe)
+        self.assertEqual(selector.rank(['a', 'b', 'c', 'd']),
+                         ['c', 'a', 'd', 'b'])
+        self.assertEqual(selector.best(['a', 'b']), 'a')
+        self.assertIsNone(selector.latency('b'))
+
+    def test_measurements_are_cached(self):
+        probe = _Probe({'a': 0.2, 'b': 0.1})
+        selector = PCloudEndpointSelector(probe)
+        selector.rank(['a', 'b'])
+        selector.rank(['a', 'b'])
+        self.assertEqual(sorted(probe.probed), ['a', 'b'])
+        selector.forget('a')
+        selector.rank(['a', 'b'])
+        self.assertEqual(sorted(probe.probed), ['a', 'a', 'b'])
+
+    def test_reported_failure_moves_last(self):
+        selector = PCloudEndpointSelector(_Probe({'a': 0.1, 'b': 0.2}))
+        self.assertEqual(selector.rank(['a', 'b']), ['a', 'b'])
+        selector.report_failure('a')
+        self.assertEqual(selector.rank(['a', 'b']), ['b', 'a'])
+
+    def test_connect_fails_over(self):
+        selector = PCloudEndpointSelector(_Probe({'a': 0.1, 'b': 0.2}))
+
+        def connect(host):
+            if host == 'a':
+                raise IOError("refused")
+            return host + '-connection'
+        self.assertEqual(selector.connect(['a', 'b'], connect),
+                         ('b', 'b-connection'))
+        self.assertIsNone(selector.latency('a'))
+        with self.assertRaises(ValueError):
+            selector.connect([], connect)
+
+
+if __name__ == '__main__':
+    unittest.main()
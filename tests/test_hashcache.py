@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from pcloudapi import PCloudAPI
+from pcloudapi import hashcache
+from pcloudapi.connection import AbstractPCloudConnection
+from pcloudapi.hashcache import PCloudHashCache, stat_signature
+
+from .test_checksums import checksums
+
+
+class _HashCounting(object):
+    """Counts the calls of hashcache.hash_file while in use."""
+
+    def __enter__(self):
+        self.hashed = []
+        self._hash_file = hashcache.hash_file
+
+        def hash_file(path, *args):
+            self.hashed.append(path)
+            return self._hash_file(path, *args)
+
+        hashcache.hash_file = hash_file
+        return self
+
+    def __exit__(self, *args):
+        hashcache.hash_file = self._hash_file
+
+
+class PCloudHashCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.db_path = os.path.join(self.dir, 'hashes.db')
+        self.cache = PCloudHashCache(self.db_path)
+        self.addCleanup(self.cache.close)
+        self.path = os.path.join(self.dir, 'file')
+        self.write(b'content', 1000)
+
+    def write(self, content, mtime):
+        with open(self.path, 'wb') as f:
+            f.write(content)
+        os.utime(self.path, ns=(mtime, mtime))
+
+    def test_hashed_once(self):
+        with _HashCounting() as counting:
+            self.assertEqual(self.cache.digests(self.path),
+                             checksums(b'content'))
+            self.assertEqual(self.cache.digests(self.path),
+                             checksums(b'content'))
+        self.assertEqual(counting.hashed, [self.path])
+
+    def test_modified_file_hashed_again(self):
+        self.cache.digests(self.path)
+        # same size, only the mtime tells it changed
+        self.write(b'changed', 2000)
+        with _HashCounting() as counting:
+            self.assertEqual(self.cache.digests(self.path),
+                             checksums(b'changed'))
+        self.assertEqual(counting.hashed, [self.path])
+
+    def test_replaces_older_versions(self):
+        old = stat_signature(os.stat(self.path))
+        self.cache.digests(self.path)
+        self.write(b'changed', 2000)
+        self.cache.digests(self.path)
+        self.assertIsNone(self.cache.get(old))
+        rows = self.cache._db.execute("SELECT COUNT(*) FROM hashes").fetchone()
+        self.assertEqual(rows, (1,))
+
+    def test_persistent(self):
+        self.cache.digests(self.path)
+        self.cache.close()
+        with PCloudHashCache(self.db_path) as cache, \
+                _HashCounting() as counting:
+            self.assertEqual(cache.digests(self.path), checksums(b'content'))
+        self.assertEqual(counting.hashed, [])
+
+    def test_missing_algorithm_is_a_miss(self):
+        signature = stat_signature(os.stat(self.path))
+        self.cache.put(signature, {'sha1': checksums(b'content')['sha1']})
+        self.assertIsNone(self.cache.get(signature))
+        self.assertEqual(self.cache.digests(self.path), checksums(b'content'))
+
+
+class _FakeConnection(AbstractPCloudConnection):
+    """Answers checksumfile from the remote files by path."""
+
+    def __init__(self, files):
+        self.persistent_params = {}
+        self.files = files
+        self.methods = []
+
+    def send_command(self, method, **params):
+        self.methods.append(method)
+        if method == 'checksumfile':
+            content = self.files.get(params['path'])
+            if content is None:
+                return {'result': 2009}
+            response = checksums(content)
+            response['result'] = 0
+            return response
+        if method == 'uploadfile':
+            return {'result': 0, 'fileids': [1], 'metadata': [{'fileid': 1}]}
+        raise AssertionError(method)
+
+
+class ChangedFilesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.cache = PCloudHashCache(os.path.join(self.dir, 'hashes.db'))
+        self.addCleanup(self.cache.close)
+        self.files = []
+        for name in ('same', 'changed', 'new'):
+            path = os.path.join(self.dir, name)
+            with open(path, 'wb') as f:
+                f.write(name.encode())
+            self.files.append((path, '/' + name))
+        self.connection = _FakeConnection({'/same': b'same',
+                                           '/changed': b'old'})
+        self.api = PCloudAPI(connection=self.connection)
+
+    def test_changed_files(self):
+        self.assertEqual(self.api.changed_files(self.files, self.cache),
+                         self.files[1:])
+
+    def test_upload_skipped_when_unchanged(self):
+        local_path, remote_path = self.files[0]
+        self.api.upload(local_path, remote_path, create_parent=False,
+                        hash_cache=self.cache)
+        local_path, remote_path = self.files[1]
+        self.api.upload(local_path, remote_path, create_parent=False,
+                        hash_cache=self.cache)
+        self.assertEqual(self.connection.methods,
+                         ['checksumfile', 'checksumfile', 'uploadfile'])
+
+
+if __name__ == '__main__':
+    unittest.main()
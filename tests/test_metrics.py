@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+
+import collections
+import unittest
+
+from pcloudapi import CompositeInstrumentation
+from pcloudapi.metrics import PCloudInstrumentation, PCloudMetrics, \
+    PCloudTracing
+from pcloudapi.pipeline import PCloudPipeline
+
+
+class _Recorder(PCloudInstrumentation):
+
+    def __init__(self):
+        self.requests = [] # (method, result, error)
+
+    def on_request(self, method, seconds, result=None, error=None):
+        assert seconds >= 0
+        self.requests.append((method, result, error))
+
+
+class _FakeConnection(object):
+    """Answers each command with the next of replies, an exception in
+    replies is raised by _read_frame instead.
+    """
+
+    def __init__(self, *replies):
+        self.replies = collections.deque(replies)
+
+    def send_command_nb(self, method, params, data=None,
+                        data_progress_callback=None):
+        pass
+
+    def _read_frame(self):
+        reply = self.replies.popleft()
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+    def _decode_frame(self, frame):
+        return dict(frame)
+
+
+class PipelineInstrumentationTest(unittest.TestCase):
+
+    def test_reports_each_reply(self):
+        recorder = _Recorder()
+        connection = _FakeConnection({'result': 0}, {'result': 2009})
+        with PCloudPipeline(connection,
+                            instrumentation=recorder) as pipeline:
+            pipeline.submit('stat', path='/a')
+            pipeline.submit('stat', path='/b')
+        self.assertEqual(recorder.requests,
+                         [('stat', 0, None), ('stat', 2009, None)])
+
+    def test_reports_broken_stream(self):
+        recorder = _Recorder()
+        connection = _FakeConnection(IOError("reset"))
+        pipeline = PCloudPipeline(connection, instrumentation=recorder)
+        first = pipeline.submit('stat', path='/a')
+        second = pipeline.submit('stat', path='/b')
+        pipeline.flush()
+        self.assertRaises(IOError, first.result)
+        self.assertRaises(IOError, second.result)
+        self.assertEqual([method for method, _, _ in recorder.requests],
+                         ['stat', 'stat'])
+        self.assertTrue(all(isinstance(error, IOError)
+                            for _, _, error in recorder.requests))
+
+
+class PCloudMetricsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics = PCloudMetrics(latency_buckets=(0.1, 1),
+                                     size_buckets=(100,))
+
+    def test_requests(self):
+        self.metrics.on_request('stat', 0.05, result=0)
+        self.metrics.on_request('stat', 0.5, result=2009)
+        self.metrics.on_request('stat', 5, error=IOError())
+        self.assertEqual(self.metrics.counter('requests_total',
+                                              method='stat', result='0'), 1)
+        self.assertEqual(self.metrics.counter('requests_total',
+                                              method='stat', result='OSError'),
+                         1)
+        histogram = self.metrics.histogram('request_duration_seconds',
+                                           method='stat')
+        self.assertEqual(histogram['count'], 3)
+        self.assertEqual(histogram['buckets'],
+                         [(0.1, 1), (1, 2), (float('inf'), 3)])
+
+    def test_throughput(self):
+        self.assertIsNone(self.metrics.throughput('sent'))
+        self.metrics.on_data('sent', 300, 1.5)
+        self.metrics.on_data('sent', 100, 0.5)
+        self.assertEqual(self.metrics.throughput('sent'), 200)
+
+    def test_prometheus_text(self):
+        self.metrics.on_retry('stat', 1, response={'result': 5000})
+        self.metrics.on_frame('received', 50)
+        self.assertEqual(self.metrics.prometheus_text(), "\n".join([
+            '# HELP pcloud_retries_total Retried commands by reason',
+            '# TYPE pcloud_retries_total counter',
+            'pcloud_retries_total{method="stat",reason="5000"} 1',
+            '# HELP pcloud_frame_bytes Size of the binary protocol frames',
+            '# TYPE pcloud_frame_bytes histogram',
+            'pcloud_frame_bytes_bucket{direction="received",le="100"} 1',
+            'pcloud_frame_bytes_bucket{direction="received",le="+Inf"} 1',
+            'pcloud_frame_bytes_sum{direction="received"} 50',
+            'pcloud_frame_bytes_count{direction="received"} 1',
+        ]) + "\n")
+
+    def test_label_escaping(self):
+        self.metrics.on_request('a"b\\', 0, result=0)
+        self.assertIn('method="a\\"b\\\\"', self.metrics.prometheus_text())
+
+
+class CompositeInstrumentationTest(unittest.TestCase):
+
+    def test_calls_all(self):
+        first, second = _Recorder(), _Recorder()
+        CompositeInstrumentation(first, second).on_request('stat', 0, result=0)
+        self.assertEqual(first.requests, [('stat', 0, None)])
+        self.assertEqual(second.requests, [('stat', 0, None)])
+
+
+class _FakeSpan(object):
+
+    def __init__(self, name, attributes, start_time):
+        self.name = name
+        self.attributes = attributes
+        self.start_time = start_time
+        self.events = []
+        self.exceptions = []
+        self.end_time = None
+
+    def add_event(self, name, attributes, timestamp):
+        self.events.append((name, attributes))
+
+    def record_exception(self, error):
+        self.exceptions.append(error)
+
+    def set_status(self, status):
+        self.status = status
+
+    def end(self, end_time):
+        self.end_time = end_time
+
+
+class _FakeTracer(object):
+
+    def __init__(self):
+        self.spans = []
+
+    def start_span(self, name, attributes=None, start_time=None):
+        span = _FakeSpan(name, attributes, start_time)
+        self.spans.append(span)
+        return span
+
+
+class PCloudTracingTest(unittest.TestCase):
+
+    def test_span_per_request(self):
+        tracer = _FakeTracer()
+        tracing = PCloudTracing(tracer)
+        tracing.on_frame('sent', 40, method='stat')
+        tracing.on_retry('stat', 1, error=IOError())
+        tracing.on_request('stat', 0.25, result=0)
+        tracing.on_request('listfolder', 0, error=IOError())
+        first, second = tracer.spans
+        self.assertEqual(first.name, 'pcloud.stat')
+        self.assertEqual(first.attributes,
+                         {'pcloud.method': 'stat', 'pcloud.result': 0,
+                          'pcloud.frame_bytes.sent': 40})
+        self.assertEqual(first.events,
+                         [('retry', {'pcloud.attempt': 1,
+                                     'pcloud.reason': 'OSError'})])
+        self.assertEqual(first.end_time - first.start_time, 250000000)
+        # nothing of the first request leaks into the second
+        self.assertEqual(second.attributes, {'pcloud.method': 'listfolder'})
+        self.assertEqual(len(second.exceptions), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
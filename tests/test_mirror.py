@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+
+import unittest
+
+from pcloudapi.mirror import PCloudMirror
+
+from .test_subscription import _subscription
+
+LARGE_HASH = 10681749967730527559 # >= 2 ** 63
+
+
+class _FakeAPI(object):
+    """Answers diff and listfolder like a json connection would, the
+    diffs from the events (entries with increasing diffids).
+    """
+
+    connection = object()
+
+    def __init__(self, tree, diffid=1):
+        self.tree = tree
+        self.diffid = diffid
+        self.events = []
+        self.methods = []
+        self.diffs = [] # (diffid, limit) of the diff requests after one
+
+    def make_request(self, method, **params):
+        self.methods.append(method)
+        if method == 'diff':
+            if 'diffid' not in params:
+                return {'result': 0, 'diffid': self.diffid, 'entries': []}
+            self.diffs.append((params['diffid'], params['limit']))
+            entries = [entry for entry in self.events
+                       if entry['diffid'] > params['diffid']]
+            entries = entries[:params['limit']]
+            return {'result': 0, 'entries': entries,
+                    'diffid': entries[-1]['diffid'] if entries
+                              else params['diffid']}
+        if method == 'listfolder':
+            return {'result': 0, 'metadata': self.tree}
+        raise AssertionError(method)
+
+
+def _file(fileid, name, hash, size=10, parentfolderid=0):
+    return {'id': 'f{0}'.format(fileid), 'fileid': fileid, 'name': name,
+            'parentfolderid': parentfolderid, 'isfolder': False,
+            'size': size, 'hash': hash}
+
+
+def _folder(folderid, name, parentfolderid=0, contents=()):
+    return {'id': 'd{0}'.format(folderid), 'folderid': folderid,
+            'name': name, 'parentfolderid': parentfolderid,
+            'isfolder': True, 'contents': list(contents)}
+
+
+def _root(*contents):
+    return {'id': 'd0', 'folderid': 0, 'name': '/', 'isfolder': True,
+            'contents': list(contents)}
+
+
+class MirrorHashTest(unittest.TestCase):
+
+    def setUp(self):
+        tree = {'id': 'd0', 'folderid': 0, 'name': '/', 'isfolder': True,
+                'contents': [_file(1, 'large', LARGE_HASH),
+                             _file(2, 'small', 12345)]}
+        self.mirror = PCloudMirror(_FakeAPI(tree), ':memory:')
+        self.addCleanup(self.mirror.close)
+        self.mirror.bootstrap()
+
+    def test_large_hash(self):
+        found = self.mirror.find(hash=LARGE_HASH)
+        self.assertEqual([metadata['fileid'] for metadata in found], [1])
+        self.assertEqual(found[0]['hash'], LARGE_HASH)
+        self.assertEqual(self.mirror.get('/large')['hash'], LARGE_HASH)
+
+    def test_small_hash(self):
+        found = self.mirror.find(hash=12345, size=10)
+        self.assertEqual([metadata['fileid'] for metadata in found], [2])
+
+    def test_event_with_large_hash(self):
+        self.mirror.apply([{'event': 'modifyfile', 'diffid': 2,
+                            'metadata': _file(2, 'small', LARGE_HASH + 1)}])
+        found = self.mirror.find(hash=LARGE_HASH + 1)
+        self.assertEqual([metadata['fileid'] for metadata in found], [2])
+
+
+class MirrorUpdateTest(unittest.TestCase):
+
+    def setUp(self):
+        # /a/b/x and /c/y
+        self.api = _FakeAPI(_root(
+                _folder(1, 'a', contents=[
+                    _folder(2, 'b', 1, [_file(1, 'x', 1, parentfolderid=2)])]),
+                _folder(3, 'c', contents=[_file(2, 'y', 2, parentfolderid=3)])
+            ))
+        self.mirror = PCloudMirror(self.api, ':memory:', diff_limit=2)
+        self.addCleanup(self.mirror.close)
+
+    def update(self, *events):
+        self.api.events.extend(events)
+        return self.mirror.update()
+
+    def names(self, path):
+        return sorted(metadata['name']
+                      for metadata in self.mirror.children(path))
+
+    def test_first_update_bootstraps(self):
+        self.assertEqual(self.mirror.update(), 0)
+        self.assertEqual(self.mirror.diffid, 1)
+        self.assertEqual(len(self.mirror), 6) # with the root
+        self.assertEqual(self.names('/'), ['a', 'c'])
+        self.assertEqual(self.names('/a/b'), ['x'])
+        self.assertEqual(self.mirror.path_of(fileid=1), '/a/b/x')
+        self.assertEqual(self.mirror.path_of(folderid=3), '/c')
+        self.assertIsNone(self.mirror.path_of(fileid=99))
+
+    def test_diff_paging(self):
+        self.mirror.update()
+        applied = self.update(*[{'event': 'createfile', 'diffid': diffid,
+                                 'metadata': _file(diffid, str(diffid), 0)}
+                                for diffid in range(2, 7)])
+        self.assertEqual(applied, 5)
+        # diff_limit entries per request, until a short page
+        self.assertEqual(self.api.diffs, [(1, 2), (3, 2), (5, 2)])
+        self.assertEqual(self.mirror.diffid, 6)
+        self.assertEqual(self.names('/'), ['2', '3', '4', '5', '6', 'a', 'c'])
+
+    def test_reset_bootstraps_again(self):
+        self.mirror.update()
+        self.api.tree = _root(_file(9, 'z', 9))
+        self.api.diffid = 5
+        self.update({'event': 'reset', 'diffid': 2})
+        self.assertEqual(self.api.methods.count('listfolder'), 2)
+        self.assertEqual(self.mirror.diffid, 5)
+        self.assertEqual(self.names('/'), ['z'])
+
+    def test_deletefolder_removes_the_subtree(self):
+        self.mirror.update()
+        self.update({'event': 'deletefolder', 'diffid': 2,
+                     'metadata': _folder(1, 'a')})
+        self.assertEqual(self.names('/'), ['c'])
+        self.assertEqual(len(self.mirror), 3) # the root, c and y
+        self.assertIsNone(self.mirror.get_by_id(fileid=1))
+
+    def test_modifyfolder_moves(self):
+        self.mirror.update()
+        self.update({'event': 'modifyfolder', 'diffid': 2,
+                     'metadata': _folder(2, 'moved', 3)})
+        self.assertEqual(self.names('/a'), [])
+        self.assertEqual(self.names('/c'), ['moved', 'y'])
+        # the contents follow their folder
+        self.assertEqual(self.mirror.path_of(fileid=1), '/c/moved/x')
+        self.assertEqual(self.mirror.get('/c/moved/x')['fileid'], 1)
+
+
+class MirrorSubscriptionTest(unittest.TestCase):
+
+    def test_reset_bootstraps(self):
+        api = _FakeAPI(_root(_file(1, 'a', 1)), diffid=10)
+        mirror = PCloudMirror(api, ':memory:')
+        self.addCleanup(mirror.close)
+        mirror.bootstrap()
+        # b and c are listed by the bootstrap after the reset
+        api.tree = _root(_file(2, 'b', 2), _file(3, 'c', 3))
+        api.diffid = 13
+        subscription, connection = _subscription(
+                mirror.on_changes,
+                [[{'event': 'reset', 'diffid': 11}],
+                 [{'event': 'createfile', 'diffid': 12,
+                   'metadata': _file(2, 'b', 2)}],
+                 [{'event': 'deletefile', 'diffid': 13,
+                   'metadata': _file(1, 'a', 1)},
+                  {'event': 'createfile', 'diffid': 14,
+                   'metadata': _file(4, 'd', 4)}]])
+        subscription.run()
+        self.assertEqual(api.methods.count('listfolder'), 2)
+        self.assertEqual(mirror.diffid, 14)
+        self.assertEqual(sorted(metadata['name']
+                                for metadata in mirror.children('/')),
+                         ['b', 'c', 'd'])
+
+
+if __name__ == '__main__':
+    unittest.main()
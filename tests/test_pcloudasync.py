@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+
+import asyncio
+import unittest
+
+from pcloudapi import AsyncPCloudAPI, AsyncPCloudBinaryConnection
+
+from .test_pcloudbin import decode_request, frame
+
+
+class _FakeServer(object):
+    """Binary api on loopback: creates folders and echoes the rest."""
+
+    def __init__(self):
+        self.requests = []
+        self.folders = set(['/'])
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle,
+                                                 '127.0.0.1', 0)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                size = int.from_bytes(await reader.readexactly(2), 'little')
+                method, params, data_len = decode_request(
+                                                await reader.readexactly(size))
+                data = await reader.readexactly(data_len or 0)
+                self.requests.append((method, params))
+                writer.write(frame(await self.answer(method, params, data)))
+                await writer.drain()
+        except asyncio.IncompleteReadError:
+            pass
+        finally:
+            writer.close()
+
+    async def answer(self, method, params, data):
+        if method == 'createfolderifnotexists':
+            await asyncio.sleep(0.01)
+            if (params['path'].rsplit('/', 1)[0] or '/') not in self.folders:
+                return {'result': 2002}
+            self.folders.add(params['path'])
+            return {'result': 0}
+        if method == 'sleep':
+            await asyncio.sleep(params['seconds'] / 1000)
+        return {'result': 0, 'method': method, 'size': len(data),
+                'value': params.get('value', 0)}
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+
+class AsyncClientTest(unittest.TestCase):
+
+    def run_with_api(self, test):
+        async def run():
+            server = _FakeServer()
+            port = await server.start()
+            try:
+                async with AsyncPCloudAPI(AsyncPCloudBinaryConnection(
+                                use_ssl=False, server='127.0.0.1',
+                                port=port)) as api:
+                    await test(api, server)
+            finally:
+                await server.close()
+        asyncio.run(run())
+
+    def test_send_before_connect(self):
+        async def send():
+            await AsyncPCloudBinaryConnection().send_command('userinfo')
+        with self.assertRaises(ValueError):
+            asyncio.run(send())
+
+    def test_concurrent_commands_get_their_replies(self):
+        async def test(api, server):
+            responses = await asyncio.gather(
+                    api.make_request('sleep', seconds=30, value=1),
+                    api.make_request('stat', value=2),
+                    api.make_request('sleep', seconds=10, value=3))
+            self.assertEqual([response['value'] for response in responses],
+                             [1, 2, 3])
+        self.run_with_api(test)
+
+    def test_data_is_sent(self):
+        async def test(api, server):
+            response = await api.make_request('upload_write',
+                                              _data=b'x' * 100000)
+            self.assertEqual(response['size'], 100000)
+        self.run_with_api(test)
+
+    def test_create_directory_top_down_once(self):
+        async def test(api, server):
+            await asyncio.gather(*[api.create_directory('/a/b/c')
+                                   for _ in range(5)])
+            await api.create_directory('/a/b')
+            self.assertEqual(server.requests,
+                             [('createfolderifnotexists', {'path': '/a'}),
+                              ('createfolderifnotexists', {'path': '/a/b'}),
+                              ('createfolderifnotexists', {'path': '/a/b/c'})])
+            self.assertIn('/a/b/c', server.folders)
+        self.run_with_api(test)
+
+    def test_create_directory_after_removal(self):
+        async def test(api, server):
+            await api.create_directory('/a/b')
+            server.folders = set(['/'])
+            del server.requests[:]
+            await api.create_directory('/a/b/c')
+            self.assertEqual([params['path'] for _, params in server.requests],
+                             ['/a/b/c', '/a', '/a/b', '/a/b/c'])
+        self.run_with_api(test)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+
+import hashlib
+import io
+import os
+import shutil
+import socket
+import ssl
+import subprocess
+import tempfile
+import threading
+import unittest
+
+from pcloudapi.metrics import PCloudInstrumentation
+from pcloudapi.pcloudbin import PCloudBinaryConnection, RECV_CHUNK_SIZE
+from pcloudapi.utils import PCloudBuffer
+
+
+def connection_reading(data):
+    """Returns a not connected connection whose stream yields data,
+    what it sends goes to its .sent BytesIO.
+    """
+    connection = PCloudBinaryConnection()
+    connection.sent = io.BytesIO()
+    connection.fp = PCloudBuffer(io.BytesIO(data), connection.sent, 8192)
+    return connection
+
+
+def encode(value, out=None):
+    """Encodes a response value (dict, list, str, int, bool)."""
+    out = bytearray() if out is None else out
+    if isinstance(value, bool):
+        out.append(19 if value else 18)
+    elif isinstance(value, int):
+        out.append(15)
+        out += value.to_bytes(8, 'little')
+    elif isinstance(value, str):
+        encoded = value.encode('utf-8')
+        out.append(3) # length in the next 4 bytes
+        out += len(encoded).to_bytes(4, 'little') + encoded
+    elif isinstance(value, dict):
+        out.append(16)
+        for key, item in value.items():
+            encode(key, out)
+            encode(item, out)
+        out.append(255)
+    else:
+        out.append(17)
+        for item in value:
+            encode(item, out)
+        out.append(255)
+    return out
+
+
+def frame(value):
+    encoded = encode(value)
+    return len(encoded).to_bytes(4, 'little') + bytes(encoded)
+
+
+def decode_request(body):
+    """Returns (method, params, data length or None) of a request body
+    (without its 2 bytes length).
+    """
+    method_len = body[0] & 0x7f
+    pos = 1
+    data_len = None
+    if body[0] & 0x80:
+        data_len = int.from_bytes(body[pos:pos + 8], 'little')
+        pos += 8
+    method = body[pos:pos + method_len].decode('utf-8')
+    pos += method_len
+    params = {}
+    count = body[pos]
+    pos += 1
+    for _ in range(count):
+        key_len = body[pos] & 0x3f
+        is_int = body[pos] & 0x40
+        key = body[pos + 1:pos + 1 + key_len].decode('utf-8')
+        pos += 1 + key_len
+        if is_int:
+            params[key] = int.from_bytes(body[pos:pos + 8], 'little')
+            pos += 8
+        else:
+            value_len = int.from_bytes(body[pos:pos + 4], 'little')
+            params[key] = body[pos + 4:pos + 4 + value_len].decode('utf-8')
+            pos += 4 + value_len
+    return method, params, data_len
+
+
+_TLS_CONTEXTS = []
+
+
+def tls_contexts():
+    """Returns (server, client) SSLContexts trusting a self-signed
+    certificate of 127.0.0.1, None if openssl is missing.
+    """
+    if not _TLS_CONTEXTS:
+        directory = tempfile.mkdtemp()
+        try:
+            cert = os.path.join(directory, 'cert.pem')
+            key = os.path.join(directory, 'key.pem')
+            subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048',
+                            '-nodes', '-days', '1', '-subj', '/CN=127.0.0.1',
+                            '-addext', 'subjectAltName=IP:127.0.0.1',
+                            '-keyout', key, '-out', cert],
+                           check=True, capture_output=True)
+            server = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            server.load_cert_chain(cert, key)
+            client = ssl.create_default_context(cafile=cert)
+            _TLS_CONTEXTS.append((server, client))
+        except (OSError, subprocess.CalledProcessError):
+            _TLS_CONTEXTS.append(None)
+        finally:
+            shutil.rmtree(directory)
+    return _TLS_CONTEXTS[0]
+
+
+def connection_receiving(test, use_ssl=False):
+    """Returns (connection over a socket pair, finish), finish() shuts
+    the connection's socket down and returns all it sent.
+    """
+    ours, theirs = socket.socketpair()
+    received = bytearray()
+    if use_ssl:
+        server, client = tls_contexts()
+
+    def receive(sock):
+        if use_ssl:
+            sock = server.wrap_socket(sock, server_side=True)
+        with sock:
+            for chunk in iter(lambda: sock.recv(65536), b''):
+                received.extend(chunk)
+
+    thread = threading.Thread(target=receive, args=(theirs,))
+    thread.start()
+    if use_ssl:
+        ours = client.wrap_socket(ours, server_hostname='127.0.0.1')
+    test.addCleanup(ours.close)
+    connection = PCloudBinaryConnection()
+    connection.socket = ours
+    raw = socket.SocketIO(ours, 'rwb')
+    ours._io_refs += 1
+    connection.fp = PCloudBuffer(raw, raw, 8192)
+
+    def finish():
+        connection.fp.flush()
+        ours.shutdown(socket.SHUT_WR) # a ragged EOF with ssl
+        thread.join()
+        return received
+
+    return connection, finish
+
+
+class SendRawDataTest(unittest.TestCase):
+
+    DATA = os.urandom(3 * 1024 * 1024 + 5)
+
+    def setUp(self):
+        self.file = tempfile.TemporaryFile()
+        self.addCleanup(self.file.close)
+        self.file.write(b'skip' + self.DATA + b'tail')
+        self.file.seek(4)
+        self.progress = []
+
+    def send(self, data, use_ssl=False, data_len=None):
+        connection, finish = connection_receiving(self, use_ssl)
+        sent = []
+        sendfile = connection._sendfile
+        connection._sendfile = lambda *args: sent.append(sendfile(*args))
+        connection.send_command_nb('uploadfile', {'path': '/'}, data=data,
+                                   data_len=data_len,
+                                   data_progress_callback=self.progress.append)
+        received = finish()
+        self.assertEqual(bytes(received[-len(self.DATA):]), self.DATA)
+        self.assertEqual(sum(self.progress), len(self.DATA))
+        return bool(sent)
+
+    def test_file_by_sendfile(self):
+        self.assertTrue(self.send(self.file, data_len=len(self.DATA)))
+        self.assertEqual(self.file.read(), b'tail')
+
+    @unittest.skipIf(tls_contexts() is None, "openssl is missing")
+    def test_file_from_mmap_over_ssl(self):
+        self.assertFalse(self.send(self.file, use_ssl=True,
+                                   data_len=len(self.DATA)))
+        self.assertEqual(self.file.read(), b'tail')
+
+    def test_buffer(self):
+        self.assertFalse(self.send(memoryview(self.DATA)))
+
+    def test_stream(self):
+        self.assertFalse(self.send(io.BytesIO(self.DATA)))
+
+    def test_length_mismatch(self):
+        connection, finish = connection_receiving(self)
+        self.assertRaises(IOError, connection.send_command_nb,
+                          'uploadfile', {}, data=b'abc', data_len=4)
+        finish()
+
+
+class _DataRecording(PCloudInstrumentation):
+
+    def __init__(self):
+        self.data = []
+
+    def on_data(self, direction, size, seconds):
+        self.data.append((direction, size))
+
+
+class WriteDataToFileTest(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, self.path)
+
+    def test_progress_callback(self):
+        data = os.urandom(5 * RECV_CHUNK_SIZE + 123)
+        connection = connection_reading(data + b'next')
+        progress = []
+        digest = hashlib.sha1()
+        connection.write_data_to_file(self.path, len(data),
+                                      progress_callback=progress.append,
+                                      digests=[digest])
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), data)
+        self.assertEqual(sum(progress), len(data))
+        self.assertGreater(len(progress), 1)
+        self.assertEqual(digest.hexdigest(), hashlib.sha1(data).hexdigest())
+        # the stream is left right after the data
+        self.assertEqual(connection.fp.read(4), b'next')
+
+    def test_empty(self):
+        connection = connection_reading(b'')
+        connection.instrumentation = _DataRecording()
+        connection.write_data_to_file(self.path, 0,
+                                      progress_callback=self.fail)
+        self.assertEqual(os.path.getsize(self.path), 0)
+        # reported like any download
+        self.assertEqual(connection.instrumentation.data, [('received', 0)])
+
+
+class _ShortWriter(object):
+    """Raw writer accepting at most 1000 bytes per write."""
+
+    def __init__(self):
+        self.written = bytearray()
+
+    def write(self, data):
+        self.written += data[:1000]
+        return min(len(data), 1000)
+
+
+class ReadDataTest(unittest.TestCase):
+
+    DATA = os.urandom(3 * RECV_CHUNK_SIZE + 5)
+
+    def test_into_buffer(self):
+        connection = connection_reading(self.DATA + b'next')
+        buffer = bytearray(len(self.DATA) + 10)
+        data = connection.read_data(len(self.DATA), buffer)
+        self.assertEqual(bytes(data), self.DATA)
+        # no copy, the data is in the buffer
+        self.assertEqual(buffer[:len(self.DATA)], self.DATA)
+        self.assertEqual(connection.fp.read(4), b'next')
+
+    def test_buffer_too_small(self):
+        connection = connection_reading(self.DATA)
+        self.assertRaises(ValueError, connection.read_data, len(self.DATA),
+                          bytearray(10))
+
+    def test_truncated(self):
+        connection = connection_reading(self.DATA[:-1])
+        self.assertRaises(IOError, connection.read_data, len(self.DATA),
+                          bytearray(len(self.DATA)))
+        # the rest of the data would be taken for the next reply
+        self.assertTrue(connection._broken)
+
+    def test_short_writes(self):
+        connection = connection_reading(self.DATA)
+        writer = _ShortWriter()
+        connection.write_data(writer, len(self.DATA))
+        self.assertEqual(writer.written, self.DATA)
+
+
+class IterListfolderTest(unittest.TestCase):
+
+    LISTING = {'result': 0,
+               'metadata': {'name': '/', 'isfolder': True, 'folderid': 0,
+                            'contents': [{'name': 'a', 'isfolder': False},
+                                         {'name': 'b', 'isfolder': False}]}}
+
+    def test_closed_before_starting(self):
+        connection = connection_reading(frame({'result': 0, 'next': 1}))
+        connection.iter_listfolder(path='/').close()
+        self.assertEqual(connection.sent.getvalue(), b'')
+        self.assertEqual(connection.get_result(), {'result': 0, 'next': 1})
+
+    def test_closed_early_drains_reply(self):
+        connection = connection_reading(frame(self.LISTING) +
+                                        frame({'result': 0, 'next': 1}))
+        entries = connection.iter_listfolder(path='/')
+        self.assertEqual(next(entries)['path'], '/')
+        entries.close()
+        self.assertEqual(connection.get_result(), {'result': 0, 'next': 1})
+
+    def test_exhausted(self):
+        connection = connection_reading(frame(self.LISTING))
+        paths = [entry['path'] for entry in
+                 connection.iter_listfolder(path='/')]
+        self.assertEqual(paths, ['/', '/a', '/b'])
+
+
+class EncodeRequestTest(unittest.TestCase):
+
+    def test_decoded_back(self):
+        connection = PCloudBinaryConnection(auth='token')
+        request = connection._encode_request(
+                        'uploadfile', {'path': '/a', 'nopartial': 1}, 10)
+        self.assertEqual(int.from_bytes(request[:2], 'little'),
+                         len(request) - 2)
+        self.assertEqual(decode_request(request[2:]),
+                         ('uploadfile',
+                          {'path': '/a', 'nopartial': 1, 'auth': 'token'},
+                          10))
+
+    @staticmethod
+    def reference(method, params):
+        """The request as params.update(persistent_params) encoded it."""
+        req = bytearray([len(method)]) + method.encode('utf-8')
+        req.append(len(params))
+        for key, value in params.items():
+            if isinstance(value, int):
+                req.append(len(key) | 0x40)
+                req += key.encode('utf-8') + value.to_bytes(8, 'little')
+            else:
+                value = value.encode('utf-8')
+                req.append(len(key))
+                req += key.encode('utf-8')
+                req += len(value).to_bytes(4, 'little') + value
+        return len(req).to_bytes(2, 'little') + bytes(req)
+
+    def check(self, params, persistent_params):
+        connection = PCloudBinaryConnection()
+        connection.persistent_params.update(persistent_params)
+        expected = dict(params)
+        expected.update(persistent_params)
+        for _ in range(2): # built, then from the template
+            self.assertEqual(
+                    connection._encode_request('stat', dict(params), None),
+                    self.reference('stat', expected))
+
+    def test_persistent_params_appended(self):
+        self.check({'path': '/a', 'folderid': 0},
+                   {'auth': 'token', 'timeformat': 'timestamp'})
+
+    def test_overridden_param_keeps_its_position(self):
+        self.check({'auth': 'other', 'path': '/a', 'timeformat': 'x'},
+                   {'timeformat': 'timestamp', 'auth': 'token', 'id': 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+
+import http.server
+import io
+import json
+import threading
+import unittest
+import urllib.parse
+
+from pcloudapi.pcloudjson import PCloudJSONConnection
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    """Records the requests and answers {'result': 0}."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def _body(self):
+        if self.headers.get('Transfer-Encoding') == 'chunked':
+            body = b""
+            while True:
+                size = int(self.rfile.readline().split(b";")[0], 16)
+                chunk = self.rfile.read(size + 2)[:size]
+                if not size:
+                    return body
+                body += chunk
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def _answer(self):
+        url = urllib.parse.urlsplit(self.path)
+        self.server.requests.append({
+            'method': self.command,
+            'path': url.path,
+            'params': dict(urllib.parse.parse_qsl(url.query)),
+            'length': self.headers.get('Content-Length'),
+            'chunked': self.headers.get('Transfer-Encoding') == 'chunked',
+            'body': self._body(),
+            'client': self.client_address,
+        })
+        reply = json.dumps({'result': 0}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+
+    do_GET = do_PUT = _answer
+
+    def log_message(self, *args):
+        pass
+
+
+class _NotSeekable(io.RawIOBase):
+
+    def __init__(self, data):
+        self.fp = io.BytesIO(data)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        return self.fp.readinto(buffer)
+
+
+class PCloudJSONConnectionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0),
+                                                     _Handler)
+        self.server.requests = []
+        thread = threading.Thread(target=self.server.serve_forever,
+                                  args=(0.05,))
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.connection = PCloudJSONConnection(
+                                use_ssl=False,
+                                server='127.0.0.1',
+                                port=self.server.server_address[1],
+                                persistent_params={'auth': 'token'})
+        self.addCleanup(self.connection.close)
+        self.progress = []
+
+    def upload(self, data):
+        self.assertEqual(self.connection.send_command(
+                                'uploadfile', path='/f', _data=data,
+                                _data_progress_callback=self.progress.append),
+                         {'result': 0})
+        return self.server.requests[-1]
+
+    def test_command(self):
+        self.connection.send_command('stat', path='/f')
+        request, = self.server.requests
+        self.assertEqual((request['method'], request['path']), ('GET', '/stat'))
+        self.assertEqual(request['params'], {'path': '/f', 'auth': 'token'})
+
+    def test_bytes(self):
+        request = self.upload(b"0123456789")
+        self.assertEqual(request['method'], 'PUT')
+        self.assertEqual((request['body'], request['length']),
+                         (b"0123456789", '10'))
+        self.assertEqual(sum(self.progress), 10)
+
+    def test_file_streamed_with_length(self):
+        fp = io.BytesIO(b"skip0123456789")
+        fp.seek(4)
+        request = self.upload(fp)
+        self.assertEqual((request['body'], request['length']),
+                         (b"0123456789", '10'))
+        self.assertFalse(request['chunked'])
+        self.assertEqual(sum(self.progress), 10)
+
+    def test_unseekable_file_chunked(self):
+        request = self.upload(_NotSeekable(b"0123456789"))
+        self.assertTrue(request['chunked'])
+        self.assertEqual(request['body'], b"0123456789")
+        self.assertEqual(sum(self.progress), 10)
+
+    def test_iterator_chunked(self):
+        request = self.upload(iter([b"0123", b"4567", b"89"]))
+        self.assertTrue(request['chunked'])
+        self.assertEqual(request['body'], b"0123456789")
+        self.assertEqual(self.progress, [4, 4, 2])
+
+    def test_keep_alive(self):
+        for _ in range(3):
+            self.connection.send_command('stat', path='/f')
+        self.upload(b"data")
+        clients = {request['client'] for request in self.server.requests}
+        self.assertEqual(len(clients), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
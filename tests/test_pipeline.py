@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+import io
+import unittest
+
+from pcloudapi.exceptions import PCloudException
+from pcloudapi.utils import PCloudBuffer
+
+from .test_pcloudbin import connection_reading, decode_request, encode, frame
+
+
+def data_frame(result, data):
+    """Returns a response announcing data followed by the data."""
+    encoded = bytearray([16])
+    encode('result', encoded)
+    encode(result, encoded)
+    encode('data', encoded)
+    encoded.append(20)
+    encoded += len(data).to_bytes(8, 'little')
+    encoded.append(255)
+    return len(encoded).to_bytes(4, 'little') + bytes(encoded) + data
+
+
+def requests(connection):
+    """Returns the (method, params) of the requests sent."""
+    sent = connection.sent.getvalue()
+    result = []
+    pos = 0
+    while pos < len(sent):
+        length = int.from_bytes(sent[pos:pos + 2], 'little')
+        method, params, _ = decode_request(sent[pos + 2:pos + 2 + length])
+        result.append((method, params))
+        pos += 2 + length
+    return result
+
+
+class PCloudPipelineTest(unittest.TestCase):
+
+    def test_results_in_order(self):
+        connection = connection_reading(b"".join(
+                frame({'result': 0, 'n': n}) for n in range(5)))
+        with connection.pipeline(max_in_flight=2) as pipeline:
+            futures = [pipeline.submit('stat', fileid=n) for n in range(5)]
+        self.assertEqual([future.result()['n'] for future in futures],
+                         list(range(5)))
+        self.assertEqual(requests(connection),
+                         [('stat', {'fileid': n}) for n in range(5)])
+
+    def test_map(self):
+        connection = connection_reading(b"".join(
+                frame({'result': 0, 'n': n}) for n in range(3)))
+        pipeline = connection.pipeline(max_in_flight=2)
+        results = pipeline.map('stat', ({'fileid': n} for n in range(3)))
+        self.assertEqual([result['n'] for result in results], [0, 1, 2])
+
+    def test_check_result(self):
+        connection = connection_reading(frame({'result': 2009}) +
+                                        frame({'result': 0}))
+        with connection.pipeline(check_result=True) as pipeline:
+            missing = pipeline.submit('stat', path='/missing')
+            found = pipeline.submit('stat', path='/found')
+        with self.assertRaises(PCloudException) as raised:
+            missing.result()
+        self.assertEqual(raised.exception.result_code, 2009)
+        self.assertEqual(found.result(), {'result': 0})
+
+    def test_data_read_with_reply(self):
+        connection = connection_reading(data_frame(0, b"abc") +
+                                        frame({'result': 0}))
+        with connection.pipeline() as pipeline:
+            read = pipeline.submit('file_read', fd=1, count=3)
+            closed = pipeline.submit('file_close', fd=1)
+        self.assertEqual(bytes(read.result()['_data']), b"abc")
+        self.assertEqual(closed.result(), {'result': 0})
+
+    def test_recovers_after_decode_error(self):
+        malformed = (1).to_bytes(4, 'little') + bytes([21]) # unknown type
+        connection = connection_reading(frame({'result': 0, 'n': 1}) +
+                                        malformed +
+                                        frame({'result': 0, 'n': 3}))
+        with connection.pipeline() as pipeline:
+            futures = [pipeline.submit('stat', fileid=n) for n in range(3)]
+        self.assertEqual(futures[0].result()['n'], 1)
+        self.assertRaises(ValueError, futures[1].result)
+        self.assertEqual(futures[2].result()['n'], 3)
+        # and the pipeline is still usable
+        self.assertIsNone(pipeline._error)
+
+    def test_broken_stream(self):
+        # the second reply is cut short
+        connection = connection_reading(frame({'result': 0}) +
+                                        frame({'result': 0})[:6])
+        pipeline = connection.pipeline()
+        futures = [pipeline.submit('stat', fileid=n) for n in range(3)]
+        pipeline.flush()
+        self.assertEqual(futures[0].result(), {'result': 0})
+        self.assertRaises(IOError, futures[1].result)
+        self.assertRaises(IOError, futures[2].result)
+        self.assertRaises(IOError, pipeline.submit, 'stat', fileid=3)
+
+    def test_connection_reconnected_after_broken_stream(self):
+        connection = connection_reading(frame({'result': 0})[:6])
+        reconnects = []
+
+        def connect():
+            reconnects.append(connection.fp)
+            connection.fp = PCloudBuffer(io.BytesIO(frame({'result': 1})),
+                                         io.BytesIO(), 8192)
+            connection._broken = False
+            return connection
+        connection.connect = connect
+        with connection.pipeline() as pipeline:
+            future = pipeline.submit('stat', fileid=1)
+        self.assertRaises(IOError, future.result)
+        # the rest of the cut reply is not taken for the next one
+        self.assertEqual(connection.send_command('stat', fileid=2),
+                         {'result': 1})
+        self.assertEqual(len(reconnects), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+
+import threading
+import time
+import unittest
+
+from pcloudapi import PCloudConnectionPool
+
+
+class _FakeConnection(object):
+    """Counts its commands, fails on 'fail' and lists two entries."""
+
+    created = []
+
+    def __init__(self, persistent_params=None, **kwargs):
+        self.persistent_params = persistent_params
+        self.kwargs = kwargs
+        self.closed = False
+        self.commands = 0
+        self.drained = False
+        _FakeConnection.created.append(self)
+
+    def connect(self):
+        return self
+
+    def close(self):
+        self.closed = True
+
+    def send_command(self, method, **params):
+        self.commands += 1
+        if method == 'fail':
+            raise IOError("connection reset")
+        if method == 'file_read':
+            return {'result': 0, 'data': 10}
+        return {'result': 0}
+
+    def iter_listfolder(self, **params):
+        try:
+            yield {'path': '/'}
+            yield {'path': '/a'}
+        finally:
+            self.drained = True
+
+
+class PoolTest(unittest.TestCase):
+
+    def setUp(self):
+        del _FakeConnection.created[:]
+
+    def pool(self, **kwargs):
+        return PCloudConnectionPool(connection=_FakeConnection, **kwargs)
+
+    def test_connections_are_reused(self):
+        pool = self.pool(auth='token', use_ssl=False)
+        pool.send_command('stat')
+        pool.send_command('stat')
+        self.assertEqual(len(_FakeConnection.created), 1)
+        connection = _FakeConnection.created[0]
+        self.assertEqual(connection.commands, 2)
+        self.assertEqual(connection.persistent_params, {'auth': 'token'})
+        self.assertEqual(connection.kwargs, {'use_ssl': False})
+        self.assertEqual((pool.size, pool.idle_size), (1, 1))
+
+    def test_failed_connection_is_discarded(self):
+        pool = self.pool()
+        with self.assertRaises(IOError):
+            pool.send_command('fail')
+        self.assertTrue(_FakeConnection.created[0].closed)
+        self.assertEqual(pool.size, 0)
+        pool.send_command('stat')
+        self.assertEqual(len(_FakeConnection.created), 2)
+
+    def test_unconsumed_data_discards(self):
+        pool = self.pool()
+        pool.send_command('file_read', fd=1, count=10)
+        self.assertTrue(_FakeConnection.created[0].closed)
+        self.assertEqual(pool.size, 0)
+
+    def test_block_raising_discards(self):
+        pool = self.pool()
+        with self.assertRaises(ValueError):
+            with pool.connection():
+                raise ValueError("out of sync")
+        self.assertTrue(_FakeConnection.created[0].closed)
+        self.assertEqual(pool.size, 0)
+
+    def test_listfolder_closed_early_keeps_connection(self):
+        pool = self.pool()
+        entries = pool.iter_listfolder(path='/')
+        self.assertEqual(next(entries), {'path': '/'})
+        entries.close()
+        connection = _FakeConnection.created[0]
+        self.assertTrue(connection.drained)
+        self.assertFalse(connection.closed)
+        self.assertEqual((pool.size, pool.idle_size), (1, 1))
+
+    def test_generator_closed_early_discards(self):
+        pool = self.pool()
+
+        def replies():
+            with pool.connection() as connection:
+                connection.send_command('stat', _noresult=True)
+                yield # closed before the reply is read
+                connection.send_command('stat')
+        generator = replies()
+        next(generator)
+        generator.close()
+        self.assertTrue(_FakeConnection.created[0].closed)
+        self.assertEqual(pool.size, 0)
+
+    def test_max_size_waits(self):
+        pool = self.pool(max_size=1, wait_timeout=0.05)
+        connection = pool.acquire()
+        with self.assertRaises(TimeoutError):
+            pool.acquire()
+        threading.Timer(0.01, pool.release, (connection,)).start()
+        pool.wait_timeout = 5
+        self.assertIs(pool.acquire(), connection)
+
+    def test_idle_connections_evicted(self):
+        pool = self.pool(min_size=1, idle_timeout=0.01).connect()
+        first = pool.acquire()
+        second = pool.acquire()
+        pool.release(first)
+        pool.release(second)
+        time.sleep(0.02)
+        pool.send_command('stat')
+        # the oldest is closed, min_size are kept
+        self.assertTrue(first.closed)
+        self.assertFalse(second.closed)
+        self.assertEqual(pool.size, 1)
+
+    def test_unhealthy_connection_replaced(self):
+        pool = self.pool(health_check=lambda connection: False)
+        pool.send_command('stat')
+        pool.send_command('stat')
+        self.assertEqual(len(_FakeConnection.created), 2)
+        self.assertTrue(_FakeConnection.created[0].closed)
+        self.assertEqual(pool.size, 1)
+
+    def test_closed_pool(self):
+        pool = self.pool()
+        pool.send_command('stat')
+        pool.close()
+        self.assertTrue(_FakeConnection.created[0].closed)
+        with self.assertRaises(ValueError):
+            pool.send_command('stat')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+
+import collections
+import os
+import unittest
+
+from pcloudapi import PCloudException
+from pcloudapi.pipeline import PCloudPipeline
+from pcloudapi.remotefile import PCloudRemoteFile
+
+
+class _FakeFileConnection(object):
+    """Serves file_* commands on content, directly and pipelined."""
+
+    def __init__(self, content, size=None, size_result=0):
+        self.content = content
+        self.size = len(content) if size is None else size
+        self.size_result = size_result
+        self.preads = [] # (offset, count)
+        self.closed_fds = []
+        self._replies = collections.deque()
+        self._data = None
+
+    def _answer(self, method, params):
+        if method == 'file_open':
+            return {'result': 0, 'fd': 3}, None
+        if method == 'file_size':
+            return {'result': self.size_result, 'size': self.size}, None
+        if method == 'file_close':
+            self.closed_fds.append(params['fd'])
+            return {'result': 0}, None
+        if method == 'file_pread':
+            self.preads.append((params['offset'], params['count']))
+            data = self.content[params['offset']:
+                                params['offset'] + params['count']]
+            return {'result': 0, 'data': len(data)}, data
+        raise AssertionError(method)
+
+    def send_command(self, method, **params):
+        response, self._data = self._answer(method, params)
+        return response
+
+    def send_command_nb(self, method, params, data=None,
+                        data_progress_callback=None):
+        self._replies.append(self._answer(method, params))
+
+    def _read_frame(self):
+        response, self._data = self._replies.popleft()
+        return response
+
+    def _decode_frame(self, frame):
+        return dict(frame)
+
+    def read_data(self, data_len, buffer=None):
+        data, self._data = self._data, None
+        assert len(data) == data_len
+        if buffer is not None:
+            buffer[:data_len] = data
+            return memoryview(buffer)[:data_len]
+        return data
+
+    def pipeline(self, max_in_flight=32, check_result=False,
+                 instrumentation=None):
+        return PCloudPipeline(self, max_in_flight, check_result,
+                              instrumentation)
+
+
+class _FakeAPI(object):
+
+    def __init__(self, connection):
+        self.connection = connection
+
+
+class RemoteFileTest(unittest.TestCase):
+
+    CONTENT = os.urandom(10000)
+
+    def open(self, connection, **kwargs):
+        kwargs.setdefault('block_size', 100)
+        kwargs.setdefault('cache_blocks', 8)
+        return PCloudRemoteFile(_FakeAPI(connection), path='/f', **kwargs)
+
+    def test_failed_open_closes_the_fd(self):
+        connection = _FakeFileConnection(self.CONTENT, size_result=2009)
+        with self.assertRaises(PCloudException):
+            self.open(connection)
+        self.assertEqual(connection.closed_fds, [3])
+
+    def test_reads_and_cache_hits(self):
+        connection = _FakeFileConnection(self.CONTENT)
+        with self.open(connection, max_read_ahead=0) as f:
+            f.seek(250)
+            self.assertEqual(f.read(100), self.CONTENT[250:350])
+            self.assertEqual(connection.preads, [(200, 200)])
+            f.seek(260)
+            self.assertEqual(f.read(50), self.CONTENT[260:310])
+            self.assertEqual(f.hits, 1)
+            self.assertEqual(len(connection.preads), 1)
+        self.assertEqual(connection.closed_fds, [3])
+
+    def test_sequential_reads_grow_read_ahead(self):
+        connection = _FakeFileConnection(self.CONTENT)
+        with self.open(connection, max_read_ahead=400) as f:
+            data = b''.join(iter(lambda: f.read(100), b''))
+        self.assertEqual(data, self.CONTENT)
+        self.assertLess(len(connection.preads), 100 // 2)
+
+    def test_read_larger_than_cache_in_blocks(self):
+        connection = _FakeFileConnection(self.CONTENT)
+        with self.open(connection) as f:
+            f.seek(50)
+            self.assertEqual(f.read(2000), self.CONTENT[50:2050])
+        self.assertEqual(len(connection.preads), 20)
+        self.assertTrue(all(count <= 100 for _, count in connection.preads))
+
+    def test_short_read(self):
+        # truncated after it was opened
+        connection = _FakeFileConnection(self.CONTENT[:650], size=1000)
+        with self.open(connection) as f:
+            self.assertEqual(f.read(400), self.CONTENT[:400])
+            self.assertEqual(f.read(400), self.CONTENT[400:650])
+            self.assertEqual(f.tell(), 650)
+
+    def test_short_uncached_read(self):
+        connection = _FakeFileConnection(self.CONTENT[:1234], size=5000)
+        with self.open(connection) as f:
+            self.assertEqual(f.read(5000), self.CONTENT[:1234])
+            self.assertEqual(f.tell(), 1234)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+
+import io
+import socket
+import threading
+import unittest
+
+import requests
+
+from pcloudapi import PCloudAPI, PCloudRetryPolicy
+from pcloudapi.connection import AbstractPCloudConnection
+from pcloudapi.pcloudbin import PCloudBinaryConnection
+from pcloudapi.retry import RetryBudget
+
+from .test_pcloudbin import decode_request, frame
+
+
+class _FakeConnection(AbstractPCloudConnection):
+    """Answers (or raises) the outcomes in order, the last one forever."""
+
+    def __init__(self, *outcomes):
+        self.persistent_params = {}
+        self.outcomes = list(outcomes)
+        self.sent = []
+        self.reconnects = 0
+
+    def send_command(self, method, **params):
+        data = params.get('_data')
+        self.sent.append(data.read() if data is not None else method)
+        outcome = self.outcomes.pop(0) if len(self.outcomes) > 1 \
+                  else self.outcomes[0]
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    def reconnect(self):
+        self.reconnects += 1
+        return self
+
+
+def _http_error(status_code):
+    response = requests.Response()
+    response.status_code = status_code
+    return requests.HTTPError(response=response)
+
+
+OK = {'result': 0}
+BUSY = {'result': 5000}
+
+
+class RetryPolicyTest(unittest.TestCase):
+
+    def policy(self, **kwargs):
+        kwargs.setdefault('budget', None)
+        return PCloudRetryPolicy(min_backoff=0, **kwargs)
+
+    def test_retry_codes_of_idempotent_methods(self):
+        connection = _FakeConnection(BUSY, BUSY, OK)
+        self.assertEqual(self.policy().send_command(connection, 'stat', {}),
+                         OK)
+        self.assertEqual(len(connection.sent), 3)
+        self.assertEqual(connection.reconnects, 0)
+
+    def test_retries_exhausted_return_the_response(self):
+        connection = _FakeConnection(BUSY)
+        self.assertEqual(self.policy(retries=2).send_command(
+                                connection, 'stat', {}), BUSY)
+        self.assertEqual(len(connection.sent), 3)
+
+    def test_not_idempotent_is_not_retried(self):
+        connection = _FakeConnection(IOError("reset"), OK)
+        with self.assertRaises(IOError):
+            self.policy().send_command(connection, 'deletefile', {})
+        self.assertEqual(len(connection.sent), 1)
+        # nothing retried, the file descriptors stay open
+        self.assertEqual(connection.reconnects, 0)
+
+    def test_reconnects_before_retrying(self):
+        connection = _FakeConnection(IOError("reset"), OK)
+        self.assertEqual(self.policy().send_command(connection, 'stat', {}),
+                         OK)
+        self.assertEqual(connection.reconnects, 1)
+
+    def test_fd_commands_are_not_retried_after_a_failure(self):
+        connection = _FakeConnection(IOError("reset"), OK)
+        with self.assertRaises(IOError):
+            self.policy().send_command(connection, 'file_pread',
+                                       {'fd': 1, 'count': 1, 'offset': 0})
+        self.assertEqual(connection.reconnects, 0)
+
+    def test_client_errors_are_not_retried(self):
+        connection = _FakeConnection(_http_error(404), OK)
+        with self.assertRaises(requests.HTTPError):
+            self.policy().send_command(connection, 'stat', {})
+        self.assertEqual(len(connection.sent), 1)
+
+    def test_server_errors_are_retried(self):
+        connection = _FakeConnection(_http_error(502), OK)
+        self.assertEqual(self.policy().send_command(connection, 'stat', {}),
+                         OK)
+
+    def test_data_is_rewound(self):
+        connection = _FakeConnection(IOError("reset"), OK)
+        data = io.BytesIO(b'chunk')
+        self.policy().send_command(connection, 'upload_write',
+                                   {'uploadid': 1, 'uploadoffset': 0,
+                                    '_data': data})
+        self.assertEqual(connection.sent, [b'chunk', b'chunk'])
+
+    def test_rule_overrides(self):
+        connection = _FakeConnection(BUSY, OK)
+        policy = self.policy(rule=lambda method, *args: method == 'copyfile')
+        self.assertEqual(policy.send_command(connection, 'copyfile', {}), OK)
+        connection = _FakeConnection(BUSY, OK)
+        self.assertEqual(policy.send_command(connection, 'stat', {}), BUSY)
+
+    def test_budget_limits_the_retries(self):
+        connection = _FakeConnection(BUSY)
+        policy = self.policy(budget=RetryBudget(ratio=0, reserve=1))
+        policy.send_command(connection, 'stat', {})
+        self.assertEqual(len(connection.sent), 2)
+
+
+class RetryBudgetTest(unittest.TestCase):
+
+    def test_deposits_refill_up_to_reserve(self):
+        budget = RetryBudget(ratio=0.5, reserve=1)
+        self.assertTrue(budget.withdraw())
+        self.assertFalse(budget.withdraw())
+        budget.deposit()
+        self.assertFalse(budget.withdraw())
+        for _ in range(10):
+            budget.deposit()
+        self.assertTrue(budget.withdraw())
+        self.assertFalse(budget.withdraw())
+
+
+class _DroppingServer(object):
+    """Serves binary connections on 127.0.0.1 in threads, closing the
+    first drop of them after reading a request and answering result 0
+    on the others, the methods received go to .methods.
+    """
+
+    def __init__(self, test, drop=1):
+        self.drop = drop
+        self.methods = []
+        self.listener = socket.create_server(('127.0.0.1', 0))
+        self.port = self.listener.getsockname()[1]
+        self.thread = threading.Thread(target=self._serve)
+        self.thread.start()
+        test.addCleanup(self.thread.join)
+        test.addCleanup(self.listener.close)
+        test.addCleanup(self.listener.shutdown, socket.SHUT_RDWR)
+
+    def _serve(self):
+        while True:
+            try:
+                sock, _ = self.listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._handle, args=(sock,),
+                             daemon=True).start()
+
+    def _handle(self, sock):
+        with sock, sock.makefile('rwb') as f:
+            while True:
+                length = f.read(2)
+                if len(length) < 2:
+                    return
+                method, _, _ = decode_request(
+                        f.read(int.from_bytes(length, 'little')))
+                self.methods.append(method)
+                if self.drop:
+                    self.drop -= 1
+                    return
+                f.write(frame({'result': 0}))
+                f.flush()
+
+
+class ReconnectTest(unittest.TestCase):
+
+    def test_reconnects_after_a_command_that_is_not_retried(self):
+        server = _DroppingServer(self)
+        connection = PCloudBinaryConnection(use_ssl=False,
+                                            server='127.0.0.1',
+                                            port=server.port).connect()
+        self.addCleanup(connection.close)
+        api = PCloudAPI(connection=connection, retry_policy=True)
+        with self.assertRaises(IOError):
+            api.deletefile(fileid=1)
+        self.assertEqual(api.renamefile(fileid=2, toname='b')['result'], 0)
+        self.assertEqual(api.copyfile(fileid=2, topath='/c')['result'], 0)
+        self.assertEqual(server.methods,
+                         ['deletefile', 'renamefile', 'copyfile'])
+
+
+class ApiRetryTest(unittest.TestCase):
+
+    def test_not_retried_by_default(self):
+        connection = _FakeConnection(BUSY, OK)
+        api = PCloudAPI(connection=connection)
+        self.assertIsNone(api.retry_policy)
+        self.assertEqual(api.make_request('stat', check_result=False), BUSY)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+
+import unittest
+
+from pcloudapi import PCloudBinaryConnection, PCloudConnectionPool, \
+    PCloudTransport
+from pcloudapi.subscription import PCloudSubscription, _binary_settings
+
+
+class _FakeConnection(object):
+    """Answers blocking diffs with the batches, then stops the feed."""
+
+    def __init__(self, subscription, batches):
+        self.subscription = subscription
+        self.batches = list(batches)
+        self.requests = []
+
+    def send_command(self, method, **params):
+        self.requests.append(params)
+        if not self.batches:
+            self.subscription._stopped.set()
+            return {'result': 0, 'diffid': params['diffid'], 'entries': []}
+        entries = self.batches.pop(0)
+        return {'result': 0, 'diffid': entries[-1]['diffid'],
+                'entries': entries}
+
+    def close(self):
+        pass
+
+
+def _subscription(callback, batches, **kwargs):
+    subscription = PCloudSubscription(api=None, callback=callback, diffid=10,
+                                      min_backoff=0, **kwargs)
+    connection = _FakeConnection(subscription, batches)
+    subscription.connection_factory = lambda: connection
+    return subscription, connection
+
+
+class SubscriptionTest(unittest.TestCase):
+
+    BATCHES = [[{'event': 'createfile', 'diffid': 11}],
+               [{'event': 'deletefile', 'diffid': 12}]]
+
+    def test_callback_raising_keeps_the_batch(self):
+        def callback(entries, diffid):
+            raise RuntimeError("failed")
+        subscription, connection = _subscription(callback, self.BATCHES)
+        with self.assertRaises(RuntimeError):
+            subscription.run()
+        self.assertEqual(subscription.diffid, 10)
+        self.assertIsInstance(subscription.error, RuntimeError)
+        self.assertTrue(subscription.stopped)
+
+    def test_on_error_gets_the_batch_again(self):
+        delivered = []
+        errors = []
+
+        def callback(entries, diffid):
+            delivered.append(diffid)
+            if len(delivered) == 1:
+                raise RuntimeError("failed once")
+        subscription, connection = _subscription(callback, self.BATCHES,
+                                                 on_error=errors.append)
+        connection.batches.insert(0, self.BATCHES[0]) # answered again
+        subscription.run()
+        self.assertEqual(delivered, [11, 11, 12])
+        self.assertEqual([str(e) for e in errors], ["failed once"])
+        self.assertEqual(subscription.diffid, 12)
+        self.assertIsNone(subscription.error)
+
+    def test_on_error_raising_stops(self):
+        def on_error(error):
+            raise ValueError("give up")
+
+        def callback(entries, diffid):
+            raise RuntimeError("failed")
+        subscription, connection = _subscription(callback, self.BATCHES,
+                                                 on_error=on_error)
+        subscription.start()
+        subscription._thread.join(5)
+        self.assertFalse(subscription._thread.is_alive())
+        self.assertIsInstance(subscription.error, ValueError)
+        self.assertTrue(subscription.stopped)
+        self.assertEqual(subscription.diffid, 10)
+
+    def test_delivered_batches_advance(self):
+        delivered = []
+        subscription, connection = _subscription(
+                    lambda entries, diffid: delivered.append(diffid),
+                    self.BATCHES)
+        subscription.run()
+        self.assertEqual(delivered, [11, 12])
+        self.assertEqual(subscription.diffid, 12)
+        self.assertEqual([request['diffid'] for request in connection.requests],
+                         [10, 11, 12])
+
+
+class BinarySettingsTest(unittest.TestCase):
+
+    def test_connection(self):
+        transport = PCloudTransport()
+        endpoints = object()
+        connection = PCloudBinaryConnection(server=['eu1', 'eu2'], port=8443,
+                                            transport=transport,
+                                            endpoints=endpoints)
+        self.assertEqual(_binary_settings(connection),
+                         {'server': ['eu1', 'eu2'], 'port': 8443,
+                          'transport': transport, 'endpoints': endpoints})
+
+    def test_pool(self):
+        pool = PCloudConnectionPool(server='eu1', port=8443, timeout=5)
+        self.assertEqual(_binary_settings(pool),
+                         {'server': 'eu1', 'port': 8443})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+import socket
+import threading
+import unittest
+
+from pcloudapi import PCloudTransport
+
+from .test_pcloudbin import tls_contexts
+
+
+class _Server(object):
+    """Accepts connections on 127.0.0.1 in a thread, over TLS if
+    server_context is given, greeting each with a byte and then
+    waiting for it to be closed.
+    """
+
+    def __init__(self, test, server_context=None):
+        self.server_context = server_context
+        self.listener = socket.create_server(('127.0.0.1', 0))
+        self.port = self.listener.getsockname()[1]
+        self.errors = []
+        self.thread = threading.Thread(target=self._serve)
+        self.thread.start()
+        test.addCleanup(self.thread.join)
+        test.addCleanup(self.listener.close)
+        test.addCleanup(self.listener.shutdown, socket.SHUT_RDWR)
+
+    def _serve(self):
+        while True:
+            try:
+                sock, _ = self.listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._handle, args=(sock,)).start()
+
+    def _handle(self, sock):
+        try:
+            if self.server_context is not None:
+                sock = self.server_context.wrap_socket(sock, server_side=True)
+            with sock:
+                sock.sendall(b'x')
+                while sock.recv(4096):
+                    pass
+        except OSError as e:
+            self.errors.append(e)
+
+
+class TransportOptionsTest(unittest.TestCase):
+
+    def test_socket_options(self):
+        server = _Server(self)
+        transport = PCloudTransport(keepalive=60, send_buffer_size=65536)
+        with transport.connect('127.0.0.1', server.port, timeout=5) as sock:
+            self.assertTrue(sock.getsockopt(socket.IPPROTO_TCP,
+                                            socket.TCP_NODELAY))
+            self.assertTrue(sock.getsockopt(socket.SOL_SOCKET,
+                                            socket.SO_KEEPALIVE))
+            self.assertGreaterEqual(sock.getsockopt(socket.SOL_SOCKET,
+                                                    socket.SO_SNDBUF), 65536)
+            self.assertEqual(sock.gettimeout(), 5)
+            self.assertEqual(sock.recv(1), b'x')
+
+    def test_next_address_after_refused(self):
+        server = _Server(self)
+        closed = socket.socket()
+        closed.bind(('127.0.0.1', 0))
+        refused = closed.getsockname()
+        closed.close()
+        addresses = [(socket.AF_INET, socket.SOCK_STREAM, 0, '', address)
+                     for address in (refused, ('127.0.0.1', server.port))]
+        for delay in (None, 10):
+            transport = PCloudTransport(happy_eyeballs_delay=delay)
+            with transport._connect_any(addresses, 5) as sock:
+                self.assertEqual(sock.getpeername()[1], server.port)
+
+
+@unittest.skipIf(tls_contexts() is None, "openssl is missing")
+class TransportTLSTest(unittest.TestCase):
+
+    def setUp(self):
+        server_context, self.client_context = tls_contexts()
+        self.server = _Server(self, server_context)
+
+    def connect(self, transport):
+        """Returns whether the connection resumed a session."""
+        sock = transport.connect('127.0.0.1', self.server.port,
+                                 timeout=5, use_ssl=True)
+        # the TLS 1.3 tickets arrive with the first data
+        self.assertEqual(sock.recv(1), b'x')
+        transport.save_session(sock, '127.0.0.1', self.server.port)
+        reused = sock.session_reused
+        sock.close()
+        return reused
+
+    def test_session_resumed(self):
+        transport = PCloudTransport(ssl_context=self.client_context)
+        self.assertFalse(self.connect(transport))
+        self.assertTrue(self.connect(transport))
+        self.assertEqual(self.server.errors, [])
+
+    def test_session_reuse_disabled(self):
+        transport = PCloudTransport(ssl_context=self.client_context,
+                                    session_reuse=False)
+        self.connect(transport)
+        self.assertFalse(self.connect(transport))
+
+    def test_default_context_created_once(self):
+        transport = PCloudTransport()
+        self.assertIs(transport.ssl_context, transport.ssl_context)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+import os
+import tempfile
+import unittest
+
+from pcloudapi import PCloudException, PCloudRetryPolicy
+from pcloudapi.upload import PCloudChunkedUploader
+
+
+class _FakeConnection(object):
+    """Answers (or raises) failures for the first upload_writes."""
+
+    def __init__(self, *failures):
+        self.failures = list(failures)
+        self.written = []
+        self.reconnects = 0
+
+    def send_command(self, method, **params):
+        if self.failures:
+            failure = self.failures.pop(0)
+            if isinstance(failure, Exception):
+                raise failure
+            return {'result': failure}
+        self.written.append((params['uploadoffset'], params['_data']))
+        return {'result': 0}
+
+    def reconnect(self):
+        self.reconnects += 1
+        return self
+
+
+class _FakeAPI(object):
+
+    def __init__(self, *failures):
+        self.connection = _FakeConnection(*failures)
+        self.instrumentation = None
+
+    def make_request(self, method, **params):
+        return {'result': 0, 'uploadid': 1}
+
+
+class ChunkedUploaderTest(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.write(fd, b'0123456789')
+        os.close(fd)
+        self.addCleanup(os.remove, self.path)
+
+    def upload(self, api):
+        uploader = PCloudChunkedUploader(api, self.path, '/f', chunk_size=4,
+                                         session_path=False)
+        uploader.retry_policy = PCloudRetryPolicy(min_backoff=0, budget=None)
+        return uploader.upload()
+
+    def test_reconnects_before_retrying(self):
+        api = _FakeAPI(IOError("connection reset"))
+        self.upload(api)
+        self.assertEqual(api.connection.reconnects, 1)
+        self.assertEqual(api.connection.written,
+                         [(0, b'0123'), (4, b'4567'), (8, b'89')])
+
+    def test_retries_try_again_later(self):
+        api = _FakeAPI(5000, 5001)
+        self.upload(api)
+        self.assertEqual(len(api.connection.written), 3)
+
+    def test_other_errors_are_not_retried(self):
+        api = _FakeAPI(2008) # over quota
+        with self.assertRaises(PCloudException) as cm:
+            self.upload(api)
+        self.assertEqual(cm.exception.result_code, 2008)
+        self.assertEqual(api.connection.written, [])
+
+    def test_concurrent_requires_pool(self):
+        with self.assertRaises(ValueError):
+            PCloudChunkedUploader(_FakeAPI(), self.path, '/f', connections=2)
+
+
+if __name__ == '__main__':
+    unittest.main()